@@ -0,0 +1,277 @@
+"""
+Benchmarks of the hot paths of a test suite: building Behaviors, running them (split between 'predict_fn' and the
+construction of the outputs), computing the success of the outputs, fitting a Performer and generating samples.
+Behaviors are synthetic and predicted by dummy functions, so that only the library is measured.
+
+    python -m benchmarks.run --samples 1000 100000 --output results.json
+    python -m benchmarks.run --samples 1000 100000 --compare results.json
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+from tabulate import tabulate
+
+from nhelper.behavior import SequenceClassificationBehavior, SpanClassificationBehavior, \
+    TokenClassificationBehavior
+from nhelper.generator import Generator
+from nhelper.performers import Performer
+from nhelper.profiling import TimedPredictFn
+from nhelper.types import BehaviorType
+
+# scenario name -> function running the scenario on a number of samples
+SCENARIOS = {}
+
+
+def scenario(name: str) -> Callable:
+    """Registers a benchmark scenario"""
+
+    def register(fn: Callable) -> Callable:
+        SCENARIOS[name] = fn
+        return fn
+
+    return register
+
+
+class Phases(object):
+    """Wall time, CPU time and (optionally) peak traced memory of the phases of a scenario"""
+
+    def __init__(self, trace_memory: bool = False):
+        """
+        :param trace_memory: whether to trace the peak memory allocated in each phase, which slows it down
+        """
+        self.trace_memory = trace_memory
+        self.timings = {}
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Times a phase, the peak memory being measured from its start, whether tracing was already on or not"""
+        started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        elif self.trace_memory:
+            tracemalloc.reset_peak()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            timing = {"wall": time.perf_counter() - wall, "cpu": time.process_time() - cpu}
+            if self.trace_memory:
+                timing["peak_memory"] = tracemalloc.get_traced_memory()[1]
+            if started_tracing:
+                tracemalloc.stop()
+            self.timings[name] = timing
+
+    def add(self, name: str, wall: float) -> None:
+        """Records a phase timed outside of 'phase', e.g. nested in another one"""
+        self.timings[name] = {"wall": wall}
+
+
+def synthetic_texts(n_samples: int, n_words: int) -> List[str]:
+    """Distinct texts of 'n_words' words"""
+    filler = " ".join(["word"] * (n_words - 1))
+    return [f"{i} {filler}" for i in range(n_samples)]
+
+
+def run_behavior(phases: Phases, behavior_fn: Callable, predict_fn: Callable, performer: Performer,
+                 batch_size: Optional[int]) -> None:
+    """Times the phases shared by the Behavior scenarios"""
+    predict_fn = TimedPredictFn(predict_fn)
+    with phases.phase("build"):
+        behavior = behavior_fn(predict_fn)
+    with phases.phase("run"):
+        behavior.run(batch_size=batch_size)
+    phases.add("predict", predict_fn.wall)
+    phases.add("outputs", phases.timings["run"]["wall"] - predict_fn.wall)
+    with phases.phase("success"):
+        behavior.outputs.success()
+    with phases.phase("fit"):
+        performer.fit([behavior])
+
+
+@scenario("sequence")
+def sequence_scenario(phases: Phases, n_samples: int, batch_size: Optional[int], n_words: int, **kwargs) -> None:
+    """Sequence classification Behavior"""
+    texts = synthetic_texts(n_samples, n_words)
+    labels = list(np.arange(n_samples) % 3)
+
+    run_behavior(
+        phases,
+        lambda predict_fn: SequenceClassificationBehavior(
+            capability="Benchmark", name="Sequence", test_type=BehaviorType.minimum_functionality, samples=texts,
+            labels=labels, predict_fn=predict_fn
+        ),
+        lambda batch: [(len(text) % 3, 0.9) for text in batch],
+        Performer(confidence_weighted=True),
+        batch_size
+    )
+
+
+@scenario("span")
+def span_scenario(phases: Phases, n_samples: int, batch_size: Optional[int], n_spans: int, **kwargs) -> None:
+    """Span classification Behavior with 'n_spans' dense spans per sample"""
+    texts = synthetic_texts(n_samples, 2 * n_spans)
+    labels = [[{"start": 4 * j, "end": 4 * j + 3, "label": j % 3} for j in range(n_spans)]] * n_samples
+
+    # one span out of four predicted with the wrong label
+    predictions = [(4 * j, 4 * j + 3, None, None, j % 3 if j % 4 else 3) for j in range(n_spans)]
+    run_behavior(
+        phases,
+        lambda predict_fn: SpanClassificationBehavior(
+            capability="Benchmark", name="Span", test_type=BehaviorType.minimum_functionality, samples=texts,
+            labels=labels, predict_fn=predict_fn
+        ),
+        lambda batch: [predictions] * len(batch),
+        Performer(span_match="overlap"),
+        batch_size
+    )
+
+
+@scenario("token")
+def token_scenario(phases: Phases, n_samples: int, batch_size: Optional[int], n_tokens: int, **kwargs) -> None:
+    """Token classification Behavior of sequences of 'n_tokens' tokens"""
+    texts = synthetic_texts(n_samples, n_tokens)
+    labels = [[(i // 3) % 2 for i in range(n_tokens)]] * n_samples
+
+    predictions = [(i // 4) % 2 for i in range(n_tokens)]
+    run_behavior(
+        phases,
+        lambda predict_fn: TokenClassificationBehavior(
+            capability="Benchmark", name="Token", test_type=BehaviorType.minimum_functionality, samples=texts,
+            labels=labels, predict_fn=predict_fn
+        ),
+        lambda batch: [predictions] * len(batch),
+        Performer(token_metrics=True),
+        batch_size
+    )
+
+
+@scenario("generate")
+def generate_scenario(phases: Phases, n_samples: int, **kwargs) -> None:
+    """Generation of every combination of two keywords, 'n_samples' in total"""
+    n_first = max(int(np.sqrt(n_samples)), 1)
+    keywords = {
+        "first": [f"first{i}" for i in range(n_first)],
+        "second": [f"second{i}" for i in range(max(n_samples // n_first, 1))]
+    }
+    with phases.phase("generate"):
+        Generator.generate("My {first} is not your {second}.", generate_all=True, **keywords)
+    with phases.phase("generate_pos"):
+        Generator.generate("My {first} is not your {second}.", generate_all=True, return_pos=True, **keywords)
+
+
+def run_benchmarks(scenarios: List[str], sizes: List[int], repeat: int = 1, trace_memory: bool = False,
+                   batch_size: Optional[int] = 1024, n_words: int = 16, n_spans: int = 8,
+                   n_tokens: int = 128) -> Dict[str, Any]:
+    """
+    :param scenarios: names of the scenarios to run
+    :param sizes: numbers of samples each scenario is run on
+    :param repeat: number of runs of each scenario, the fastest being kept
+    :param trace_memory: whether to also measure the peak memory of each phase, in a separate run
+    :param batch_size: maximum number of samples per call to the prediction functions
+    :param n_words: number of words of the samples of the sequence classification Behavior
+    :param n_spans: number of spans per sample of the span classification Behavior
+    :param n_tokens: number of tokens per sample of the token classification Behavior
+    :return: environment and results of the benchmarks
+    """
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise ValueError(f"Unknown scenarios {sorted(unknown)}, expected some of {list(SCENARIOS)}.")
+    params = {"batch_size": batch_size, "n_words": n_words, "n_spans": n_spans, "n_tokens": n_tokens}
+
+    results = []
+    for name in scenarios:
+        for n_samples in sizes:
+            runs = []
+            for _ in range(repeat):
+                phases = Phases()
+                SCENARIOS[name](phases, n_samples, **params)
+                runs.append(phases.timings)
+            timings = {phase: min((run[phase] for run in runs), key=lambda timing: timing["wall"])
+                       for phase in runs[0]}
+
+            if trace_memory:
+                phases = Phases(trace_memory=True)
+                SCENARIOS[name](phases, n_samples, **params)
+                for phase, timing in phases.timings.items():
+                    if "peak_memory" in timing:
+                        timings[phase]["peak_memory"] = timing["peak_memory"]
+
+            main_phase = "run" if "run" in timings else next(iter(timings))
+            results.append({
+                "scenario": name,
+                "n_samples": n_samples,
+                "throughput": n_samples / timings[main_phase]["wall"] if timings[main_phase]["wall"] else None,
+                "phases": timings
+            })
+
+    return {"environment": environment(), "params": params, "results": results}
+
+
+def environment() -> Dict[str, str]:
+    """Versions the results depend on"""
+    import nhelper
+    return {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "numpy": np.__version__,
+        "nhelper": getattr(nhelper, "__version__", "unknown")
+    }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any]) -> str:
+    """Tabulates the wall time of every phase against a baseline, a ratio above 1 being a slowdown"""
+    baseline_timings = {
+        (result["scenario"], result["n_samples"], phase): timing["wall"]
+        for result in baseline["results"] for phase, timing in result["phases"].items()
+    }
+    rows = []
+    for result in results["results"]:
+        for phase, timing in result["phases"].items():
+            reference = baseline_timings.get((result["scenario"], result["n_samples"], phase))
+            ratio = timing["wall"] / reference if reference else None
+            rows.append([result["scenario"], result["n_samples"], phase, reference, timing["wall"], ratio])
+    return tabulate(rows, headers=["Scenario", "Samples", "Phase", "Baseline (s)", "Wall (s)", "Ratio"])
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """"""
+    parser = argparse.ArgumentParser(description="Benchmarks of the Behavior, Performer and Generator hot paths.")
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--samples", nargs="+", type=int, default=[1000],
+                        help="numbers of samples each scenario is run on")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each scenario, the fastest being kept")
+    parser.add_argument("--memory", action="store_true", help="also measure the peak memory of each phase")
+    parser.add_argument("--batch-size", type=int, default=1024)
+    parser.add_argument("--n-words", type=int, default=16)
+    parser.add_argument("--n-spans", type=int, default=8)
+    parser.add_argument("--n-tokens", type=int, default=128)
+    parser.add_argument("--output", help="file the JSON results are written to")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare against")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.scenarios, args.samples, repeat=args.repeat, trace_memory=args.memory,
+                             batch_size=args.batch_size, n_words=args.n_words, n_spans=args.n_spans,
+                             n_tokens=args.n_tokens)
+    if args.output:
+        with open(args.output, "w") as writer:
+            json.dump(results, writer, indent=2)
+
+    if args.compare:
+        with open(args.compare) as reader:
+            print(compare(results, json.load(reader)))
+    else:
+        rows = [[result["scenario"], result["n_samples"], phase, timing["wall"], timing.get("cpu"),
+                 timing.get("peak_memory")]
+                for result in results["results"] for phase, timing in result["phases"].items()]
+        print(tabulate(rows, headers=["Scenario", "Samples", "Phase", "Wall (s)", "CPU (s)", "Peak memory (B)"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,40 @@
+import asyncio
+import hashlib
 import os
 import pickle
-from copy import deepcopy
+from collections import deque
+from collections.abc import Sequence, Sized
+from copy import copy
+from functools import partial
 from pathlib import Path
-from typing import List, Union, Callable, Optional, Any
+from typing import Deque, Iterable, Iterator, List, Tuple, Union, Callable, Optional, Any
 
 from overrides import overrides
 
-from .types import BehaviorType, TaskType, SequenceClassificationOutput, Span, SpanClassificationOutput, \
-    MultiLabelSequenceClassificationOutput, Token, TokenClassificationOutput
+from .cache import PredictionCache
+from .outputs import MultiLabelOutputStore, OutputStore, PairedOutputStore, SequenceOutputStore, SpanOutputStore, \
+    TokenOutputStore
+from .scheduler import AsyncScheduler
+from .types import BehaviorType, TaskType, Span, Token
+from .utils import batched, count_tokens
 
 
 class Behavior(object):
     """Model's Behavior to be tested"""
 
-    def __init__(self, capability: str, name: str, test_type: BehaviorType, task_type: TaskType, samples: List[str],
-                 labels: Any, predict_fn: Callable = None, description: str = None):
+    def __init__(self, capability: str, name: str, test_type: BehaviorType, task_type: TaskType,
+                 samples: Iterable[str], labels: Any, predict_fn: Callable = None, description: str = None):
         """
         :param capability: capability to test
         :param name: behavior name (used for identification)
         :param test_type: type of test
         :param task_type: type of task
-        :param samples: list of samples to test
+        :param samples: samples to test, either a list or a lazy iterable (e.g. a generator) consumed when running
         :param predict_fn: function used for prediction
-        :param labels: set of labels
+        :param labels: set of labels, either a list or a lazy iterable aligned with the samples
         :param description: behavior's description
         """
-        if isinstance(labels, list):
+        if isinstance(labels, list) and isinstance(samples, Sized):
             assert len(labels) == len(samples), \
                 "Provide either a single label or one label per sample"
         self.capability = capability
@@ -39,7 +48,7 @@ class Behavior(object):
         self.labels = labels
 
         self._is_ran = False
-        self.outputs = []
+        self.outputs = self._empty_outputs()
 
     @property
     def predict_fn(self):
@@ -49,28 +58,181 @@ class Behavior(object):
     def predict_fn(self, value):
         self._predict_fn = value
 
-    def run(self) -> None:
-        """"""
+    def run(self, batch_size: Optional[int] = None, max_tokens: Optional[int] = None,
+            cache: Optional[PredictionCache] = None) -> None:
+        """
+        Runs the prediction function over the samples and stores the outputs. Samples are sent to
+        'predict_fn' in consecutive chunks so that peak memory is bounded by the chunk size.
+
+        :param batch_size: maximum number of samples per call to 'predict_fn', all samples at once if None
+        :param max_tokens: maximum number of (whitespace-separated) tokens per call to 'predict_fn'
+        :param cache: prediction cache consulted before calling 'predict_fn'
+        """
+        if self._is_ran:
+            raise ValueError(f"This 'Behavior' has already been ran.")
+
+        predict_fn = self.predict_fn if cache is None else partial(cache.predict, self.predict_fn)
+        for samples, labels in self._batches(batch_size, max_tokens):
+            self._add_outputs(predict_fn(samples), labels, samples)
+
+        self._is_ran = True
+
+    def stream(self, batch_size: Optional[int] = None, max_tokens: Optional[int] = None,
+               cache: Optional[PredictionCache] = None) -> Iterator[Union[List[Any], OutputStore]]:
+        """
+        Runs the Behavior chunk by chunk, yielding the outputs of each chunk instead of keeping them,
+        so that memory stays constant in the number of samples (e.g. with 'Performer.partial_fit').
+        Lazy samples and labels are consumed as they are predicted.
+
+        :param batch_size: maximum number of samples per call to 'predict_fn', all samples at once if None
+        :param max_tokens: maximum number of (whitespace-separated) tokens per call to 'predict_fn'
+        :param cache: prediction cache consulted before calling 'predict_fn'
+        :return: iterator over the outputs of each chunk
+        """
+        if self._is_ran:
+            raise ValueError(f"This 'Behavior' has already been ran.")
+
+        predict_fn = self.predict_fn if cache is None else partial(cache.predict, self.predict_fn)
+        for samples, labels in self._batches(batch_size, max_tokens):
+            self.outputs = self._empty_outputs()
+            self._add_outputs(predict_fn(samples), labels, samples)
+            yield self.outputs
+
+        self.outputs = self._empty_outputs()
+        self._is_ran = True
+
+    async def arun(self, batch_size: Optional[int] = None, max_tokens: Optional[int] = None,
+                   scheduler: Optional[AsyncScheduler] = None) -> None:
+        """
+        Asynchronous counterpart of 'run' for (possibly 'async def') prediction functions performing I/O,
+        e.g. requests to an inference server. Chunks are sent concurrently through the scheduler, at most
+        'scheduler.max_concurrency' of them being built and pending at once. The pending chunks are cancelled
+        as soon as one fails.
+
+        :param batch_size: maximum number of samples per call to 'predict_fn', all samples at once if None
+        :param max_tokens: maximum number of (whitespace-separated) tokens per call to 'predict_fn'
+        :param scheduler: object bounding, throttling and retrying the calls to 'predict_fn'
+        """
+        if self._is_ran:
+            raise ValueError(f"This 'Behavior' has already been ran.")
+
+        scheduler = scheduler if scheduler is not None else AsyncScheduler()
+        pending = deque()
+        try:
+            for samples, labels in self._batches(batch_size, max_tokens):
+                if len(pending) >= scheduler.max_concurrency:
+                    await self._add_first_outputs(pending)
+                pending.append((samples, labels, asyncio.ensure_future(scheduler.call(self.predict_fn, samples))))
+            while pending:
+                await self._add_first_outputs(pending)
+        except BaseException:
+            for _, _, task in pending:
+                task.cancel()
+            raise
+        self._is_ran = True
+
+    async def _add_first_outputs(self, pending: Deque[Tuple[List[str], List[Any], asyncio.Future]]) -> None:
+        """
+        Waits for the first pending chunk and adds its outputs, so that outputs keep the order of the samples.
+        Raises the error of any pending chunk failing in the meantime.
+        """
+        tasks = [task for _, _, task in pending]
+        while True:
+            for task in tasks:
+                if task.done() and not task.cancelled() and task.exception() is not None:
+                    raise task.exception()
+            if tasks[0].done():
+                break
+            # only the chunks still running are waited for, finished ones would return at once
+            await asyncio.wait([task for task in tasks if not task.done()], return_when=asyncio.FIRST_COMPLETED)
+
+        samples, labels, task = pending.popleft()
+        self._add_outputs(task.result(), labels, samples)
+
+    def _batches(self, batch_size: Optional[int] = None,
+                 max_tokens: Optional[int] = None) -> Iterator[Tuple[List[str], List[Any]]]:
+        """Splits the samples and their labels into consecutive chunks"""
+        for batch in batched(zip(self.samples, self.labels), batch_size, max_tokens,
+                             length_fn=lambda pair: count_tokens(pair[0])):
+            yield [sample for sample, _ in batch], [label for _, label in batch]
+
+    def texts(self) -> List[str]:
+        """Texts to predict, in the order the predictions are expected by 'add_predictions'"""
+        return list(self.samples)
+
+    def add_predictions(self, predictions: List[Any], texts: Optional[List[str]] = None) -> None:
+        """
+        Builds the outputs from predictions computed outside the Behavior, e.g. in a single
+        prediction pass shared by several Behaviors.
+
+        :param predictions: one prediction per text, in the same order as 'self.texts()'
+        :param texts: texts the predictions were made on, as returned by 'self.texts()', so that lazy samples
+                      already consumed to predict them are not iterated again
+        """
+        if self._is_ran:
+            raise ValueError(f"This 'Behavior' has already been ran.")
+        texts = texts if texts is not None else self.texts()
+        if len(predictions) != len(texts):
+            raise ValueError(f"Expected {len(texts)} predictions, got {len(predictions)} instead.")
+
+        self._add_outputs(predictions, list(self.labels), texts)
+        self._is_ran = True
+
+    def _add_outputs(self, predictions: List[Any], labels: List[Any], samples: List[str]) -> None:
+        """
+        Converts a chunk of predictions into outputs and appends them to 'self.outputs'
+
+        :param predictions: predictions returned by 'predict_fn' for the chunk
+        :param labels: labels of the chunk
+        :param samples: samples of the chunk
+        """
         raise NotImplementedError()
 
+    def fingerprint(self) -> str:
+        """
+        Content hash of the Behavior (class, metadata, samples and labels), used to detect modified Behaviors.
+        The 'predict_fn' is not part of it. Lazy samples or labels consumed when iterated cannot be hashed.
+        """
+        if iter(self.samples) is self.samples or iter(self.labels) is self.labels:
+            raise ValueError(f"Behavior '{self.name}' has lazy samples or labels and cannot be fingerprinted.")
+
+        digest = hashlib.sha256()
+        for value in (self.__class__.__name__, self.capability, self.name, self.test_type.value, self.task_type.value,
+                      self.description):
+            digest.update(f"{value}\x00".encode("utf-8"))
+        for sample, label in zip(self.samples, self.labels):
+            digest.update(f"{sample}\x00{label!r}\x00".encode("utf-8"))
+        return digest.hexdigest()
+
     def reset(self) -> None:
         """"""
-        self.outputs = []
+        self.outputs = self._empty_outputs()
         self._is_ran = False
 
-    def to_file(self, path_folder: str) -> None:
-        """Save the Behavior as a pickle object"""
+    def _empty_outputs(self) -> Union[List[Any], OutputStore]:
+        """Container the outputs are appended to"""
+        return []
+
+    def to_file(self, path_folder: str) -> str:
+        """Save the Behavior as a pickle object and returns the path to the file"""
         Path(path_folder).mkdir(parents=True, exist_ok=True)
 
         file_name = "_".join(self.name.split())
         path = Path(os.path.join(path_folder, f"{file_name}.pkl"))
 
-        self_copy = deepcopy(self)
+        # shallow copy: the samples and labels are shared, only the outputs and 'predict_fn' are dropped
+        self_copy = copy(self)
         self_copy.reset()
         self_copy.predict_fn = None
+        # columns of a columnar pack are pickled by reference to the pack, the file would not be self-contained
+        for attribute in ("samples", "labels"):
+            values = getattr(self_copy, attribute)
+            if isinstance(values, Sequence) and not isinstance(values, (list, tuple)):
+                setattr(self_copy, attribute, list(values))
 
         with open(path, "wb") as writer:
             pickle.dump(self_copy, writer)
+        return str(path)
 
     @classmethod
     def from_file(cls, path_to_file: str, predict_fn: Callable = None):
@@ -78,6 +240,9 @@ class Behavior(object):
         with open(path_to_file, "rb") as reader:
             behavior = pickle.load(reader)
 
+        # Behaviors saved before the output stores were introduced hold a plain list of outputs
+        if not behavior._is_ran:
+            behavior.reset()
         behavior.predict_fn = predict_fn
         return behavior
 
@@ -101,27 +266,20 @@ class SequenceClassificationBehavior(Behavior):
                          description)
 
     @overrides
-    def run(self) -> None:
+    def _add_outputs(self, predictions: List[Any], labels: List[Any], samples: List[str]) -> None:
         """"""
-        if self._is_ran:
-            raise ValueError(f"This 'Behavior' has already been ran.")
-        predictions = self.predict_fn(self.samples)
-
-        for prediction, truth, text in zip(predictions, self.labels, self.samples):
+        for prediction, truth, text in zip(predictions, labels, samples):
             if isinstance(prediction, tuple) or isinstance(prediction, list):
                 y_pred, prob = prediction
             else:
                 y_pred = prediction
                 prob = None
-            self.outputs.append(
-                SequenceClassificationOutput(
-                    text=text,
-                    y_pred=y_pred,
-                    y_pred_prob=prob,
-                    y=truth
-                )
-            )
-        self._is_ran = True
+            self.outputs.append(text, y_pred, prob, truth)
+
+    @overrides
+    def _empty_outputs(self) -> SequenceOutputStore:
+        """"""
+        return SequenceOutputStore()
 
     def __str__(self):
         return f"<SequenceClassificationBehavior: name='{self.name}'>"
@@ -145,32 +303,138 @@ class MultiLabelSequenceClassificationBehavior(Behavior):
                          description)
 
     @overrides
-    def run(self) -> None:
+    def _add_outputs(self, predictions: List[Any], labels: List[Any], samples: List[str]) -> None:
         """"""
-        if self._is_ran:
-            raise ValueError(f"This 'Behavior' has already been ran.")
-        predictions = self.predict_fn(self.samples)
-
-        for prediction, truth, text in zip(predictions, self.labels, self.samples):
+        for prediction, truth, text in zip(predictions, labels, samples):
             if isinstance(prediction, tuple):
                 y_pred, prob = prediction
             else:
                 y_pred = prediction
                 prob = None
-            self.outputs.append(
-                MultiLabelSequenceClassificationOutput(
-                    text=text,
-                    y_pred=y_pred,
-                    y_pred_prob=prob,
-                    y=truth
-                )
-            )
-        self._is_ran = True
+            self.outputs.append(text, y_pred, prob, truth)
+
+    @overrides
+    def _empty_outputs(self) -> MultiLabelOutputStore:
+        """"""
+        return MultiLabelOutputStore()
 
     def __str__(self):
         return f"<MultiLabelSequenceClassificationBehavior: name='{self.name}'>"
 
 
+class PairedSequenceClassificationBehavior(Behavior):
+    """
+    Invariance and directional tests: each perturbed sample is compared to the prediction on its original
+    rather than to a fixed label. Originals and perturbed samples are predicted in the same calls to
+    'predict_fn', each distinct text once.
+    """
+
+    def __init__(self, capability: str, name: str, test_type: BehaviorType, originals: List[str], samples: List[str],
+                 labels: Optional[Union[int, List[int]]] = None, predict_fn: Callable = None,
+                 description: str = None, target: Optional[int] = None, tolerance: float = 0.):
+        """
+        :param capability:
+        :param name:
+        :param test_type:
+        :param originals: original of each perturbed sample
+        :param samples: perturbed samples
+        :param labels: expected shift of the probability from the original to each perturbed sample, 0 for the
+                       same predicted label (invariance), 1 for an increase and -1 for a decrease, either a single
+                       value or one per sample. Defaults to 0 for invariance tests.
+        :param predict_fn: function returning a label or a (label, probability) tuple per text, the probability
+                           being that of the 'target' class or a vector of probabilities of every class
+        :param description:
+        :param target: class whose probability is compared when 'predict_fn' returns vectors of probabilities
+        :param tolerance: shift of probability tolerated in the unexpected direction
+        """
+        if labels is None:
+            if test_type != BehaviorType.invariance:
+                raise ValueError(f"Behavior '{name}' of type '{test_type.value}' requires the expected shifts.")
+            labels = 0
+        if isinstance(labels, int):
+            labels = [labels] * len(samples)
+        if len(originals) != len(samples):
+            raise ValueError(f"Expected one original per sample, got {len(originals)} originals for "
+                             f"{len(samples)} samples.")
+        if any(label not in (-1, 0, 1) for label in labels):
+            raise ValueError(f"Expected shifts should be -1, 0 or 1.")
+
+        self.originals = originals
+        self.target = target
+        self.tolerance = tolerance
+        super().__init__(capability, name, test_type, TaskType.sequence_classification, samples, labels, predict_fn,
+                         description)
+
+    @overrides
+    def _batches(self, batch_size: Optional[int] = None,
+                 max_tokens: Optional[int] = None) -> Iterator[Tuple[List[str], List[Any]]]:
+        """Splits the pairs into consecutive chunks, the texts of each chunk being deduplicated"""
+        for batch in batched(zip(self.originals, self.samples, self.labels), batch_size, max_tokens,
+                             length_fn=lambda pair: count_tokens(pair[0]) + count_tokens(pair[1])):
+            yield self._distinct_texts(batch), batch
+
+    @overrides
+    def texts(self) -> List[str]:
+        return self._distinct_texts(zip(self.originals, self.samples))
+
+    @overrides
+    def add_predictions(self, predictions: List[Any], texts: Optional[List[str]] = None) -> None:
+        """"""
+        if self._is_ran:
+            raise ValueError(f"This 'Behavior' has already been ran.")
+        texts = texts if texts is not None else self.texts()
+        if len(predictions) != len(texts):
+            raise ValueError(f"Expected {len(texts)} predictions, got {len(predictions)} instead.")
+
+        self._add_outputs(predictions, list(zip(self.originals, self.samples, self.labels)), texts)
+        self._is_ran = True
+
+    @staticmethod
+    def _distinct_texts(pairs: Iterable[Tuple]) -> List[str]:
+        """Originals and perturbed samples of pairs, each distinct text once"""
+        return list(dict.fromkeys(text for original, sample, *_ in pairs for text in (original, sample)))
+
+    @overrides
+    def _add_outputs(self, predictions: List[Any], labels: List[Any], samples: List[str]) -> None:
+        """
+        :param predictions: prediction of each text
+        :param labels: (original, perturbed sample, expected shift) of each pair
+        :param samples: texts predicted
+        """
+        predictions = dict(zip(samples, predictions))
+        for original, sample, expected in labels:
+            y_pred, prob = self._split(predictions[sample])
+            original_y_pred, original_prob = self._split(predictions[original])
+            self.outputs.append(sample, original, y_pred, prob, original_y_pred, original_prob, expected)
+
+    def _split(self, prediction: Any) -> Tuple[Any, Optional[float]]:
+        """Label and probability of the 'target' class of a prediction"""
+        if not isinstance(prediction, (tuple, list)):
+            return prediction, None
+        y_pred, prob = prediction
+        if isinstance(prob, (tuple, list)):
+            if self.target is None:
+                raise ValueError(f"Behavior '{self.name}' requires a 'target' class for vectors of probabilities.")
+            prob = prob[self.target]
+        return y_pred, prob
+
+    @overrides
+    def fingerprint(self) -> str:
+        """"""
+        digest = hashlib.sha256(super().fingerprint().encode("utf-8"))
+        for value in [self.target, self.tolerance] + list(self.originals):
+            digest.update(f"{value}\x00".encode("utf-8"))
+        return digest.hexdigest()
+
+    @overrides
+    def _empty_outputs(self) -> PairedOutputStore:
+        """"""
+        return PairedOutputStore(self.tolerance)
+
+    def __str__(self):
+        return f"<PairedSequenceClassificationBehavior: name='{self.name}'>"
+
+
 class SpanClassificationBehavior(Behavior):
     """"""
 
@@ -189,37 +453,34 @@ class SpanClassificationBehavior(Behavior):
                          description)
 
     @overrides
-    def run(self) -> None:
+    def _add_outputs(self, predictions: List[Any], labels: List[Any], samples: List[str]) -> None:
         """"""
-        if self._is_ran:
-            raise ValueError(f"This 'Behavior' has already been ran.")
-
-        predictions = self.predict_fn(self.samples)
-
-        for predicted_spans, true_spans, text in zip(predictions, self.labels, self.samples):
+        for predicted_spans, true_spans, text in zip(predictions, labels, samples):
             sample_spans = []
             if len(predicted_spans) > 0 and isinstance(predicted_spans[0], tuple):
                 for span in predicted_spans:
-                    if len(span) >= 3:
-                        span = Span(**{key: span[i] for i, key in enumerate(Span.__fields__.keys())})
-                    else:
+                    if len(span) < 3:
                         raise ValueError(
                             f"Output of type 'Span' requires at least 3 elements, got {len(span)} instead.")
-                    sample_spans.append(span)
+                    sample_spans.append(self._span_record(dict(zip(Span.__fields__.keys(), span))))
             elif len(predicted_spans) > 0 and isinstance(predicted_spans[0], Span):
-                sample_spans = predicted_spans
+                sample_spans = [self._span_record(span.__dict__) for span in predicted_spans]
             elif len(predicted_spans) > 0:
                 raise ValueError(
                     f"Expected span prediction to be of type 'tuple' or 'Span' got '{type(predicted_spans[0])}'")
-            self.outputs.append(
-                SpanClassificationOutput(
-                    text=text,
-                    y_pred=sample_spans,
-                    y=true_spans
-                )
-            )
 
-        self._is_ran = True
+            true_spans = [self._span_record(span if isinstance(span, dict) else span.__dict__) for span in true_spans]
+            self.outputs.append(text, sample_spans, true_spans)
+
+    @staticmethod
+    def _span_record(span: dict) -> tuple:
+        """Flattens the fields of a span in the order of the 'Span' fields"""
+        return tuple(span.get(key) for key in Span.__fields__.keys())
+
+    @overrides
+    def _empty_outputs(self) -> SpanOutputStore:
+        """"""
+        return SpanOutputStore()
 
     def __str__(self):
         return f"<SpanClassificationBehavior: name='{self.name}'>"
@@ -243,39 +504,36 @@ class TokenClassificationBehavior(Behavior):
                          description)
 
     @overrides
-    def run(self) -> None:
+    def _add_outputs(self, predictions: List[Any], labels: List[Any], samples: List[str]) -> None:
         """"""
-        if self._is_ran:
-            raise ValueError(f"This 'Behavior' has already been ran.")
-
-        predictions = self.predict_fn(self.samples)
+        for predicted_tokens, true_tokens, text in zip(predictions, labels, samples):
+            if isinstance(predicted_tokens[0], int) and isinstance(true_tokens[0], int):
+                # labels given per position are stored as columns, without per-token records
+                self.outputs.append_labels(text, predicted_tokens, true_tokens)
+                continue
 
-        for predicted_tokens, true_tokens, text in zip(predictions, self.labels, self.samples):
             if isinstance(predicted_tokens[0], Token):
-                sample_tokens_pred = predicted_tokens
+                sample_tokens_pred = [(token.pos, token.prob, token.label) for token in predicted_tokens]
             elif isinstance(predicted_tokens[0], int):
-                sample_tokens_pred = [Token(pos=i, label=l) for i, l in enumerate(predicted_tokens)]
+                sample_tokens_pred = [(i, None, l) for i, l in enumerate(predicted_tokens)]
             else:
                 raise ValueError(
                     f"Expected token prediction to be of type 'int' or 'Token' got '{type(predicted_tokens[0])}'")
 
             if isinstance(true_tokens[0], Token):
-                sample_tokens = true_tokens
+                sample_tokens = [(token.pos, token.prob, token.label) for token in true_tokens]
             elif isinstance(true_tokens[0], int):
-                sample_tokens = [Token(pos=i, label=l) for i, l in enumerate(true_tokens)]
+                sample_tokens = [(i, None, l) for i, l in enumerate(true_tokens)]
             else:
                 raise ValueError(
                     f"Expected token prediction to be of type 'int' or 'Token' got '{type(true_tokens[0])}'")
 
-            self.outputs.append(
-                TokenClassificationOutput(
-                    text=text,
-                    y_pred=sample_tokens_pred,
-                    y=sample_tokens
-                )
-            )
+            self.outputs.append(text, sample_tokens_pred, sample_tokens)
 
-        self._is_ran = True
+    @overrides
+    def _empty_outputs(self) -> TokenOutputStore:
+        """"""
+        return TokenOutputStore()
 
     def __str__(self):
         return f"<TokenClassificationBehavior: name='{self.name}'>"
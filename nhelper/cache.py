@@ -0,0 +1,148 @@
+import hashlib
+import pickle
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from .utils import batched
+
+# SQLite limits the number of host parameters of a single statement
+_MAX_PARAMETERS = 500
+
+
+class PredictionCache(object):
+    """
+    On-disk cache of predictions backed by SQLite. Entries are keyed by a model fingerprint and
+    the hash of the sample text, and the least recently used ones are evicted above 'max_size'.
+    """
+
+    def __init__(self, path: str, fingerprint: str, max_size: Optional[int] = None):
+        """
+        :param path: path to the SQLite database file, created if it does not exist
+        :param fingerprint: identifier of the model (e.g. hash of its weights), predictions made
+                            with a different fingerprint are never returned
+        :param max_size: maximum number of entries kept in the database, unbounded if None
+        """
+        self.path = path
+        self.fingerprint = fingerprint
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+        self._connection = None
+        self._lock = None
+        self._connect()
+
+    def _connect(self) -> None:
+        """"""
+        self._lock = threading.RLock()
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS predictions "
+                "(key TEXT PRIMARY KEY, prediction BLOB NOT NULL, last_access INTEGER NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS predictions_last_access ON predictions (last_access)"
+            )
+
+    def key(self, text: str) -> str:
+        """Content address of a text for the current fingerprint"""
+        return hashlib.sha256(f"{self.fingerprint}\x00{text}".encode("utf-8")).hexdigest()
+
+    def get(self, texts: List[str]) -> Dict[str, Any]:
+        """
+        Retrieves the cached predictions of some texts and refreshes their last access.
+
+        :param texts: texts to look up
+        :return: mapping from the texts found in the cache to their prediction
+        """
+        keys = {self.key(text): text for text in texts}
+        found, found_keys = {}, []
+        with self._lock:
+            for batch in batched(keys, _MAX_PARAMETERS):
+                rows = self._connection.execute(
+                    f"SELECT key, prediction FROM predictions WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                found.update((keys[key], pickle.loads(prediction)) for key, prediction in rows)
+                found_keys.extend(key for key, _ in rows)
+
+            with self._connection:
+                now = time.time_ns()
+                self._connection.executemany(
+                    "UPDATE predictions SET last_access = ? WHERE key = ?",
+                    [(now, key) for key in found_keys]
+                )
+
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put(self, predictions: Dict[str, Any]) -> None:
+        """
+        Stores predictions and evicts the least recently used entries if the cache is full.
+
+        :param predictions: mapping from texts to their prediction
+        """
+        rows = [(self.key(text), pickle.dumps(prediction)) for text, prediction in predictions.items()]
+        with self._lock, self._connection:
+            now = time.time_ns()
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO predictions (key, prediction, last_access) VALUES (?, ?, ?)",
+                [(key, prediction, now) for key, prediction in rows]
+            )
+            if self.max_size is not None:
+                self._connection.execute(
+                    "DELETE FROM predictions WHERE key IN "
+                    "(SELECT key FROM predictions ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                    (self.max_size,)
+                )
+
+    def predict(self, predict_fn: Callable, texts: List[str]) -> List[Any]:
+        """
+        Predicts texts, only calling 'predict_fn' on the distinct texts missing from the cache.
+
+        :param predict_fn: function used for prediction
+        :param texts: texts to predict
+        :return: one prediction per text
+        """
+        predictions = self.get(texts)
+        missing = [text for text in dict.fromkeys(texts) if text not in predictions]
+        if missing:
+            new_predictions = dict(zip(missing, predict_fn(missing)))
+            self.put(new_predictions)
+            predictions.update(new_predictions)
+        return [predictions[text] for text in texts]
+
+    def clear(self) -> None:
+        """Removes all the entries and resets the counters"""
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM predictions")
+            self.hits = 0
+            self.misses = 0
+
+    def close(self) -> None:
+        """"""
+        self._connection.close()
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """"""
+        return {"hits": self.hits, "misses": self.misses, "size": len(self)}
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_connection"] = None
+        state["_lock"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._connect()
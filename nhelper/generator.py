@@ -1,24 +1,129 @@
-from itertools import product
-from typing import List, Union, Tuple
+from collections import OrderedDict
+from functools import partial, reduce
+from itertools import accumulate, chain, islice, product
+from operator import add, mul
+from random import Random
+from string import Formatter
+from typing import Any, Callable, Dict, Iterator, List, Optional, Union, Tuple
 
-from transformers import pipeline
+from .cache import PredictionCache
+
+
+class Template(object):
+    """
+    Template parsed once into literal and slot segments: rendering is a join over the precomputed
+    pieces, and the character offset of every slot is known while rendering.
+    """
+
+    def __init__(self, template: str):
+        """
+        :param template: 'str.format'-style template with named fields, e.g. "My name is {name}"
+        """
+        self.template = template
+        self.literals, self.slots = [], []
+
+        literal = ""
+        for literal_text, field_name, format_spec, conversion in Formatter().parse(template):
+            literal += literal_text
+            if field_name is None:
+                continue
+            self.literals.append(literal)
+            self.slots.append((field_name, conversion, format_spec))
+            literal = ""
+        self.literals.append(literal)
+
+        self.fields = list(dict.fromkeys(field_name for field_name, _, _ in self.slots))
+        self._names = [field_name for field_name, _, _ in self.slots]
+        # number of literal characters before each slot
+        self._literal_offsets = list(accumulate(len(literal) for literal in self.literals[:-1]))
+        self._first_slots = {field: self._names.index(field) for field in self.fields}
+        self._is_plain = all(
+            conversion is None and not format_spec and field_name.isidentifier()
+            for field_name, conversion, format_spec in self.slots
+        )
+        # positional version of the template, formatted in C once the slot values are known
+        self._format_string = "{}".join(literal.replace("{", "{{").replace("}", "}}") for literal in self.literals)
+
+    def render(self, values: Dict[str, Any], return_offsets: bool = True) -> Tuple[str, Optional[List[int]]]:
+        """
+        :param values: value of each field
+        :param return_offsets: whether to compute the start offset of each slot
+        :return: rendered text and start offset of each slot (None if not 'return_offsets')
+        """
+        if self._is_plain:
+            slot_values = [values[name] for name in self._names]
+        else:
+            slot_values = [self._format_slot(values, *slot) for slot in self.slots]
+
+        text = self._format_string.format(*slot_values)
+        if not return_offsets:
+            return text, None
+
+        value_offsets = accumulate(map(len, slot_values), initial=0)
+        return text, list(map(add, self._literal_offsets, value_offsets))
+
+    @staticmethod
+    def _format_slot(values: Dict[str, Any], field_name: str, conversion: Optional[str], format_spec: str) -> str:
+        """Formats a slot with attribute/index access, conversion or format spec, as 'str.format' would"""
+        formatter = Formatter()
+        value, _ = formatter.get_field(field_name, (), values)
+        value = formatter.convert_field(value, conversion)
+        return formatter.format_field(value, formatter.vformat(format_spec, (), values))
+
+    def positions(self, text: str, offsets: List[int], values: Dict[str, Any]) -> List[Tuple]:
+        """
+        :param text: rendered text
+        :param offsets: start offset of each slot, as returned by 'render'
+        :param values: value of each field
+        :return: (start, end, field, value) of the first slot of each field, in the order of 'values'
+        """
+        positions = []
+        for label, word in values.items():
+            start = offsets[self._first_slots[label]] if label in self._first_slots else text.find(word)
+            positions.append((start, start + len(word), label, word))
+        return positions
 
 
 class Generator(object):
     """Helper object to create syntactical samples"""
 
-    def __init__(self, fill_mask_model_name: str = None, translator_model_name: str = None):
+    def __init__(self, fill_mask_model_name: str = None, translator_model_name: str = None, batch_size: int = 8,
+                 num_workers: int = 0, device: Optional[Union[int, str]] = None, cache_size: int = 1024,
+                 cache_path: Optional[str] = None):
         """
 
         :param fill_mask_model_name:
         :param translator_model_name:
+        :param batch_size: number of templates fed at once to the models
+        :param num_workers: number of workers preprocessing the templates of the models
+        :param device: device the models are loaded on (e.g. -1 or "cpu", 0 or "cuda:0")
+        :param cache_size: maximum number of results kept in memory, 0 disables in-memory caching
+        :param cache_path: path to a SQLite database where results are also persisted, so that they are
+                           reused across runs
         """
         self.fill_mask_model_name = fill_mask_model_name
         self.translator_model_name = translator_model_name
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.device = device
+        self.cache_size = cache_size
+        self.cache_path = cache_path
+
+        # imported here rather than at module level as loading 'transformers' takes seconds
+        from transformers import pipeline
 
-        self.fill_pipeline = pipeline("fill-mask", model=fill_mask_model_name) if fill_mask_model_name else None
-        self.translator_pipeline = pipeline("text2text-generation",
-                                            model=translator_model_name) if translator_model_name else None
+        # the device is only forwarded when set, older pipelines comparing it to integers
+        device_kwargs = {"device": device} if device is not None else {}
+        self.fill_pipeline = pipeline("fill-mask", model=fill_mask_model_name,
+                                      **device_kwargs) if fill_mask_model_name else None
+        self.translator_pipeline = pipeline("text2text-generation", model=translator_model_name,
+                                            **device_kwargs) if translator_model_name else None
+
+        # mask token of the model (e.g. "<mask>" for RoBERTa) replacing the generic "[MASK]" of the templates
+        self.mask_token = self.fill_pipeline.tokenizer.mask_token if self.fill_pipeline is not None else None
+
+        self._memory = OrderedDict()
+        self._disk_caches = {}
 
     def fill_mask(self, templates: Union[str, List[str]], top_k: int) -> List[List[str]]:
         """
@@ -35,9 +140,17 @@ class Generator(object):
         if isinstance(templates, str):
             templates = [templates]
 
-        if "roberta" in self.fill_mask_model_name:
-            templates = [template.replace("[MASK]", "<mask>") for template in templates]
-        batch_unmasked = self.fill_pipeline(templates, top_k=top_k)
+        if self.mask_token is not None and self.mask_token != "[MASK]":
+            templates = [template.replace("[MASK]", self.mask_token) for template in templates]
+
+        filled_mask = self._cached_call("fill-mask", self.fill_mask_model_name, top_k, templates,
+                                        partial(self._fill_mask, top_k=top_k))
+        return [list(sequences) for sequences in filled_mask]
+
+    def _fill_mask(self, templates: List[str], top_k: int) -> List[List[str]]:
+        """"""
+        batch_unmasked = self.fill_pipeline(templates, top_k=top_k, batch_size=self.batch_size,
+                                            num_workers=self.num_workers)
 
         if len(templates) == 1:
             batch_unmasked = [batch_unmasked]
@@ -59,38 +172,171 @@ class Generator(object):
         if isinstance(templates, str):
             templates = [templates]
 
-        translation = self.translator_pipeline(templates)
+        return self._cached_call("text2text-generation", self.translator_model_name, None, templates,
+                                 self._translate)
+
+    def _translate(self, templates: List[str]) -> List[str]:
+        """"""
+        translation = self.translator_pipeline(templates, batch_size=self.batch_size, num_workers=self.num_workers)
         return [elt["generated_text"] for elt in translation]
 
+    def _cached_call(self, task: str, model_name: str, top_k: Optional[int], templates: List[str],
+                     predict_fn: Callable[[List[str]], List[Any]]) -> List[Any]:
+        """
+        Memoizes the results of a model, keyed by the task, the model name, 'top_k' and the template. Results
+        are looked up in the in-memory LRU cache first, then in the on-disk cache if any, and only the unique
+        missing templates are fed to the model.
+        """
+        namespace = (task, model_name, top_k)
+        results, missing = {}, []
+        for template in dict.fromkeys(templates):
+            key = (*namespace, template)
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                results[template] = self._memory[key]
+            else:
+                missing.append(template)
+
+        if missing:
+            if self.cache_path is not None:
+                predictions = self._disk_cache(namespace).predict(predict_fn, missing)
+            else:
+                predictions = predict_fn(missing)
+
+            for template, prediction in zip(missing, predictions):
+                results[template] = prediction
+                self._memory[(*namespace, template)] = prediction
+            while len(self._memory) > self.cache_size:
+                self._memory.popitem(last=False)
+
+        return [results[template] for template in templates]
+
+    def _disk_cache(self, namespace: Tuple) -> PredictionCache:
+        """On-disk cache of a (task, model name, top_k) namespace"""
+        if namespace not in self._disk_caches:
+            self._disk_caches[namespace] = PredictionCache(self.cache_path, fingerprint=":".join(map(str, namespace)))
+        return self._disk_caches[namespace]
+
     @staticmethod
     def generate(templates: Union[str, List[str]], generate_all: bool = False, return_pos: bool = False, **kwargs) -> \
             Union[List[str], Tuple[List[str], List[List[Tuple]]]]:
         """"""
+        generations = list(Generator.iter_generate(templates, generate_all=generate_all, return_pos=return_pos,
+                                                   **kwargs))
+        if return_pos:
+            return [text for text, _ in generations], [positions for _, positions in generations]
+
+        return generations
+
+    @staticmethod
+    def iter_generate(templates: Union[str, List[str]], generate_all: bool = False, return_pos: bool = False,
+                      _n_samples: Optional[int] = None, _seed: Optional[int] = None,
+                      _shard: Optional[Tuple[int, int]] = None, **kwargs) -> Iterator[Union[str, Tuple[str, List]]]:
+        """
+        Lazily yields the generations of 'generate', in the same order. Combinations of keywords are decoded
+        from their index in the combination space, so that neither the combinations nor the generations are
+        ever materialized.
+
+        :param templates: template(s) to fill
+        :param generate_all: whether to use every combination (cartesian product) of the keywords' alternatives
+                             instead of zipping them
+        :param return_pos: whether to also yield the positions of the keywords in each generation
+        :param _n_samples: if set, number of combinations drawn uniformly at random (without replacement)
+        :param _seed: seed of the random sampling of combinations
+        :param _shard: (index, count) of the contiguous share of the combinations to generate, e.g. (0, 4) for the
+                       first quarter. Shards are deterministic so that workers can split the generation.
+        :param kwargs: alternatives of each keyword. The sampling and sharding parameters are prefixed with an
+                       underscore so that they never collide with a keyword of the templates.
+        :return: iterator over the generations, or (generation, positions) tuples if 'return_pos'
+        """
         if isinstance(templates, str):
             templates = [templates]
 
         assert max(map(len, kwargs.values())) == min(map(len, kwargs.values())) or generate_all, \
             "Please provide the same number number of alternatives for all keywords or set 'generate_all' to True."
 
+        templates = [Template(template) for template in templates]
+        keywords, alternatives = list(kwargs), [list(values) for values in kwargs.values()]
         if generate_all:
-            combined_kwargs = [dict(zip(kwargs, t)) for t in product(*kwargs.values())]
+            n_combinations = reduce(mul, map(len, alternatives), 1)
         else:
-            combined_kwargs = [dict(zip(kwargs, t)) for t in zip(*kwargs.values())]
+            n_combinations = len(alternatives[0]) if alternatives else 1
+
+        indices, n_indices = range(n_combinations), n_combinations
+        if _n_samples is not None and _n_samples < n_combinations:
+            indices, n_indices = Generator._sample_indices(n_combinations, _n_samples, _seed), _n_samples
+        if _shard is not None:
+            shard_idx, n_shards = _shard
+            if not 0 <= shard_idx < n_shards:
+                raise ValueError(f"Invalid shard {_shard}, expected (index, count) with 0 <= index < count.")
+            indices = indices[n_indices * shard_idx // n_shards:n_indices * (shard_idx + 1) // n_shards]
 
-        generations, all_positions = [], []
-        for combination in combined_kwargs:
+        if isinstance(indices, range):
+            combinations = Generator._iter_combinations(indices.start, indices.stop, alternatives, generate_all)
+        else:
+            combinations = (Generator._decode_combination(idx, alternatives, generate_all) for idx in indices)
+
+        for values in combinations:
+            combination = dict(zip(keywords, values))
             for template in templates:
-                text = template.format(**combination)
-                generations.append(text)
+                text, offsets = template.render(combination, return_offsets=return_pos)
+                yield (text, template.positions(text, offsets, combination)) if return_pos else text
 
-                if return_pos:
-                    positions = []
-                    for label, word in combination.items():
-                        start = text.find(word)
-                        positions.append((start, start + len(word), label, word))
-                    all_positions.append(positions)
+    @staticmethod
+    def _sample_indices(n_combinations: int, n_samples: int, seed: Optional[int] = None) -> List[int]:
+        """
+        Draws sorted combination indices uniformly without replacement. Sparse draws are done by rejection
+        so that arbitrarily large combination spaces are never enumerated.
+        """
+        rng = Random(seed)
+        if 2 * n_samples > n_combinations:
+            return sorted(rng.sample(range(n_combinations), n_samples))
 
-        if return_pos:
-            return generations, all_positions
+        drawn = set()
+        while len(drawn) < n_samples:
+            drawn.add(rng.randrange(n_combinations))
+        return sorted(drawn)
 
-        return generations
+    @staticmethod
+    def _iter_combinations(start: int, stop: int, alternatives: List[List[str]],
+                           generate_all: bool) -> Iterator[Tuple[str, ...]]:
+        """
+        Alternatives of the contiguous combinations [start, stop), in the order of '_decode_combination'. The
+        combinations before 'start' are not enumerated: the product is resumed from the first combination, as
+        a chain of products each fixing one keyword less, so that iterating stays in C whatever 'start'.
+        """
+        if not generate_all:
+            return zip(*(values[start:stop] for values in alternatives))
+        if start == 0:
+            return islice(product(*alternatives), stop)
+
+        digits = []
+        idx = start
+        for values in reversed(alternatives):
+            idx, value_idx = divmod(idx, len(values))
+            digits.append(value_idx)
+        digits = digits[::-1]
+
+        # e.g. from (a1, b2, c3): (a1, b2, c3...), then (a1, b3..., c*), then (a2..., b*, c*)
+        last = len(alternatives) - 1
+        products = (
+            product(*([values[digit]] for values, digit in zip(alternatives[:k], digits[:k])),
+                    alternatives[k][digits[k] + (k != last):], *alternatives[k + 1:])
+            for k in range(last, -1, -1)
+        )
+        return islice(chain.from_iterable(products), stop - start)
+
+    @staticmethod
+    def _decode_combination(idx: int, alternatives: List[List[str]], generate_all: bool) -> List[str]:
+        """
+        Alternatives of the combination at a given index, following the order of 'itertools.product'
+        (last keyword varying the fastest) if 'generate_all', the order of 'zip' otherwise.
+        """
+        if not generate_all:
+            return [values[idx] for values in alternatives]
+
+        combination = []
+        for values in reversed(alternatives):
+            idx, value_idx = divmod(idx, len(values))
+            combination.append(values[value_idx])
+        return combination[::-1]
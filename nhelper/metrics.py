@@ -0,0 +1,188 @@
+from typing import Any, Optional, Tuple
+
+import numpy as np
+
+SPAN_MATCH_MODES = ("exact", "overlap", "iou")
+
+
+def match_spans(query_groups: np.ndarray, query_starts: np.ndarray, query_ends: np.ndarray,
+                ref_groups: np.ndarray, ref_starts: np.ndarray, ref_ends: np.ndarray,
+                mode: str = "exact", iou_threshold: float = 0.5) -> np.ndarray:
+    """
+    Finds which query spans match at least one reference span of the same group (e.g. same sample and
+    label). Spans are half-open intervals [start, end). The reference spans are indexed once by sorting
+    them on (group, start), each query being then resolved by binary search, so that the cost is
+    O((n + m) log m) instead of the O(n * m) of pairwise comparisons.
+
+    :param query_groups: group of each query span
+    :param query_starts: start of each query span
+    :param query_ends: end of each query span
+    :param ref_groups: group of each reference span
+    :param ref_starts: start of each reference span
+    :param ref_ends: end of each reference span
+    :param mode: "exact" (same boundaries), "overlap" (at least one common position) or "iou"
+                 (intersection over union above 'iou_threshold')
+    :param iou_threshold: minimum intersection over union for the "iou" mode
+    :return: boolean array, whether each query span is matched
+    """
+    if mode not in SPAN_MATCH_MODES:
+        raise ValueError(f"Unknown span matching mode '{mode}', expected one of {SPAN_MATCH_MODES}.")
+    if mode == "iou" and not 0 < iou_threshold <= 1:
+        raise ValueError(f"'iou_threshold' should be in ]0, 1], got {iou_threshold}.")
+
+    query_groups, query_starts, query_ends, ref_groups, ref_starts, ref_ends = (
+        np.asarray(values, dtype=np.int64)
+        for values in (query_groups, query_starts, query_ends, ref_groups, ref_starts, ref_ends)
+    )
+    n_queries = len(query_groups)
+    if n_queries == 0 or len(ref_groups) == 0:
+        return np.zeros(n_queries, dtype=bool)
+
+    # sorted index of the reference spans over a single (group, start) integer key
+    base = int(max(query_ends.max(), ref_ends.max(), query_starts.max(), ref_starts.max())) + 2
+    order = np.lexsort((ref_starts, ref_groups))
+    ref_groups, ref_starts, ref_ends = ref_groups[order], ref_starts[order], ref_ends[order]
+    ref_keys = ref_groups * base + ref_starts
+
+    if mode == "exact":
+        lo = np.searchsorted(ref_keys, query_groups * base + query_starts, side="left")
+        hi = np.searchsorted(ref_keys, query_groups * base + query_starts, side="right")
+        return _any_in_ranges(lo, hi, lambda queries, refs: ref_ends[refs] == query_ends[queries])
+
+    # last reference span of the query's group starting before the query ends
+    last = np.searchsorted(ref_keys, query_groups * base + query_ends, side="left") - 1
+    valid = (last >= 0) & (ref_groups[np.maximum(last, 0)] == query_groups)
+
+    if mode == "overlap":
+        # running maximum of the ends within each group: earlier groups have smaller encoded values
+        max_ends = np.maximum.accumulate(ref_groups * base + ref_ends)
+        max_end = max_ends[np.maximum(last, 0)] - query_groups * base
+        return valid & (max_end > query_starts)
+
+    # a reference span reaching the threshold cannot start before 'end - length / threshold'
+    lengths = query_ends - query_starts
+    min_starts = np.maximum(np.ceil(query_ends - lengths / iou_threshold).astype(np.int64), 0)
+    lo = np.searchsorted(ref_keys, query_groups * base + min_starts, side="left")
+    hi = np.where(valid, last + 1, lo)
+
+    def above_threshold(queries, refs):
+        intersection = np.clip(
+            np.minimum(query_ends[queries], ref_ends[refs]) - np.maximum(query_starts[queries], ref_starts[refs]),
+            0, None
+        )
+        union = lengths[queries] + (ref_ends[refs] - ref_starts[refs]) - intersection
+        return intersection >= iou_threshold * np.maximum(union, 1)
+
+    return _any_in_ranges(lo, hi, above_threshold)
+
+
+def _any_in_ranges(lo: np.ndarray, hi: np.ndarray, predicate) -> np.ndarray:
+    """
+    Whether, for each query, 'predicate' holds for at least one reference of its range [lo, hi).
+    All the (query, reference) candidate pairs are evaluated at once.
+    """
+    counts = np.maximum(hi - lo, 0)
+    queries = np.repeat(np.arange(len(lo)), counts)
+    refs = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(lo, counts)
+
+    matched = np.zeros(len(lo), dtype=bool)
+    matched[queries[predicate(queries, refs)]] = True
+    return matched
+
+
+def span_counts(n_samples: int, pred_samples: np.ndarray, pred_starts: np.ndarray, pred_ends: np.ndarray,
+                true_samples: np.ndarray, true_starts: np.ndarray, true_ends: np.ndarray,
+                pred_labels: Optional[np.ndarray] = None, true_labels: Optional[np.ndarray] = None,
+                mode: str = "exact", iou_threshold: float = 0.5) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Counts per sample the true positives (true spans matched by a prediction), false positives
+    (predicted spans matching no true span) and false negatives (true spans matched by no prediction).
+
+    :param n_samples: number of samples
+    :param pred_samples: sample of each predicted span
+    :param pred_starts: start of each predicted span
+    :param pred_ends: end of each predicted span
+    :param true_samples: sample of each true span
+    :param true_starts: start of each true span
+    :param true_ends: end of each true span
+    :param pred_labels: integer-coded label of each predicted span, labels are ignored if None
+    :param true_labels: integer-coded label of each true span, labels are ignored if None
+    :param mode: span matching mode, see 'match_spans'
+    :param iou_threshold: minimum intersection over union for the "iou" mode
+    :return: true positives, false positives and false negatives of each sample
+    """
+    pred_samples = np.asarray(pred_samples, dtype=np.int64)
+    true_samples = np.asarray(true_samples, dtype=np.int64)
+    pred_groups, true_groups = pred_samples, true_samples
+    if pred_labels is not None and true_labels is not None:
+        n_labels = int(max(np.max(pred_labels, initial=0), np.max(true_labels, initial=0))) + 1
+        pred_groups = pred_samples * n_labels + pred_labels
+        true_groups = true_samples * n_labels + true_labels
+
+    pred_matched = match_spans(pred_groups, pred_starts, pred_ends, true_groups, true_starts, true_ends, mode,
+                               iou_threshold)
+    true_matched = match_spans(true_groups, true_starts, true_ends, pred_groups, pred_starts, pred_ends, mode,
+                               iou_threshold)
+
+    tp = np.bincount(true_samples, weights=true_matched, minlength=n_samples).astype(np.int64)
+    fn = np.bincount(true_samples, weights=~true_matched, minlength=n_samples).astype(np.int64)
+    fp = np.bincount(pred_samples, weights=~pred_matched, minlength=n_samples).astype(np.int64)
+    return tp, fp, fn
+
+
+def precision_recall_f1(tp: float, fp: float, fn: float, n_pred: float) -> Tuple[float, float, float]:
+    """
+    :param tp: number of true positives
+    :param fp: number of false positives
+    :param fn: number of false negatives
+    :param n_pred: number of predictions
+    :return: precision, recall and F1 score (NaN when undefined)
+    """
+    precision = (n_pred - fp) / n_pred if n_pred else np.nan
+    recall = tp / (tp + fn) if tp + fn else np.nan
+    if np.isnan(precision) or np.isnan(recall):
+        f1 = np.nan
+    else:
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.
+    return precision, recall, f1
+
+
+def confusion_matrix(true_codes: np.ndarray, pred_codes: np.ndarray, n_labels: int,
+                     weights: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    :param true_codes: integer-coded true label of each prediction
+    :param pred_codes: integer-coded predicted label of each prediction
+    :param n_labels: number of labels
+    :param weights: number of times each prediction is counted, defaults to once
+    :return: (n_labels, n_labels) matrix counting the predictions of each true (row) and predicted (column) label
+    """
+    true_codes = np.asarray(true_codes, dtype=np.int64)
+    pred_codes = np.asarray(pred_codes, dtype=np.int64)
+    counts = np.bincount(true_codes * n_labels + pred_codes, weights=weights, minlength=n_labels * n_labels)
+    return counts.astype(np.int64).reshape(n_labels, n_labels)
+
+
+def label_runs(samples: np.ndarray, positions: np.ndarray, labels: np.ndarray,
+               outside_label: Any = 0) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Entities of token sequences: maximal runs of consecutive tokens of a sample sharing a label other than
+    'outside_label'. Tokens are expected sorted by sample and position.
+
+    :param samples: sample of each token
+    :param positions: position of each token
+    :param labels: label of each token
+    :param outside_label: label of the tokens outside of any entity
+    :return: sample, start, end (exclusive) and label of each entity
+    """
+    samples, positions, labels = np.asarray(samples), np.asarray(positions), np.asarray(labels)
+    inside = labels != outside_label
+
+    # a run starts on the first token, a new sample, a gap in the positions or a new label
+    starts = np.ones(len(labels), dtype=bool)
+    starts[1:] = (samples[1:] != samples[:-1]) | (positions[1:] != positions[:-1] + 1) | (labels[1:] != labels[:-1])
+    first = np.flatnonzero(starts)
+    last = np.append(first[1:], len(labels)) - 1
+
+    entities = inside[first]
+    first, last = first[entities], last[entities]
+    return samples[first], positions[first], positions[last] + 1, labels[first]
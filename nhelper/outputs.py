@@ -0,0 +1,431 @@
+from collections.abc import Sequence
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from .metrics import confusion_matrix, label_runs, span_counts
+from .types import MultiLabelSequenceClassificationOutput, PairedSequenceClassificationOutput, \
+    SequenceClassificationOutput, Span, SpanClassificationOutput, Token, TokenClassificationOutput
+
+
+class OutputStore(Sequence):
+    """
+    Compact store of the outputs of a Behavior. Outputs are kept in flat columns and only
+    materialized into their pydantic model when indexed, so that running a Behavior does not
+    allocate one (or more) pydantic object per sample.
+    """
+
+    def __len__(self):
+        return len(self.text)
+
+    def __getitem__(self, idx: Union[int, slice]):
+        if isinstance(idx, slice):
+            return [self._materialize(i) for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("Output index out of range")
+        return self._materialize(idx)
+
+    def __eq__(self, other):
+        if not isinstance(other, (OutputStore, list)):
+            return NotImplemented
+        return len(self) == len(other) and all(output == other_output for output, other_output in zip(self, other))
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__}: {len(self)} outputs>"
+
+    def _materialize(self, idx: int):
+        """Builds the pydantic output of a sample"""
+        raise NotImplementedError()
+
+    def success(self, binarize: bool = False) -> np.ndarray:
+        """
+        :param binarize: whether to compute the success on binarized predictions
+        :return: boolean success of every output
+        """
+        attr = "binary_success" if binarize else "success"
+        return np.fromiter((getattr(output, attr) for output in self), dtype=bool, count=len(self))
+
+
+class SequenceOutputStore(OutputStore):
+    """Struct of arrays holding the outputs of a sequence classification Behavior"""
+    output_cls = SequenceClassificationOutput
+
+    def __init__(self):
+        self.text = []
+        self.y_pred = []
+        self.y_pred_prob = []
+        self.y = []
+
+    def append(self, text: str, y_pred: Any, y_pred_prob: Any, y: Any) -> None:
+        """"""
+        self.text.append(text)
+        self.y_pred.append(y_pred)
+        self.y_pred_prob.append(y_pred_prob)
+        self.y.append(y)
+
+    def _materialize(self, idx: int):
+        return self.output_cls(text=self.text[idx], y_pred=self.y_pred[idx], y_pred_prob=self.y_pred_prob[idx],
+                               y=self.y[idx])
+
+    def success(self, binarize: bool = False) -> np.ndarray:
+        # labels are validated as strings first by the output model, hence the comparison of their string form
+        return np.asarray(self.y_pred, dtype=str) == np.asarray(self.y, dtype=str)
+
+
+class MultiLabelOutputStore(SequenceOutputStore):
+    """Struct of arrays holding the outputs of a multi-label sequence classification Behavior"""
+    output_cls = MultiLabelSequenceClassificationOutput
+
+    def success(self, binarize: bool = False) -> np.ndarray:
+        return np.fromiter((list(y_pred) == list(y) for y_pred, y in zip(self.y_pred, self.y)), dtype=bool,
+                           count=len(self))
+
+    def indicators(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: predicted and true (n_outputs, n_labels) binary indicator matrices
+        """
+        y_pred, y = np.asarray(self.y_pred, dtype=np.int64), np.asarray(self.y, dtype=np.int64)
+        if len(self) == 0:
+            return y_pred.reshape(0, 0), y.reshape(0, 0)
+        if y_pred.ndim != 2 or y_pred.shape != y.shape:
+            raise ValueError(f"Expected predictions and labels of a same number of labels, got shapes "
+                             f"{y_pred.shape} and {y.shape}.")
+        return y_pred, y
+
+
+class PairedOutputStore(OutputStore):
+    """Struct of arrays holding the outputs of a paired (original, perturbed) sequence classification Behavior"""
+    output_cls = PairedSequenceClassificationOutput
+
+    def __init__(self, tolerance: float = 0.):
+        """
+        :param tolerance: shift of probability tolerated in the unexpected direction
+        """
+        self.tolerance = tolerance
+        self.text = []
+        self.original = []
+        self.y_pred = []
+        self.y_pred_prob = []
+        self.original_y_pred = []
+        self.original_y_pred_prob = []
+        self.y = []
+
+    def append(self, text: str, original: str, y_pred: Any, y_pred_prob: Optional[float], original_y_pred: Any,
+               original_y_pred_prob: Optional[float], y: int) -> None:
+        """"""
+        self.text.append(text)
+        self.original.append(original)
+        self.y_pred.append(y_pred)
+        self.y_pred_prob.append(y_pred_prob)
+        self.original_y_pred.append(original_y_pred)
+        self.original_y_pred_prob.append(original_y_pred_prob)
+        self.y.append(y)
+
+    def _materialize(self, idx: int):
+        return self.output_cls(text=self.text[idx], original=self.original[idx], y_pred=self.y_pred[idx],
+                               y_pred_prob=self.y_pred_prob[idx], original_y_pred=self.original_y_pred[idx],
+                               original_y_pred_prob=self.original_y_pred_prob[idx], y=self.y[idx],
+                               tolerance=self.tolerance)
+
+    def shifts(self) -> np.ndarray:
+        """Shift of probability from the original to the perturbed sample of every output, NaN if unknown"""
+        return _to_float(np.asarray(self.y_pred_prob, dtype=object)) - \
+            _to_float(np.asarray(self.original_y_pred_prob, dtype=object))
+
+    def success(self, binarize: bool = False) -> np.ndarray:
+        shifts, expected = self.shifts(), np.asarray(self.y, dtype=np.int64)
+        # labels are validated as strings first by the output model, hence the comparison of their string form
+        same_label = np.asarray(self.y_pred, dtype=str) == np.asarray(self.original_y_pred, dtype=str)
+        with np.errstate(invalid="ignore"):
+            invariant = same_label & ~(np.abs(shifts) > self.tolerance)
+            monotonic = expected * shifts >= -self.tolerance
+        return np.where(expected == 0, invariant, monotonic)
+
+
+class RaggedArray(object):
+    """Flat columns of variable-length records (e.g. the tokens of each sample) indexed by offsets"""
+
+    def __init__(self, fields: Tuple[str, ...]):
+        """
+        :param fields: names of the columns
+        """
+        self.fields = fields
+        self.columns = {field: [] for field in fields}
+        self.offsets = [0]
+        self._arrays = None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def append(self, records: List[Tuple]) -> None:
+        """
+        :param records: records of a sample, one value per field
+        """
+        for field, values in zip(self.fields, zip(*records)):
+            self.columns[field].extend(values)
+        self.offsets.append(self.offsets[-1] + len(records))
+        self._arrays = None
+
+    def append_columns(self, columns: Dict[str, Sequence]) -> None:
+        """
+        :param columns: values of each field for the records of a sample, all of the same length
+        """
+        n_records = len(columns[self.fields[0]])
+        for field in self.fields:
+            self.columns[field].extend(columns[field])
+        self.offsets.append(self.offsets[-1] + n_records)
+        self._arrays = None
+
+    def get(self, idx: int) -> List[Dict[str, Any]]:
+        """Records of a sample"""
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        return [
+            {field: self.columns[field][i] for field in self.fields}
+            for i in range(start, end)
+        ]
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """NumPy view of the columns and offsets, cached until the next append"""
+        if self._arrays is None:
+            self._arrays = {field: np.asarray(values) for field, values in self.columns.items()}
+            self._arrays["offsets"] = np.asarray(self.offsets, dtype=np.int64)
+        return self._arrays
+
+    def lengths(self) -> np.ndarray:
+        """Number of records of each sample"""
+        return np.diff(self.arrays()["offsets"])
+
+
+class TokenOutputStore(OutputStore):
+    """Offset-indexed flat arrays holding the outputs of a token classification Behavior"""
+    output_cls = TokenClassificationOutput
+    fields = ("pos", "prob", "label")
+
+    def __init__(self):
+        self.text = []
+        self.y_pred = RaggedArray(self.fields)
+        self.y = RaggedArray(self.fields)
+
+    def append(self, text: str, y_pred: List[Tuple[int, Optional[float], int]],
+               y: List[Tuple[int, Optional[float], int]]) -> None:
+        """
+        :param text: sample
+        :param y_pred: predicted (pos, prob, label) of each token
+        :param y: true (pos, prob, label) of each token
+        """
+        self.text.append(text)
+        self.y_pred.append(y_pred)
+        self.y.append(y)
+
+    def append_labels(self, text: str, y_pred: Sequence[int], y: Sequence[int]) -> None:
+        """
+        Appends an output whose tokens are given as a label per position, without building per-token records.
+
+        :param text: sample
+        :param y_pred: predicted label of each token
+        :param y: true label of each token
+        """
+        self.text.append(text)
+        for tokens, labels in ((self.y_pred, y_pred), (self.y, y)):
+            tokens.append_columns({"pos": range(len(labels)), "prob": [None] * len(labels), "label": labels})
+
+    def _materialize(self, idx: int):
+        return self.output_cls(
+            text=self.text[idx],
+            y_pred=[Token(**token) for token in self.y_pred.get(idx)],
+            y=[Token(**token) for token in self.y.get(idx)]
+        )
+
+    def success(self, binarize: bool = False) -> np.ndarray:
+        n_samples = len(self)
+        pred_lengths, true_lengths = self.y_pred.lengths(), self.y.lengths()
+        same_length = pred_lengths == true_lengths
+
+        # tokens of samples having as many predicted as true tokens are aligned in the flat arrays
+        sample_idx = np.repeat(np.arange(n_samples), pred_lengths)
+        pred_mask = same_length[sample_idx]
+        true_mask = np.repeat(same_length, true_lengths)
+
+        pred, true = self.y_pred.arrays(), self.y.arrays()
+        mismatch = np.zeros(int(pred_mask.sum()), dtype=bool)
+        for field in self.fields:
+            pred_values = _to_float(pred[field])[pred_mask]
+            true_values = _to_float(true[field])[true_mask]
+            mismatch |= ~((pred_values == true_values) | (np.isnan(pred_values) & np.isnan(true_values)))
+
+        n_mismatches = np.bincount(sample_idx[pred_mask], weights=mismatch, minlength=n_samples)
+        return same_length & (n_mismatches == 0)
+
+    def token_counts(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Token-level correctness: true tokens are matched to the predicted token at the same position.
+
+        :return: number of correctly labeled tokens and number of true tokens of each output
+        """
+        true_samples, true_labels, pred_labels, found = self._aligned_tokens()
+        correct = found & (pred_labels == true_labels)
+        return (np.bincount(true_samples, weights=correct, minlength=len(self)).astype(np.int64),
+                np.bincount(true_samples, minlength=len(self)))
+
+    def confusion_matrix(self) -> Tuple[List[Any], np.ndarray]:
+        """
+        Confusion of the labels of the true tokens matched by a predicted token at the same position.
+
+        :return: labels and (n_labels, n_labels) matrix counting the tokens of each true (row) and predicted
+                 (column) label
+        """
+        _, true_labels, pred_labels, found = self._aligned_tokens()
+        labels, codes = np.unique(np.concatenate([true_labels[found], pred_labels[found]]), return_inverse=True)
+        codes = codes.ravel()
+        n_found = int(found.sum())
+        return labels.tolist(), confusion_matrix(codes[:n_found], codes[n_found:], len(labels))
+
+    def entity_counts(self, outside_label: Any = 0) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Entity-level true positives, false positives and false negatives of every output, entities being the
+        runs of consecutive tokens sharing a label other than 'outside_label' (see 'nhelper.metrics.label_runs')
+        and matching when they have the same boundaries and label.
+
+        :param outside_label: label of the tokens outside of any entity
+        :return: true positives, false positives, false negatives and number of predicted entities of each output
+        """
+        pred_entities = label_runs(*self._sorted_tokens(self.y_pred), outside_label=outside_label)
+        true_entities = label_runs(*self._sorted_tokens(self.y), outside_label=outside_label)
+        _, label_codes = np.unique(np.concatenate([pred_entities[3], true_entities[3]]), return_inverse=True)
+        label_codes = label_codes.ravel()
+        n_pred = len(pred_entities[3])
+
+        tp, fp, fn = span_counts(len(self), *pred_entities[:3], *true_entities[:3], pred_labels=label_codes[:n_pred],
+                                 true_labels=label_codes[n_pred:])
+        return tp, fp, fn, np.bincount(pred_entities[0], minlength=len(self))
+
+    def _aligned_tokens(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Sample and label of the true tokens, label predicted at their position and whether a token was predicted
+        at their position
+        """
+        true_samples, true_positions, true_labels = self._sorted_tokens(self.y)
+        pred_samples, pred_positions, pred_labels = self._sorted_tokens(self.y_pred)
+
+        base = int(max(np.max(true_positions, initial=0), np.max(pred_positions, initial=0))) + 1
+        pred_keys, true_keys = pred_samples * base + pred_positions, true_samples * base + true_positions
+        idx = np.minimum(np.searchsorted(pred_keys, true_keys), max(len(pred_keys) - 1, 0))
+        if len(pred_keys) == 0:
+            return true_samples, true_labels, np.zeros_like(true_labels), np.zeros(len(true_keys), dtype=bool)
+        return true_samples, true_labels, pred_labels[idx], pred_keys[idx] == true_keys
+
+    @staticmethod
+    def _sorted_tokens(tokens: RaggedArray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Sample, position and label of the tokens, sorted by sample and position"""
+        arrays = tokens.arrays()
+        samples = np.repeat(np.arange(len(tokens)), tokens.lengths())
+        positions = arrays["pos"].astype(np.int64)
+        labels = arrays["label"] if len(samples) else np.zeros(0, dtype=np.int64)
+        order = np.lexsort((positions, samples))
+        return samples[order], positions[order], labels[order]
+
+
+class SpanOutputStore(OutputStore):
+    """Offset-indexed flat arrays holding the outputs of a span classification Behavior"""
+    output_cls = SpanClassificationOutput
+    fields = tuple(Span.__fields__.keys())
+
+    def __init__(self):
+        self.text = []
+        self.y_pred = RaggedArray(self.fields)
+        self.y = RaggedArray(self.fields)
+        self._success = {}
+
+    def append(self, text: str, y_pred: List[Tuple], y: List[Tuple]) -> None:
+        """
+        :param text: sample
+        :param y_pred: predicted spans, as tuples ordered as the fields of 'Span'
+        :param y: true spans, as tuples ordered as the fields of 'Span'
+        """
+        self.text.append(text)
+        self.y_pred.append(y_pred)
+        self.y.append(y)
+        self._success = {}
+
+    def success(self, binarize: bool = False) -> np.ndarray:
+        """
+        Exact (or binary) span matching of every output: predicted and true spans of each sample are
+        sorted by their integer keys and compared position-wise, without building any 'Span' object.
+        The result is cached until the next append.
+        """
+        if binarize not in self._success:
+            self._success[binarize] = self._match(binarize)
+        return self._success[binarize]
+
+    def _materialize(self, idx: int):
+        return self.output_cls(
+            text=self.text[idx],
+            y_pred=[Span(**span) for span in self.y_pred.get(idx)],
+            y=[Span(**span) for span in self.y.get(idx)]
+        )
+
+    def span_counts(self, mode: str = "exact", iou_threshold: float = 0.5,
+                    binarize: bool = False) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Span-level true positives, false positives and false negatives of every output.
+
+        :param mode: "exact", "overlap" or "iou" span matching, see 'nhelper.metrics.match_spans'
+        :param iou_threshold: minimum intersection over union for the "iou" mode
+        :param binarize: whether to ignore the labels when matching spans
+        :return: true positives, false positives and false negatives of each output
+        """
+        label_codes = {}
+        pred_samples, pred_starts, pred_ends, pred_labels = self._span_columns(self.y_pred, label_codes)
+        true_samples, true_starts, true_ends, true_labels = self._span_columns(self.y, label_codes)
+        if binarize:
+            pred_labels, true_labels = None, None
+        return span_counts(len(self), pred_samples, pred_starts, pred_ends, true_samples, true_starts, true_ends,
+                           pred_labels, true_labels, mode=mode, iou_threshold=iou_threshold)
+
+    def _match(self, binarize: bool) -> np.ndarray:
+        """"""
+        n_samples = len(self)
+        same_length = self.y_pred.lengths() == self.y.lengths()
+
+        label_codes = {}
+        pred_keys = self._sorted_keys(self.y_pred, label_codes, binarize)
+        true_keys = self._sorted_keys(self.y, label_codes, binarize)
+
+        # once sorted, the spans of samples having as many predicted as true spans are aligned
+        pred_keys = pred_keys[same_length[pred_keys[:, 0]]]
+        true_keys = true_keys[same_length[true_keys[:, 0]]]
+        mismatch = np.any(pred_keys != true_keys, axis=1)
+
+        n_mismatches = np.bincount(pred_keys[:, 0], weights=mismatch, minlength=n_samples)
+        return same_length & (n_mismatches == 0)
+
+    @classmethod
+    def _sorted_keys(cls, spans: RaggedArray, label_codes: Dict[str, int], binarize: bool) -> np.ndarray:
+        """Integer keys (sample, start, end[, label code]) of the spans, sorted lexicographically"""
+        columns = cls._span_columns(spans, label_codes)
+        keys = np.stack(columns[:3] if binarize else columns, axis=1)
+        return keys[np.lexsort(keys.T[::-1])]
+
+    @staticmethod
+    def _span_columns(spans: RaggedArray, label_codes: Dict[str, int]) -> Tuple[np.ndarray, ...]:
+        """
+        Sample, start, end and label code of each span. Labels are coded through their string form,
+        consistently with 'Span.key'.
+        """
+        labels = spans.columns["label"]
+        return (
+            np.repeat(np.arange(len(spans)), spans.lengths()),
+            np.asarray(spans.columns["start"], dtype=np.int64),
+            np.asarray(spans.columns["end"], dtype=np.int64),
+            np.fromiter((label_codes.setdefault(str(label), len(label_codes)) for label in labels), dtype=np.int64,
+                        count=len(labels))
+        )
+
+
+def _to_float(values: np.ndarray) -> np.ndarray:
+    """Casts a column to float, missing values (None) becoming NaN"""
+    if values.dtype == object:
+        values = np.array([np.nan if value is None else value for value in values], dtype=float)
+    return values.astype(float)
@@ -1,4 +1,20 @@
-from typing import Union
+from importlib import import_module
+from typing import TYPE_CHECKING, Union
+
 from .performer import Performer
 
+if TYPE_CHECKING:
+    from .lightning_performer import LightningPerformer
+
 PerformerType = Union[Performer]
+
+# 'pytorch_lightning' is only loaded when the LightningPerformer is accessed
+_LAZY_ATTRIBUTES = {
+    "LightningPerformer": ".lightning_performer",
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        return getattr(import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
@@ -1,49 +1,127 @@
-from collections import defaultdict
-from functools import reduce
-from typing import Any, Callable, Optional
+from typing import Any, Callable, List, Optional, Tuple
 
-import numpy as np
 import pytorch_lightning as pl
+import torch
+import torch.distributed as dist
 from pytorch_lightning.utilities.types import STEP_OUTPUT
 
+# batch metadata the success is broken down by, and their prefix in the result
+GROUPS = (
+    ("name", "Name"),
+    ("capability", "Capability"),
+    ("test_type", "Behavior type")
+)
+
 
 class LightningPerformer(pl.Callback):
-    def __init__(self, postprocessor: Optional[Callable] = None):
+    """
+    Computes the performance summary of a PyTorchTestPack evaluated with 'Trainer.test'. The metadata of each
+    sample is integer-coded on the host and success counts are scatter-added into per-group tensors kept on
+    the device of the predictions, so that batches never trigger a host synchronization. The counts of every
+    process are summed at the end of a distributed evaluation.
+    """
+
+    def __init__(self, postprocessor: Optional[Callable] = None, initial_capacity: int = 64):
+        """
+        :param postprocessor: function computing the success of each sample from the batch and the outputs of
+                              the model, defaults to comparing the labels to the outputs
+        :param initial_capacity: number of groups of each grouping the counts are allocated for, grown as needed
+        """
         super(LightningPerformer, self).__init__()
         self.postprocessor = postprocessor
+        self.initial_capacity = initial_capacity
 
         self.result = None
-        self.all = []
-        self.per_capability = defaultdict(list)
-        self.per_name = defaultdict(list)
-        self.per_type = defaultdict(list)
+        self.categories = {}
+        self.success = {}
+        self.support = {}
+        self.reset()
+
+    def reset(self) -> None:
+        """"""
+        self.categories = {key: {} for key, _ in GROUPS}
+        self.success = {}
+        self.support = {}
+
+    def on_test_start(self, trainer: "pl.Trainer", pl_module: "pl.LightningModule") -> None:
+        self.reset()
 
     def on_test_batch_end(self, trainer: "pl.Trainer", pl_module: "pl.LightningModule", outputs: Optional[STEP_OUTPUT],
-                          batch: Any, batch_idx: int, dataloader_idx: int) -> None:
+                          batch: Any, batch_idx: int, dataloader_idx: int = 0) -> None:
         if self.postprocessor:
             success = self.postprocessor(batch, outputs)
         else:
             success = batch["labels"] == outputs
+        success = torch.as_tensor(success).reshape(-1).long()
+
+        for key, _ in GROUPS:
+            values = batch[key]
+            if isinstance(values, str):
+                values = [values]
+            if len(values) == 1 and len(success) > 1:
+                values = list(values) * len(success)
 
-        self.all.append(success)
-        self.per_capability[batch["capability"]].append(success)
-        self.per_name[batch["name"]].append(success)
-        self.per_type[batch["test_type"]].append(success)
+            codes = [self.categories[key].setdefault(value, len(self.categories[key])) for value in values]
+            codes = torch.as_tensor(codes, dtype=torch.long).to(success.device, non_blocking=True)
+            self._reserve(key, len(self.categories[key]), success.device)
+            self.success[key].index_add_(0, codes, success)
+            self.support[key].index_add_(0, codes, torch.ones_like(success))
+
+    def _reserve(self, key: str, n_categories: int, device: torch.device) -> None:
+        """Grows (doubling) the count tensors of a grouping so that they hold at least 'n_categories' groups"""
+        if key not in self.success:
+            capacity = max(self.initial_capacity, n_categories)
+            self.success[key] = torch.zeros(capacity, dtype=torch.long, device=device)
+            self.support[key] = torch.zeros(capacity, dtype=torch.long, device=device)
+        elif n_categories > len(self.success[key]):
+            extra = max(len(self.success[key]), n_categories - len(self.success[key]))
+            self.success[key] = torch.cat([self.success[key], self.success[key].new_zeros(extra)])
+            self.support[key] = torch.cat([self.support[key], self.support[key].new_zeros(extra)])
 
     def on_test_end(self, trainer: "pl.Trainer", pl_module: "pl.LightningModule") -> None:
-        total_success = {"Total": [np.mean(self.all), f"{np.sum(self.all)}/{len(self.all)}"]}
-        per_name_success = {
-            f"Name - {key}": [np.mean(val), f"{np.sum(val)}/{len(val)}"] for key, val in self.per_name.items()
-        }
-        per_capability_success = {
-            f"Capability - {key}": [np.mean(val), f"{np.sum(val)}/{len(val)}"] for key, val in
-            self.per_capability.items()
-        }
-        per_type_success = {
-            f"Behavior type - {key}": [np.mean(val), f"{np.sum(val)}/{len(val)}"] for key, val in self.per_type.items()
-        }
-        self.result = reduce(lambda x, y: dict(x, **y),
-                             (total_success, per_name_success, per_capability_success, per_type_success))
+        counts = {}
+        for key, _ in GROUPS:
+            categories = list(self.categories[key])
+            self._reserve(key, len(categories), pl_module.device)
+            success, support = self.success[key][:len(categories)], self.support[key][:len(categories)]
+            if dist.is_available() and dist.is_initialized():
+                categories, success, support = self._all_reduce(categories, success, support)
+            counts[key] = (categories, success.tolist(), support.tolist())
+
+        _, name_success, name_support = counts["name"]
+        self.result = {"Total": self._score(sum(name_success), sum(name_support))}
+        for key, prefix in GROUPS:
+            categories, success, support = counts[key]
+            self.result.update({
+                f"{prefix} - {category}": self._score(n_success, n_support)
+                for category, n_success, n_support in zip(categories, success, support)
+            })
 
         for logger in trainer.loggers:
             logger.log_hyperparams(self.result)
+
+    @staticmethod
+    def _all_reduce(categories: List[str], success: torch.Tensor,
+                    support: torch.Tensor) -> Tuple[List[str], torch.Tensor, torch.Tensor]:
+        """
+        Sums the counts of every process: local codes are mapped to the union of the categories seen by all the
+        processes before the counts are all-reduced.
+        """
+        all_categories = [None] * dist.get_world_size()
+        dist.all_gather_object(all_categories, categories)
+        global_categories = list(dict.fromkeys(category for rank_categories in all_categories
+                                               for category in rank_categories))
+        codes = {category: code for code, category in enumerate(global_categories)}
+
+        index = torch.as_tensor([codes[category] for category in categories], dtype=torch.long,
+                                device=success.device)
+        global_success = success.new_zeros(len(global_categories)).index_add_(0, index, success)
+        global_support = support.new_zeros(len(global_categories)).index_add_(0, index, support)
+        dist.all_reduce(global_success)
+        dist.all_reduce(global_support)
+        return global_categories, global_success, global_support
+
+    @staticmethod
+    def _score(n_success: int, support: int) -> List[Any]:
+        """Accuracy and support of a group of samples"""
+        return [n_success / support if support else float("nan"), f"{n_success}/{support}"]
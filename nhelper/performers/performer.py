@@ -1,29 +1,109 @@
 import logging
 from collections import defaultdict
-from functools import reduce
-from typing import List
+from enum import Enum
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
 
 import numpy as np
 from tabulate import tabulate
 
 from nhelper.behavior import Behavior
+from nhelper.metrics import SPAN_MATCH_MODES, confusion_matrix, precision_recall_f1
+from nhelper.outputs import MultiLabelOutputStore, OutputStore, SequenceOutputStore, SpanOutputStore, \
+    TokenOutputStore
+
+# Behavior attributes the success is broken down by, and their prefix in the result
+GROUPS = (
+    ("name", "Name"),
+    ("test_type", "Behavior type"),
+    ("capability", "Capability")
+)
+
+# output-level grouping key: the true label of sequence classification outputs
+LABEL = "label"
+
+# prefix in the result of each known grouping key
+PREFIXES = dict(GROUPS, **{LABEL: "Label"})
+
+METRIC_TYPES = ("weighted", "macro")
+
+# Span-level counts summed over the outputs when span metrics are requested
+SPAN_COLUMNS = ("tp", "fp", "fn", "n_pred")
+
+# confidence of the predictions and confidence of the successful ones, summed for the confidence-weighted accuracy
+CONFIDENCE_COLUMNS = ("confidence", "confident_success")
+
+# token-level and entity-level counts summed over the outputs when token metrics are requested
+TOKEN_COLUMNS = ("n_correct_tokens", "n_tokens", "entity_tp", "entity_fp", "entity_fn", "n_pred_entities")
+
+# wrong label values, label values and exact matches of the multi-label outputs, summed when class metrics are requested
+MULTILABEL_COLUMNS = ("label_errors", "n_label_values", "subset_success", "subset_support")
+
+# per-class counts keyed by (task, label), and confusion counts keyed by (true label, predicted label)
+CLASS_COLUMNS = ("class_tp", "class_fp", "class_fn")
+CONFUSION = "confusion"
+
+# tasks the classes belong to: labels of single-label outputs and label columns of multi-label outputs
+SINGLE_LABEL, MULTI_LABEL = "single-label", "multi-label"
 
 
 class Performer(object):
     """Object use to compute a performance summary of a list of Behaviors."""
 
-    def __init__(self, metric_type: str = "weighted", binarize: bool = False):
+    def __init__(self, metric_type: str = "weighted", binarize: bool = False, span_match: Optional[str] = None,
+                 iou_threshold: float = 0.5, group_by: Optional[Sequence[Union[str, Tuple[str, ...]]]] = None,
+                 confidence_weighted: bool = False, token_metrics: bool = False, outside_label: Any = 0,
+                 class_metrics: bool = False):
         """
-        :param metric_type: aggregation type
+        :param metric_type: aggregation type, "weighted" (accuracy over all the outputs of a group) or "macro"
+                            (mean of the accuracies of the Behaviors of a group)
         :param binarize: whether to compute performance on binarized predictions.
+        :param span_match: if set, span-level precision, recall and F1 of the span classification Behaviors are
+                           also computed, spans matching either "exact"ly, on "overlap" or on "iou" above a threshold
+        :param iou_threshold: minimum intersection over union of two matching spans for the "iou" span matching
+        :param group_by: groupings the result is broken down by, in addition to the total. A grouping is a key or a
+                         tuple of keys (cross-tab), a key being a Behavior attribute (e.g. "capability") or "label",
+                         the true label of sequence classification outputs. Defaults to "name", "test_type" and
+                         "capability".
+        :param confidence_weighted: whether to also compute the accuracy weighted by the confidence of the
+                                    predictions ('y_pred_prob'), outputs without confidence being left out
+        :param token_metrics: whether to also compute the token-level accuracy and the entity-level precision,
+                              recall and F1 of the token classification Behaviors
+        :param outside_label: label of the tokens outside of any entity, for the entity-level metrics
+        :param class_metrics: whether to also compute the per-class precision, recall and F1 and the confusion
+                              matrix of the sequence classification Behaviors, as well as the Hamming loss and
+                              subset accuracy of the multi-label ones. Classes of single-label and multi-label
+                              Behaviors are reported separately.
         """
+        if span_match is not None and span_match not in SPAN_MATCH_MODES:
+            raise ValueError(f"Unknown span matching mode '{span_match}', expected one of {SPAN_MATCH_MODES}.")
+        if metric_type not in METRIC_TYPES:
+            raise ValueError(f"Unknown metric type '{metric_type}', expected one of {METRIC_TYPES}.")
         self.metric_type = metric_type
         self.success_attr = "success" if not binarize else "binary_success"
         print(self.success_attr)
+        self.span_match = span_match
+        self.iou_threshold = iou_threshold
+        self.confidence_weighted = confidence_weighted
+        self.token_metrics = token_metrics
+        self.outside_label = outside_label
+        self.class_metrics = class_metrics
+
+        group_by = group_by if group_by is not None else [column for column, _ in GROUPS]
+        self.groupings = [(grouping,) if isinstance(grouping, str) else tuple(grouping) for grouping in group_by]
 
         self.eps = 1e-8
         self._is_fitted = False
         self.result = None
+        self.span_result = None
+        self.confidence_result = None
+        self.token_result = None
+        self.multilabel_result = None
+        self.class_result = None
+        self.confusion_matrix = None
+        self.columns = None
+        self.categories = None
+        self._sums = {}
+        self._contributions = {}
 
     def fit(self, behaviors: List[Behavior]) -> None:
         """
@@ -37,46 +117,396 @@ class Performer(object):
             logging.info(f"The behaviors were not run, running them now...")
             [b.run() for b in behaviors]
 
-        flatten_outputs = [output for behavior in behaviors for output in behavior.outputs]
+        self.add(behaviors)
 
-        total_success = [getattr(output, self.success_attr) for output in flatten_outputs]
-        total_acc = {"Total": [np.mean(total_success), f"{np.sum(total_success)}/{len(total_success)}"]}
+        logging.info("'Performer' has been successfully fitted.")
 
-        # Retrieving accuracy per 'Behavior'
-        named_success = {
-            f"Name - {behavior.name}": [getattr(output, self.success_attr) for output in behavior.outputs]
-            for behavior in behaviors
-        }
+    def partial_fit(self, behavior: Behavior, outputs: Optional[Union[List[Any], OutputStore]] = None) -> None:
+        """
+        Adds a chunk of outputs of a Behavior to the aggregated result without keeping them, so that
+        Behaviors streamed chunk by chunk (see 'Behavior.stream') are evaluated in constant memory.
 
-        per_name_acc = {
-            key: [np.mean(val), f"{np.sum(val)}/{len(val)}"] for key, val in named_success.items()
-        }
+        :param behavior: Behavior the outputs belong to
+        :param outputs: chunk of outputs, defaults to all the outputs of the Behavior
+        """
+        self.add([behavior], [outputs if outputs is not None else behavior.outputs])
 
-        # Retrieving accuracy per 'Behavior.capability'
-        per_capability_acc = defaultdict(list)
-        for behavior in behaviors:
-            per_capability_acc[f"Capability - {behavior.capability}"].extend(
-                [getattr(output, self.success_attr) for output in behavior.outputs]
-            )
-        per_capability_acc = {
-            key: [np.mean(val), f"{np.sum(val)}/{len(val)}"] for key, val in per_capability_acc.items()
-        }
+    def add(self, behaviors: List[Behavior], outputs: Optional[List[Union[List[Any], OutputStore]]] = None) -> None:
+        """
+        Adds the contributions of ran Behaviors to the aggregated result, whether the Performer is already
+        fitted or not.
+
+        :param behaviors: list of ran Behaviors
+        :param outputs: outputs of each Behavior, defaults to their 'outputs' attribute
+        """
+        self.columns, self.categories = self._to_columns(behaviors, outputs)
+        contributions = self._aggregate(self.columns, self.categories, len(behaviors))
+        if self.class_metrics:
+            self._class_contributions(contributions, outputs if outputs is not None else
+                                      [behavior.outputs for behavior in behaviors])
+        self._accumulate(contributions, behaviors)
+        self._update_result()
+        self._is_fitted = True
+
+    def remove(self, names: List[str]) -> None:
+        """
+        Subtracts the contributions of previously added Behaviors from the aggregated result, e.g. before
+        adding them back once modified. Groups left without any output are dropped from the result.
+
+        :param names: names of the Behaviors to remove
+        """
+        for name in names:
+            if name not in self._contributions:
+                raise ValueError(f"Behavior '{name}' has not been added to the Performer.")
+            for column, sums in self._contributions.pop(name).items():
+                for key, value in sums.items():
+                    self._sums[column][key] -= value
+
+        empty_keys = [key for key, support in self._sums.get("support", {}).items() if support == 0]
+        for column in self._summed_columns():
+            for key in empty_keys:
+                del self._sums[column][key]
+        if self.class_metrics:
+            for key in [key for key, count in self._sums[CONFUSION].items() if count == 0]:
+                del self._sums[CONFUSION][key]
+            for key in [key for key in self._sums["class_tp"]
+                        if not any(self._sums[column][key] for column in CLASS_COLUMNS)]:
+                for column in CLASS_COLUMNS:
+                    del self._sums[column][key]
+        self._update_result()
+
+    def _to_columns(self, behaviors: List[Behavior], outputs: Optional[List[Union[List[Any], OutputStore]]] = None) \
+            -> Tuple[Dict[str, np.ndarray], Dict[str, List[str]]]:
+        """
+        Gathers the outputs of the Behaviors in a columnar store: the summed columns (success, support...),
+        the Behavior of each output and one integer-coded column per grouping key.
+
+        :param behaviors: list of ran Behaviors
+        :param outputs: outputs of each Behavior, defaults to their 'outputs' attribute
+        :return: columns and categories (code -> value) of the integer-coded columns
+        """
+        if outputs is None:
+            outputs = [behavior.outputs for behavior in behaviors]
+
+        n_outputs = [len(behavior_outputs) for behavior_outputs in outputs]
+        success = np.concatenate([np.zeros(0, dtype=bool)] + [self._success(behavior_outputs)
+                                                              for behavior_outputs in outputs])
+        behavior_idx = np.repeat(np.arange(len(behaviors)), n_outputs)
+
+        columns, categories = {"success": success, "support": np.ones(len(success), dtype=np.int64),
+                               "behavior": behavior_idx}, {}
+        if self.span_match is not None:
+            counts = [self._span_counts(behavior_outputs) for behavior_outputs in outputs]
+            for i, column in enumerate(SPAN_COLUMNS):
+                columns[column] = np.concatenate([np.zeros(0, dtype=np.int64)] + [count[i] for count in counts])
+
+        if self.token_metrics:
+            counts = [self._token_counts(behavior_outputs) for behavior_outputs in outputs]
+            for i, column in enumerate(TOKEN_COLUMNS):
+                columns[column] = np.concatenate([np.zeros(0, dtype=np.int64)] + [count[i] for count in counts])
+
+        if self.class_metrics:
+            counts = [self._multilabel_counts(behavior_outputs) for behavior_outputs in outputs]
+            for i, column in enumerate(MULTILABEL_COLUMNS):
+                columns[column] = np.concatenate([np.zeros(0, dtype=np.int64)] + [count[i] for count in counts])
+
+        if self.confidence_weighted:
+            confidence = np.concatenate([np.zeros(0)] + [self._confidence(behavior_outputs)
+                                                         for behavior_outputs in outputs])
+            columns["confidence"] = confidence
+            columns["confident_success"] = confidence * success
 
-        # Retrieving accuracy per 'BehaviorType'
-        per_behavior_type_acc = defaultdict(list)
-        for behavior in behaviors:
-            per_behavior_type_acc[f"Behavior type - {behavior.test_type.value}"].extend(
-                [getattr(output, self.success_attr) for output in behavior.outputs]
-            )
-        per_behavior_type_acc = {
-            key: [np.mean(val), f"{np.sum(val)}/{len(val)}"] for key, val in per_behavior_type_acc.items()
+        for key in dict.fromkeys(key for grouping in self.groupings for key in grouping):
+            if key == LABEL:
+                values = [label for behavior_outputs in outputs for label in self._labels(behavior_outputs)]
+                codes = {value: code for code, value in
+                         enumerate(value for value in dict.fromkeys(values) if value is not None)}
+                columns[key] = np.fromiter((codes.get(value, -1) for value in values), dtype=np.int64,
+                                           count=len(values))
+            else:
+                values = [getattr(behavior, key) for behavior in behaviors]
+                values = [value.value if isinstance(value, Enum) else value for value in values]
+                codes = {value: code for code, value in enumerate(dict.fromkeys(values))}
+                behavior_codes = np.array([codes[value] for value in values], dtype=np.int64)
+                columns[key] = behavior_codes[behavior_idx]
+            categories[key] = list(codes)
+        return columns, categories
+
+    def _success(self, outputs: Union[List[Any], OutputStore]) -> np.ndarray:
+        """Boolean success of every output of a Behavior"""
+        if isinstance(outputs, OutputStore):
+            return outputs.success(binarize=self.success_attr == "binary_success")
+        return np.fromiter((getattr(output, self.success_attr) for output in outputs), dtype=bool,
+                           count=len(outputs))
+
+    def _span_counts(self, outputs: Union[List[Any], OutputStore]) -> Tuple[np.ndarray, ...]:
+        """Span-level true positives, false positives, false negatives and predictions of every output"""
+        if isinstance(outputs, SpanOutputStore):
+            tp, fp, fn = outputs.span_counts(self.span_match, self.iou_threshold,
+                                             binarize=self.success_attr == "binary_success")
+            return tp, fp, fn, outputs.y_pred.lengths()
+        return tuple(np.zeros(len(outputs), dtype=np.int64) for _ in SPAN_COLUMNS)
+
+    def _token_counts(self, outputs: Union[List[Any], OutputStore]) -> Tuple[np.ndarray, ...]:
+        """Correct and true tokens, entity-level true positives, false positives, false negatives and predictions"""
+        if isinstance(outputs, TokenOutputStore):
+            return outputs.token_counts() + outputs.entity_counts(self.outside_label)
+        return tuple(np.zeros(len(outputs), dtype=np.int64) for _ in TOKEN_COLUMNS)
+
+    @staticmethod
+    def _multilabel_counts(outputs: Union[List[Any], OutputStore]) -> Tuple[np.ndarray, ...]:
+        """Wrong label values, label values, exact match and support of every multi-label output"""
+        if isinstance(outputs, MultiLabelOutputStore):
+            y_pred, y = outputs.indicators()
+            subset_success = (y_pred == y).all(axis=1)
+            return ((y_pred != y).sum(axis=1), np.full(len(y), y.shape[1]), subset_success,
+                    np.ones(len(y), dtype=np.int64))
+        return tuple(np.zeros(len(outputs), dtype=np.int64) for _ in MULTILABEL_COLUMNS)
+
+    @staticmethod
+    def _class_contributions(contributions: List[Dict[str, Dict[Any, float]]],
+                             outputs: List[Union[List[Any], OutputStore]]) -> None:
+        """
+        Adds to the contribution of each Behavior its per-class true positives, false positives and false
+        negatives, and its confusion counts. The labels of all the single-label outputs are integer-coded at
+        once, so that the counts of every Behavior are a single scatter-add over the outputs.
+        """
+        single_label = [i for i, behavior_outputs in enumerate(outputs)
+                        if isinstance(behavior_outputs, SequenceOutputStore) and
+                        not isinstance(behavior_outputs, MultiLabelOutputStore)]
+        if single_label:
+            # labels are compared in their string form, as validated by the output model
+            y_pred = [np.asarray(outputs[i].y_pred, dtype=str) for i in single_label]
+            y = [np.asarray(outputs[i].y, dtype=str) for i in single_label]
+            labels, codes = np.unique(np.concatenate(y_pred + y), return_inverse=True)
+            codes = codes.ravel()
+            n_outputs = sum(len(behavior_y) for behavior_y in y)
+            pred_codes, true_codes = codes[:n_outputs], codes[n_outputs:]
+            behavior_idx = np.repeat(np.arange(len(single_label)), [len(behavior_y) for behavior_y in y])
+
+            n_labels = len(labels)
+            confusion = np.bincount((behavior_idx * n_labels + true_codes) * n_labels + pred_codes,
+                                    minlength=len(single_label) * n_labels * n_labels)
+            confusion = confusion.reshape(len(single_label), n_labels, n_labels)
+            labels = labels.tolist()
+            for i, behavior_confusion in zip(single_label, confusion):
+                tp = np.diagonal(behavior_confusion)
+                class_counts = (tp, behavior_confusion.sum(axis=0) - tp, behavior_confusion.sum(axis=1) - tp)
+                Performer._add_class_counts(contributions[i], [(SINGLE_LABEL, label) for label in labels],
+                                            class_counts)
+                true_idx, pred_idx = np.nonzero(behavior_confusion)
+                contributions[i][CONFUSION] = {
+                    (labels[t], labels[p]): count for t, p, count in
+                    zip(true_idx.tolist(), pred_idx.tolist(), behavior_confusion[true_idx, pred_idx].tolist())
+                }
+
+        for i, behavior_outputs in enumerate(outputs):
+            if isinstance(behavior_outputs, MultiLabelOutputStore) and len(behavior_outputs):
+                y_pred, y = (indicators.astype(bool) for indicators in behavior_outputs.indicators())
+                class_counts = ((y_pred & y).sum(axis=0), (y_pred & ~y).sum(axis=0), (~y_pred & y).sum(axis=0))
+                Performer._add_class_counts(contributions[i], [(MULTI_LABEL, label) for label in range(y.shape[1])],
+                                            class_counts)
+
+    @staticmethod
+    def _add_class_counts(contribution: Dict[str, Dict[Any, float]], labels: List[Tuple[str, Any]],
+                          class_counts: Tuple[np.ndarray, ...]) -> None:
+        """Adds the per-class counts of the labels present in the outputs of a Behavior to its contribution"""
+        present = np.flatnonzero(sum(class_counts))
+        for column, counts in zip(CLASS_COLUMNS, class_counts):
+            contribution[column] = {labels[label]: count for label, count in zip(present.tolist(),
+                                                                                  counts[present].tolist())}
+
+    @staticmethod
+    def _confidence(outputs: Union[List[Any], OutputStore]) -> np.ndarray:
+        """Confidence of every output, its 'y_pred_prob' (averaged for multi-label outputs), 0 if missing"""
+        probs = outputs.y_pred_prob if isinstance(outputs, SequenceOutputStore) else \
+            [getattr(output, "y_pred_prob", None) for output in outputs]
+        return np.fromiter(
+            (0. if prob is None else float(np.mean(prob)) if isinstance(prob, (list, tuple)) else float(prob)
+             for prob in probs),
+            dtype=float, count=len(probs)
+        )
+
+    @staticmethod
+    def _labels(outputs: Union[List[Any], OutputStore]) -> List[Optional[str]]:
+        """True label of every output, in its string form, None for outputs without a single label"""
+        if isinstance(outputs, SequenceOutputStore) and not isinstance(outputs, MultiLabelOutputStore):
+            return [str(label) for label in outputs.y]
+        return [None] * len(outputs)
+
+    def _summed_columns(self) -> Tuple[str, ...]:
+        """Columns summed over the groups"""
+        return ("success", "support") + (SPAN_COLUMNS if self.span_match is not None else ()) + \
+               (CONFIDENCE_COLUMNS if self.confidence_weighted else ()) + \
+               (TOKEN_COLUMNS if self.token_metrics else ()) + \
+               (MULTILABEL_COLUMNS if self.class_metrics else ())
+
+    def _aggregate(self, columns: Dict[str, np.ndarray], categories: Dict[str, List[str]],
+                   n_behaviors: int) -> List[Dict[str, Dict[str, float]]]:
+        """
+        Sums the summed columns over the total and every group of every grouping, Behavior by Behavior. The keys
+        of a grouping are combined into a single integer code per output (mixed radix), so that each grouping is
+        a single pass over the outputs whatever its number of keys.
+
+        :param columns: columns of the outputs
+        :param categories: categories of the integer-coded columns
+        :param n_behaviors: number of Behaviors the outputs belong to
+        :return: for each Behavior, the sums of each column keyed as in 'self.result'
+        """
+        contributions = [defaultdict(dict) for _ in range(n_behaviors)]
+        behavior_idx = columns["behavior"]
+        for grouping in [()] + self.groupings:
+            shape = [len(categories[key]) for key in grouping]
+            valid = np.ones(len(behavior_idx), dtype=bool)
+            for key in grouping:
+                valid &= columns[key] >= 0
+            group_codes = np.ravel_multi_index([columns[key][valid] for key in grouping], shape) if grouping else \
+                np.zeros(int(valid.sum()), dtype=np.int64)
+
+            # (Behavior, group) pairs present in the outputs
+            n_groups = int(np.prod(shape)) if grouping else 1
+            pairs, pair_idx = np.unique(behavior_idx[valid] * n_groups + group_codes, return_inverse=True)
+            pair_behaviors, pair_groups = np.divmod(pairs, n_groups)
+            groups, group_idx = np.unique(pair_groups, return_inverse=True)
+            group_keys = self._keys(grouping, groups, shape, categories)
+            keys = [group_keys[i] for i in group_idx.ravel().tolist()]
+
+            for column in self._summed_columns():
+                sums = np.bincount(pair_idx.ravel(), weights=columns[column][valid], minlength=len(pairs))
+                for behavior, key, value in zip(pair_behaviors.tolist(), keys, sums.tolist()):
+                    contributions[behavior][column][key] = value
+        return contributions
+
+    @staticmethod
+    def _keys(grouping: Tuple[str, ...], groups: np.ndarray, shape: List[int],
+              categories: Dict[str, List[str]]) -> List[str]:
+        """Keys of groups in the result, e.g. 'Capability - Negation' or 'Capability × Label - Negation × 1'"""
+        if not grouping:
+            return ["Total"] * len(groups)
+        codes = [key_codes.tolist() for key_codes in np.unravel_index(groups, shape)]
+        prefix = " × ".join(PREFIXES.get(key, key.replace("_", " ").capitalize()) for key in grouping)
+        values = zip(*(
+            [str(categories[key][code]) for code in key_codes] for key, key_codes in zip(grouping, codes)
+        ))
+        return [f"{prefix} - {' × '.join(group_values)}" for group_values in values]
+
+    def _accumulate(self, contributions: List[Dict[str, Dict[str, float]]], behaviors: List[Behavior]) -> None:
+        """
+        Adds the contributions of the Behaviors to the running sums. The contribution of each Behavior is also
+        recorded so that it can be removed later on.
+        """
+        for column in self._summed_columns() + ((CONFUSION,) + CLASS_COLUMNS if self.class_metrics else ()):
+            self._sums.setdefault(column, {})
+        for behavior, behavior_contributions in zip(behaviors, contributions):
+            recorded = self._contributions.setdefault(behavior.name, {})
+            for column, sums in behavior_contributions.items():
+                running_sums = self._sums.setdefault(column, {})
+                recorded_sums = recorded.setdefault(column, {})
+                for key, value in sums.items():
+                    running_sums[key] = running_sums.get(key, 0) + value
+                    recorded_sums[key] = recorded_sums.get(key, 0) + value
+
+    def _update_result(self) -> None:
+        """Computes the result from the running sums, ordered as 'Total' then by grouping"""
+        prefix_rank = {
+            " × ".join(PREFIXES.get(key, key.replace("_", " ").capitalize()) for key in grouping): rank
+            for rank, grouping in enumerate(self.groupings, start=1)
         }
+        keys = sorted(self._sums["success"], key=lambda key: prefix_rank.get(key.split(" - ")[0], 0))
 
-        self.result = reduce(lambda x, y: dict(x, **y),
-                             (total_acc, per_name_acc, per_behavior_type_acc, per_capability_acc))
-        logging.info("'Performer' has been successfully fitted.")
-        self._is_fitted = True
+        successes, supports = self._sums["success"], self._sums["support"]
+        if self.metric_type == "macro":
+            accuracies = defaultdict(list)
+            for contribution in self._contributions.values():
+                for key, support in contribution.get("support", {}).items():
+                    if support:
+                        accuracies[key].append(contribution["success"][key] / support)
+            self.result = {
+                key: [float(np.mean(accuracies[key])) if accuracies[key] else np.nan,
+                      self._score(successes[key], supports[key])[1]]
+                for key in keys
+            }
+        else:
+            self.result = {key: self._score(successes[key], supports[key]) for key in keys}
+
+        if self.span_match is not None:
+            tp, fp, fn, n_pred = (self._sums[column] for column in SPAN_COLUMNS)
+            self.span_result = {
+                key: list(precision_recall_f1(tp[key], fp[key], fn[key], n_pred[key])) for key in keys
+            }
+
+        if self.confidence_weighted:
+            confidence, confident_success = (self._sums[column] for column in CONFIDENCE_COLUMNS)
+            self.confidence_result = {
+                key: confident_success[key] / confidence[key] if confidence[key] else np.nan for key in keys
+            }
+
+        if self.token_metrics:
+            n_correct, n_tokens, tp, fp, fn, n_pred = (self._sums[column] for column in TOKEN_COLUMNS)
+            self.token_result = {
+                key: [n_correct[key] / n_tokens[key] if n_tokens[key] else np.nan] +
+                     list(precision_recall_f1(tp[key], fp[key], fn[key], n_pred[key]))
+                for key in keys
+            }
+
+        if self.class_metrics:
+            errors, n_values, subset_success, subset_support = (self._sums[column] for column in MULTILABEL_COLUMNS)
+            self.multilabel_result = {
+                key: [errors[key] / n_values[key] if n_values[key] else np.nan,
+                      subset_success[key] / subset_support[key] if subset_support[key] else np.nan]
+                for key in keys
+            }
+
+            tp, fp, fn = (self._sums[column] for column in CLASS_COLUMNS)
+            self.class_result = {}
+            for task, label in sorted(tp, key=lambda key: (key[0], self._label_order(key[1]))):
+                key = (task, label)
+                self.class_result.setdefault(task, {})[label] = \
+                    list(precision_recall_f1(tp[key], fp[key], fn[key], tp[key] + fp[key])) + [int(tp[key] + fn[key])]
+
+            labels = sorted({label for pair in self._sums[CONFUSION] for label in pair}, key=self._label_order)
+            codes = {label: code for code, label in enumerate(labels)}
+            pairs = list(self._sums[CONFUSION].items())
+            self.confusion_matrix = (labels, confusion_matrix(
+                [codes[true] for (true, _), _ in pairs], [codes[pred] for (_, pred), _ in pairs], len(labels),
+                weights=[count for _, count in pairs]
+            ))
+
+    @staticmethod
+    def _label_order(label: Any) -> Tuple:
+        """Sort key of labels, numerical labels first and in numerical order"""
+        try:
+            return 0, float(label), ""
+        except (TypeError, ValueError):
+            return 1, 0., str(label)
+
+    @staticmethod
+    def _score(n_success: float, support: int) -> List[Any]:
+        """Accuracy and support of a group of outputs"""
+        return [n_success / support if support else np.nan, f"{int(n_success)}/{int(support)}"]
 
     def tabulate_result(self):
         """Prettify results"""
-        return tabulate([[key] + value for key, value in self.result.items()], headers=["Test", "Acc", "Support"])
+        headers = ["Test", "Acc", "Support"]
+        rows = [[key] + value for key, value in self.result.items()]
+        if self.confidence_result is not None:
+            headers.append("Conf. acc")
+            rows = [row + [self.confidence_result[row[0]]] for row in rows]
+        if self.span_result is not None:
+            headers += ["Precision", "Recall", "F1"]
+            rows = [row + self.span_result[row[0]] for row in rows]
+        if self.token_result is not None:
+            headers += ["Token acc", "Entity P", "Entity R", "Entity F1"]
+            rows = [row + self.token_result[row[0]] for row in rows]
+        if self.multilabel_result is not None:
+            headers += ["Hamming loss", "Subset acc"]
+            rows = [row + self.multilabel_result[row[0]] for row in rows]
+        return tabulate(rows, headers=headers)
+
+    def tabulate_classes(self):
+        """Prettify per-class results"""
+        if self.class_result is None:
+            raise ValueError("Per-class results require a Performer with 'class_metrics' enabled.")
+        rows = [[task, label] + value for task, task_result in self.class_result.items()
+                for label, value in task_result.items()]
+        return tabulate(rows, headers=["Task", "Label", "Precision", "Recall", "F1", "Support"])
@@ -0,0 +1,170 @@
+import cProfile
+import io
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+
+class TimedPredictFn(object):
+    """Wraps a prediction function to count its calls and time them, recording the size of each batch"""
+
+    def __init__(self, predict_fn: Callable):
+        """
+        :param predict_fn: prediction function to wrap
+        """
+        self.predict_fn = predict_fn
+        self.wall = 0.
+        self.batch_sizes = []
+
+    def __call__(self, texts: List[str]) -> List[Any]:
+        start = time.perf_counter()
+        predictions = self.predict_fn(texts)
+        self.wall += time.perf_counter() - start
+        self.batch_sizes.append(len(texts))
+        return predictions
+
+
+def profile_run(behavior: Any, run: Callable[[], Any]) -> Tuple[Any, Dict[str, Any]]:
+    """
+    Calls 'run' with the 'predict_fn' of a Behavior timed. The CPU time is that of the calling thread, so that
+    Behaviors run concurrently by threads are told apart. Defined at module level to be used in worker processes.
+
+    :param behavior: Behavior whose 'predict_fn' is called by 'run'
+    :param run: function running the Behavior, e.g. 'behavior.run'
+    :return: result of 'run' and timings of the Behavior
+    """
+    timed = TimedPredictFn(behavior.predict_fn)
+    behavior.predict_fn = timed
+    wall, cpu = time.perf_counter(), time.thread_time()
+    try:
+        result = run()
+    finally:
+        behavior.predict_fn = timed.predict_fn
+    return result, {"wall": time.perf_counter() - wall, "cpu": time.thread_time() - cpu,
+                    "predict_wall": timed.wall, "batch_sizes": timed.batch_sizes}
+
+
+class Profiler(object):
+    """
+    Collects the timings of the runs of a TestPack: wall and CPU time of each phase (running the Behaviors,
+    fitting the performer...), time spent in and outside of 'predict_fn' by each Behavior, throughput, number
+    and size of the calls to 'predict_fn'. cProfile (calling thread only) and tracemalloc can also be captured.
+    """
+
+    def __init__(self, cprofile: bool = False, trace_memory: bool = False, top: int = 20):
+        """
+        :param cprofile: whether to profile the runs with cProfile
+        :param trace_memory: whether to trace the memory allocated during the runs with tracemalloc
+        :param top: number of functions (cProfile) and lines (tracemalloc) reported
+        """
+        self.cprofile = cprofile
+        self.trace_memory = trace_memory
+        self.top = top
+
+        self.phases = {}
+        self.behaviors = {}
+        self.batch_sizes = []
+        self.predict_wall = 0.
+        self._lock = threading.Lock()
+        self._profile = None
+        self._snapshot = None
+        self._peak_memory = None
+        self._started_tracing = False
+
+    def reset(self) -> None:
+        """"""
+        self.phases = {}
+        self.behaviors = {}
+        self.batch_sizes = []
+        self.predict_wall = 0.
+        self._profile = None
+        self._snapshot = None
+        self._peak_memory = None
+
+    def start(self) -> None:
+        """Starts the optional cProfile and tracemalloc captures"""
+        if self.cprofile:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        if self.trace_memory:
+            self._started_tracing = not tracemalloc.is_tracing()
+            if self._started_tracing:
+                tracemalloc.start()
+
+    def stop(self) -> None:
+        """Stops the optional cProfile and tracemalloc captures"""
+        if self._profile is not None:
+            self._profile.disable()
+        if self.trace_memory:
+            self._snapshot = tracemalloc.take_snapshot()
+            self._peak_memory = tracemalloc.get_traced_memory()[1]
+            if self._started_tracing:
+                tracemalloc.stop()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Times a phase, the timings of a phase entered several times being summed"""
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            timings = self.phases.setdefault(name, {"wall": 0., "cpu": 0.})
+            timings["wall"] += time.perf_counter() - wall
+            timings["cpu"] += time.process_time() - cpu
+
+    def add_behavior(self, name: str, timings: Dict[str, Any], n_samples: int) -> None:
+        """
+        :param name: name of the Behavior
+        :param timings: timings of the Behavior (see 'profile_run')
+        :param n_samples: number of samples of the Behavior
+        """
+        with self._lock:
+            self.behaviors[name] = {
+                "wall": timings["wall"],
+                "cpu": timings["cpu"],
+                "predict_wall": timings["predict_wall"],
+                "outputs_wall": timings["wall"] - timings["predict_wall"],
+                "n_samples": n_samples,
+                "samples_per_sec": n_samples / timings["wall"] if timings["wall"] else None,
+                **self._batch_statistics(timings["batch_sizes"])
+            }
+        self.add_predict_calls(timings["predict_wall"], timings["batch_sizes"])
+
+    def add_predict_calls(self, wall: float, batch_sizes: List[int]) -> None:
+        """Records calls to a 'predict_fn' made outside of a Behavior, e.g. shared by several Behaviors"""
+        with self._lock:
+            self.predict_wall += wall
+            self.batch_sizes.extend(batch_sizes)
+
+    @staticmethod
+    def _batch_statistics(batch_sizes: List[int]) -> Dict[str, Any]:
+        """"""
+        return {
+            "n_predict_calls": len(batch_sizes),
+            "mean_batch_size": sum(batch_sizes) / len(batch_sizes) if batch_sizes else None,
+            "max_batch_size": max(batch_sizes, default=None)
+        }
+
+    def report(self) -> Dict[str, Any]:
+        """
+        :return: JSON-serializable timings of the phases and Behaviors, 'predict_fn' calls, and the cProfile
+                 and tracemalloc captures if enabled
+        """
+        report = {
+            "phases": self.phases,
+            "behaviors": self.behaviors,
+            "predict": {"wall": self.predict_wall, **self._batch_statistics(self.batch_sizes)}
+        }
+        if self._profile is not None:
+            stream = io.StringIO()
+            pstats.Stats(self._profile, stream=stream).sort_stats("cumulative").print_stats(self.top)
+            report["cprofile"] = stream.getvalue()
+        if self._snapshot is not None:
+            report["memory"] = {
+                "peak": self._peak_memory,
+                "top": [str(stat) for stat in self._snapshot.statistics("lineno")[:self.top]]
+            }
+        return report
@@ -0,0 +1,113 @@
+import asyncio
+import inspect
+import logging
+import time
+from typing import Any, Callable, Optional, Tuple, Type
+
+
+class RateLimiter(object):
+    """Token bucket limiting the number of requests issued per second"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        """
+        :param rate: maximum sustained number of requests per second
+        :param burst: maximum number of requests that can be issued at once
+        """
+        if rate <= 0:
+            raise ValueError(f"'rate' should be positive, got {rate}.")
+        self.rate = rate
+        self.burst = burst
+
+        self._tokens = burst
+        self._last = None
+        self._lock = None
+
+    async def acquire(self) -> None:
+        """Waits until a request can be issued"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            now = time.monotonic()
+            if self._last is not None:
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+
+            if self._tokens >= 1:
+                self._tokens -= 1
+            else:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._tokens = 0
+                self._last = time.monotonic()
+
+
+class AsyncScheduler(object):
+    """
+    Schedules calls to a prediction function from asyncio code: bounds the number of in-flight requests,
+    throttles them with an optional 'RateLimiter' and retries failed ones with exponential backoff.
+    Synchronous functions are run in the default thread pool executor.
+    """
+
+    def __init__(self, max_concurrency: int = 8, retries: int = 0, backoff: float = 0.5, max_backoff: float = 30.,
+                 rate_limiter: Optional[RateLimiter] = None, retry_on: Tuple[Type[BaseException], ...] = (Exception,)):
+        """
+        :param max_concurrency: maximum number of requests in flight
+        :param retries: number of times a failed request is retried
+        :param backoff: delay (in seconds) before the first retry, doubled after each failure
+        :param max_backoff: maximum delay (in seconds) between two attempts
+        :param rate_limiter: object throttling the requests
+        :param retry_on: exception types that trigger a retry
+        """
+        if max_concurrency < 1:
+            raise ValueError(f"'max_concurrency' should be a positive integer, got {max_concurrency}.")
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.rate_limiter = rate_limiter
+        self.retry_on = retry_on
+
+        self.n_requests = 0
+        self.n_retries = 0
+        self._semaphore = None
+
+    async def call(self, fn: Callable, *args) -> Any:
+        """
+        Calls 'fn' once a slot is available, retrying it upon failure.
+
+        :param fn: synchronous or asynchronous function
+        :param args: positional arguments of 'fn'
+        :return: result of 'fn'
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        attempt = 0
+        while True:
+            async with self._semaphore:
+                if self.rate_limiter is not None:
+                    await self.rate_limiter.acquire()
+                self.n_requests += 1
+                try:
+                    return await self._call(fn, *args)
+                except self.retry_on as e:
+                    if attempt >= self.retries:
+                        raise
+                    error = e
+
+            delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+            logging.warning(f"Request failed ({error!r}), retrying in {delay:.2f}s...")
+            await asyncio.sleep(delay)
+            attempt += 1
+            self.n_retries += 1
+
+    @staticmethod
+    async def _call(fn: Callable, *args) -> Any:
+        """"""
+        if inspect.iscoroutinefunction(fn):
+            return await fn(*args)
+
+        result = await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
@@ -0,0 +1,348 @@
+import json
+import os
+from collections.abc import Sequence
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Union
+
+import numpy as np
+from pydantic import BaseModel
+
+from . import behavior as behavior_module
+from .behavior import Behavior, PairedSequenceClassificationBehavior
+from .types import BehaviorType, Span, TaskType, Token
+from .utils import EXECUTORS
+
+MANIFEST = "manifest.json"
+FORMAT_VERSION = 1
+
+
+class StringColumn(Sequence):
+    """
+    Read-only column of strings stored contiguously as UTF-8 in a byte buffer and delimited by an
+    offsets array, both memory-mapped from disk by default. Slicing returns a view sharing the buffers,
+    and pickling only ships the location of the column, which is mapped again once unpickled.
+    """
+
+    def __init__(self, folder: str, name: str, start: int = 0, stop: Optional[int] = None, mmap: bool = True):
+        """
+        :param folder: folder the column was written to
+        :param name: name of the column
+        :param start: first row of the view
+        :param stop: row after the last row of the view, the end of the column if None
+        :param mmap: whether to memory-map the column instead of reading it in memory
+        """
+        self.folder = folder
+        self.name = name
+        self.mmap = mmap
+        self._load(start, stop)
+
+    def _load(self, start: int, stop: Optional[int]) -> None:
+        """"""
+        mmap_mode = "r" if self.mmap else None
+        offsets = np.load(os.path.join(self.folder, f"{self.name}.offsets.npy"), mmap_mode=mmap_mode)
+
+        buffer_path = os.path.join(self.folder, f"{self.name}.bin")
+        if self.mmap and os.path.getsize(buffer_path) > 0:
+            self.buffer = np.memmap(buffer_path, dtype=np.uint8, mode="r")
+        else:
+            self.buffer = np.fromfile(buffer_path, dtype=np.uint8)
+
+        stop = len(offsets) - 1 if stop is None else stop
+        self.start, self.stop = start, stop
+        self.offsets = offsets[start:stop + 1]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx: Union[int, slice]):
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(len(self))
+            if step != 1:
+                return [self._get(i) for i in range(start, stop, step)]
+            return self._view(start, max(start, stop))
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("Column index out of range")
+        return self._get(idx)
+
+    def __iter__(self) -> Iterator[Any]:
+        offsets = self.offsets.tolist()
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            yield self._decode(self.buffer[start:end].tobytes())
+
+    def __getstate__(self):
+        return {"folder": self.folder, "name": self.name, "start": self.start, "stop": self.stop, "mmap": self.mmap}
+
+    def __setstate__(self, state):
+        start, stop = state.pop("start"), state.pop("stop")
+        self.__dict__.update(state)
+        self._load(start, stop)
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__}: '{self.name}', {len(self)} rows>"
+
+    def _get(self, idx: int) -> Any:
+        """"""
+        start, end = int(self.offsets[idx]), int(self.offsets[idx + 1])
+        return self._decode(self.buffer[start:end].tobytes())
+
+    def _decode(self, data: bytes) -> Any:
+        """Value of a row from its bytes"""
+        return data.decode("utf-8")
+
+    def _view(self, start: int, stop: int) -> "StringColumn":
+        """View over the rows [start, stop) sharing the buffers of the column"""
+        view = self.__class__.__new__(self.__class__)
+        view.__dict__.update(self.__dict__)
+        view.start, view.stop = self.start + start, self.start + stop
+        view.offsets = self.offsets[start:stop + 1]
+        return view
+
+
+class JsonColumn(StringColumn):
+    """'StringColumn' of JSON documents, each row being decoded when accessed"""
+
+    def __init__(self, folder: str, name: str, start: int = 0, stop: Optional[int] = None, mmap: bool = True,
+                 decoder: Optional[Callable[[Any], Any]] = None):
+        """
+        :param folder: folder the column was written to
+        :param name: name of the column
+        :param start: first row of the view
+        :param stop: row after the last row of the view, the end of the column if None
+        :param mmap: whether to memory-map the column instead of reading it in memory
+        :param decoder: function applied to each decoded JSON document, must be picklable
+        """
+        self.decoder = decoder
+        super().__init__(folder, name, start, stop, mmap)
+
+    def __getstate__(self):
+        return {**super().__getstate__(), "decoder": self.decoder}
+
+    def _decode(self, data: bytes) -> Any:
+        value = json.loads(data)
+        return self.decoder(value) if self.decoder is not None else value
+
+
+class ColumnWriter(object):
+    """Appends strings to the buffer and offsets files of a 'StringColumn'"""
+
+    def __init__(self, folder: str, name: str):
+        """
+        :param folder: folder to write the column to
+        :param name: name of the column
+        """
+        self.folder = folder
+        self.name = name
+        self.offsets = [0]
+        self._writer = open(os.path.join(folder, f"{name}.bin"), "wb")
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def append(self, value: str) -> None:
+        """"""
+        data = value.encode("utf-8")
+        self._writer.write(data)
+        self.offsets.append(self.offsets[-1] + len(data))
+
+    def close(self) -> None:
+        """Flushes the buffer and writes the offsets"""
+        self._writer.close()
+        np.save(os.path.join(self.folder, f"{self.name}.offsets.npy"), np.asarray(self.offsets, dtype=np.int64))
+
+
+def _encode_label(value: Any) -> Any:
+    """JSON encoding of the label values that are not natively serializable"""
+    if isinstance(value, BaseModel):
+        return value.dict()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Label of type '{type(value)}' is not JSON serializable.")
+
+
+def _decode_spans(spans: List[Optional[dict]]) -> List[Optional[Span]]:
+    """"""
+    return [Span(**span) if isinstance(span, dict) else span for span in spans]
+
+
+def _decode_tokens(tokens: List[Union[dict, int]]) -> List[Union[Token, int]]:
+    """"""
+    return [Token(**token) if isinstance(token, dict) else token for token in tokens]
+
+
+LABEL_DECODERS = {
+    TaskType.span_classification: _decode_spans,
+    TaskType.token_classification: _decode_tokens
+}
+
+
+def write_behaviors(behaviors: Iterable[Behavior], folder: str) -> None:
+    """
+    Writes Behaviors in a single columnar pack: samples and (JSON-encoded) labels of all the Behaviors
+    are appended to two 'StringColumn's and a manifest records the metadata and rows of each Behavior.
+    Samples and labels are streamed to disk, without copying the Behaviors. Lazy samples are consumed.
+
+    :param behaviors: Behaviors to write
+    :param folder: folder to write the pack to
+    """
+    Path(folder).mkdir(parents=True, exist_ok=True)
+    behaviors = list(behaviors)
+    for behavior in behaviors:
+        if isinstance(behavior, PairedSequenceClassificationBehavior):
+            raise ValueError(f"Paired Behavior '{behavior.name}' cannot be written in the columnar format, "
+                             f"use the pickle format instead.")
+    samples, labels = ColumnWriter(folder, "samples"), ColumnWriter(folder, "labels")
+
+    entries = []
+    try:
+        for behavior in behaviors:
+            start = len(samples)
+            for sample, label in zip(behavior.samples, behavior.labels):
+                samples.append(sample)
+                labels.append(json.dumps(label, default=_encode_label))
+            entries.append({**_manifest_entry(behavior), "start": start, "stop": len(samples)})
+    finally:
+        samples.close()
+        labels.close()
+
+    _write_manifest(folder, "columnar", entries)
+
+
+def write_pickled_behaviors(behaviors: Iterable[Behavior], folder: str) -> None:
+    """
+    Writes one pickle file per Behavior (see 'Behavior.to_file') and a manifest indexing the files, so that
+    they can be filtered and loaded without listing nor opening the whole folder.
+
+    :param behaviors: Behaviors to write
+    :param folder: folder to write the Behaviors to
+    """
+    Path(folder).mkdir(parents=True, exist_ok=True)
+    entries = [
+        {**_manifest_entry(behavior), "file": os.path.basename(behavior.to_file(folder))} for behavior in behaviors
+    ]
+    _write_manifest(folder, "pickle", entries)
+
+
+def _load_pickle(path: str) -> Behavior:
+    """Loads a pickled Behavior, defined at module level to be shipped to worker processes"""
+    return Behavior.from_file(path)
+
+
+def read_pickled_behaviors(folder: str, names: Optional[Iterable[str]] = None,
+                           capabilities: Optional[Iterable[str]] = None, executor: Optional[str] = "thread",
+                           max_workers: Optional[int] = None) -> List[Behavior]:
+    """
+    Reads pickled Behaviors concurrently. The files to read are taken from the manifest (see
+    'write_pickled_behaviors') and filtered before being opened. Folders written without a manifest
+    are listed, and their Behaviors filtered once loaded.
+
+    :param folder: folder of the pickled Behaviors
+    :param names: names of the Behaviors to read, all if None
+    :param capabilities: capabilities of the Behaviors to read, all if None
+    :param executor: "thread" to read the files concurrently (I/O bound, e.g. network storage), "process" to
+                     also unpickle them in parallel, or None to read them sequentially
+    :param max_workers: maximum number of files read at once
+    :return: Behaviors, without 'predict_fn'
+    """
+    has_manifest = os.path.isfile(os.path.join(folder, MANIFEST))
+    if has_manifest:
+        manifest = read_manifest(folder)
+        if manifest.get("format") != "pickle":
+            raise ValueError(f"'{folder}' does not contain pickled Behaviors, use 'read_behaviors' for a "
+                             f"'{manifest.get('format')}' pack.")
+        files = [entry["file"] for entry in filter_entries(manifest["behaviors"], names, capabilities)]
+    else:
+        files = [f for f in os.listdir(folder) if f.endswith("pkl")]
+    paths = [os.path.join(folder, f) for f in files]
+
+    if executor is None or len(paths) <= 1:
+        behaviors = [_load_pickle(path) for path in paths]
+    else:
+        if executor not in EXECUTORS:
+            raise ValueError(f"Unknown executor '{executor}', expected one of {list(EXECUTORS)}.")
+        with EXECUTORS[executor](max_workers=max_workers) as pool:
+            behaviors = list(pool.map(_load_pickle, paths))
+
+    if not has_manifest:
+        kept = filter_entries([_manifest_entry(behavior) for behavior in behaviors], names, capabilities)
+        kept_names = {entry["name"] for entry in kept}
+        behaviors = [behavior for behavior in behaviors if behavior.name in kept_names]
+    return behaviors
+
+
+def _manifest_entry(behavior: Behavior) -> Dict[str, Any]:
+    """Metadata of a Behavior recorded in the manifest"""
+    return {
+        "class": behavior.__class__.__name__,
+        "capability": behavior.capability,
+        "name": behavior.name,
+        "test_type": behavior.test_type.value,
+        "task_type": behavior.task_type.value,
+        "description": behavior.description
+    }
+
+
+def _write_manifest(folder: str, format: str, entries: List[Dict[str, Any]]) -> None:
+    """"""
+    with open(os.path.join(folder, MANIFEST), "w") as writer:
+        json.dump({"format": format, "version": FORMAT_VERSION, "behaviors": entries}, writer)
+
+
+def read_manifest(folder: str) -> Dict[str, Any]:
+    """"""
+    with open(os.path.join(folder, MANIFEST)) as reader:
+        return json.load(reader)
+
+
+def filter_entries(entries: List[Dict[str, Any]], names: Optional[Iterable[str]] = None,
+                   capabilities: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+    """
+    :param entries: manifest entries of the Behaviors
+    :param names: names of the Behaviors to keep, all if None
+    :param capabilities: capabilities of the Behaviors to keep, all if None
+    :return: entries matching both filters
+    """
+    names = set(names) if names is not None else None
+    capabilities = set(capabilities) if capabilities is not None else None
+    return [
+        entry for entry in entries
+        if (names is None or entry["name"] in names) and (capabilities is None or entry["capability"] in capabilities)
+    ]
+
+
+def read_behaviors(folder: str, names: Optional[Iterable[str]] = None, capabilities: Optional[Iterable[str]] = None,
+                   mmap: bool = True) -> List[Behavior]:
+    """
+    Reads Behaviors written by 'write_behaviors'. Only the manifest is parsed: the samples and labels of each
+    Behavior are views over the memory-mapped columns, decoded when accessed.
+
+    :param folder: folder of the pack
+    :param names: names of the Behaviors to read, all if None
+    :param capabilities: capabilities of the Behaviors to read, all if None
+    :param mmap: whether to memory-map the columns instead of reading them in memory
+    :return: Behaviors, without 'predict_fn', in the order they were written
+    """
+    manifest = read_manifest(folder)
+    if manifest.get("format") != "columnar":
+        raise ValueError(f"'{folder}' does not contain a columnar pack.")
+
+    entries = filter_entries(manifest["behaviors"], names, capabilities)
+    if not entries:
+        return []
+
+    samples, labels = StringColumn(folder, "samples", mmap=mmap), JsonColumn(folder, "labels", mmap=mmap)
+    behaviors = []
+    for entry in entries:
+        behavior_labels = labels[entry["start"]:entry["stop"]]
+        behavior_labels.decoder = LABEL_DECODERS.get(TaskType(entry["task_type"]))
+        behavior_cls = getattr(behavior_module, entry["class"])
+        behaviors.append(behavior_cls(
+            capability=entry["capability"],
+            name=entry["name"],
+            test_type=BehaviorType(entry["test_type"]),
+            samples=samples[entry["start"]:entry["stop"]],
+            labels=behavior_labels,
+            description=entry["description"]
+        ))
+    return behaviors
@@ -1,2 +1,20 @@
-from .pt_dataloader import PyTorchTestPack
+from importlib import import_module
+from typing import TYPE_CHECKING
+
 from .testpack import TestPack
+
+if TYPE_CHECKING:
+    from .pt_dataloader import MappedPyTorchTestPack, PyTorchIterableTestPack, PyTorchTestPack
+
+# the PyTorch datasets are imported on first access, so that 'torch' is only loaded when they are used
+_LAZY_ATTRIBUTES = {
+    "MappedPyTorchTestPack": ".pt_dataloader",
+    "PyTorchIterableTestPack": ".pt_dataloader",
+    "PyTorchTestPack": ".pt_dataloader",
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        return getattr(import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
@@ -1,10 +1,13 @@
 import os.path
-from typing import Any, Callable, List, Optional
+from itertools import islice
+from typing import Any, Callable, Iterator, List, Optional
 
-from torch.utils.data import Dataset
+import numpy as np
+from torch.utils.data import Dataset, IterableDataset, get_worker_info
 
-from nhelper.behavior import Behavior
-from nhelper.types import BehaviorType
+from nhelper.storage import LABEL_DECODERS, MANIFEST, JsonColumn, StringColumn, filter_entries, read_behaviors, \
+    read_manifest, read_pickled_behaviors
+from nhelper.types import BehaviorType, TaskType
 from .testpack import TestPack
 
 
@@ -65,15 +68,28 @@ class PyTorchTestPack(Dataset):
         return cls(capabilities, names, test_types, texts, all_labels, processor)
 
     @classmethod
-    def from_saved_behaviors(cls, folder_path: str, processor: Callable = None):
-        """"""
+    def from_saved_behaviors(cls, folder_path: str, processor: Callable = None, names: Optional[List[str]] = None,
+                             capabilities: Optional[List[str]] = None, executor: Optional[str] = "thread",
+                             max_workers: Optional[int] = None, mmap: bool = True):
+        """
+        :param folder_path: folder of pickled Behaviors or of a columnar pack
+        :param processor: function applied to each item
+        :param names: names of the Behaviors to use, all if None
+        :param capabilities: capabilities of the Behaviors to use, all if None
+        :param executor: "thread", "process" or None, how pickled Behaviors are loaded (see 'read_pickled_behaviors')
+        :param max_workers: maximum number of pickled Behaviors loaded at once
+        :param mmap: whether to memory-map the samples and labels of a columnar pack
+        """
         assert os.path.isdir(folder_path), "Please provide a path to a folder."
 
-        files = [os.path.join(folder_path, f) for f in os.listdir(folder_path) if f.endswith(".pkl")]
+        if os.path.isfile(os.path.join(folder_path, MANIFEST)) and read_manifest(folder_path)["format"] == "columnar":
+            behaviors = read_behaviors(folder_path, names=names, capabilities=capabilities, mmap=mmap)
+        else:
+            behaviors = read_pickled_behaviors(folder_path, names=names, capabilities=capabilities,
+                                               executor=executor, max_workers=max_workers)
 
         capabilities, names, test_types, texts, all_labels = [], [], [], [], []
-        for f in files:
-            behavior = Behavior.from_file(f)
+        for behavior in behaviors:
             for sample, labels in zip(behavior.samples, behavior.labels):
                 capabilities.append(behavior.capability)
                 names.append(behavior.name)
@@ -81,3 +97,102 @@ class PyTorchTestPack(Dataset):
                 texts.append(sample)
                 all_labels.append(labels)
         return cls(capabilities, names, test_types, texts, all_labels, processor)
+
+
+class PyTorchIterableTestPack(IterableDataset):
+    """
+    Streaming counterpart of 'PyTorchTestPack': samples are read lazily from the Behaviors, so that
+    suites whose samples are generated on the fly never need to be held in memory. With several
+    DataLoader workers, each worker yields a disjoint (round-robin) share of the samples.
+    """
+
+    def __init__(self, testpack: TestPack, processor: Optional[Callable] = None):
+        """
+        :param testpack: TestPack whose Behaviors' samples and labels are iterated over
+        :param processor: function applied to each item
+        """
+        self.testpack = testpack
+        self.processor = processor
+
+    def _items(self) -> Iterator[dict]:
+        """"""
+        for behavior in self.testpack.behaviors:
+            for sample, labels in zip(behavior.samples, behavior.labels):
+                yield {
+                    "capability": behavior.capability,
+                    "name": behavior.name,
+                    "test_type": behavior.test_type.value,
+                    "text": sample,
+                    "labels": labels
+                }
+
+    def __iter__(self):
+        items = self._items()
+        worker_info = get_worker_info()
+        if worker_info is not None:
+            items = islice(items, worker_info.id, None, worker_info.num_workers)
+
+        for item in items:
+            yield self.processor(**item) if self.processor is not None else item
+
+    @classmethod
+    def from_testpack(cls, testpack: TestPack, processor: Callable = None):
+        """Constructs a streaming PyTorch Dataset from a TestPack"""
+        return cls(testpack, processor)
+
+
+class MappedPyTorchTestPack(Dataset):
+    """
+    Random-access counterpart of 'PyTorchTestPack' reading a columnar pack (see 'TestPack.to_file'). Texts and
+    labels stay in the memory-mapped buffers of the pack and the Behavior of each item is a small integer code,
+    so that no per-item Python object is allocated: DataLoader workers share the pages of the pack and their
+    memory does not grow with its size.
+    """
+
+    def __init__(self, folder: str, processor: Optional[Callable] = None, names: Optional[List[str]] = None,
+                 capabilities: Optional[List[str]] = None):
+        """
+        :param folder: folder of a columnar pack
+        :param processor: function applied to each item
+        :param names: names of the Behaviors to use, all if None
+        :param capabilities: capabilities of the Behaviors to use, all if None
+        """
+        manifest = read_manifest(folder)
+        if manifest.get("format") != "columnar":
+            raise ValueError(f"'{folder}' does not contain a columnar pack.")
+
+        self.folder = folder
+        self.processor = processor
+        self.behaviors = filter_entries(manifest["behaviors"], names, capabilities)
+        self.texts = StringColumn(folder, "samples")
+        self.labels = JsonColumn(folder, "labels")
+        self._decoders = [LABEL_DECODERS.get(TaskType(entry["task_type"])) for entry in self.behaviors]
+
+        # row of each item in the columns and code of its Behavior
+        starts = np.asarray([entry["start"] for entry in self.behaviors], dtype=np.int64)
+        lengths = np.asarray([entry["stop"] - entry["start"] for entry in self.behaviors], dtype=np.int64)
+        self.behavior_codes = np.repeat(np.arange(len(self.behaviors), dtype=np.min_scalar_type(len(self.behaviors))),
+                                        lengths)
+        self.rows = np.arange(lengths.sum(), dtype=np.int64) - np.repeat(np.cumsum(lengths) - lengths - starts,
+                                                                         lengths)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("Dataset index out of range")
+
+        row, code = int(self.rows[idx]), int(self.behavior_codes[idx])
+        behavior, decoder = self.behaviors[code], self._decoders[code]
+        labels = self.labels[row]
+        item = {
+            "capability": behavior["capability"],
+            "name": behavior["name"],
+            "test_type": behavior["test_type"],
+            "text": self.texts[row],
+            "labels": decoder(labels) if decoder is not None else labels
+        }
+        return self.processor(**item) if self.processor is not None else item
@@ -1,23 +1,53 @@
+import asyncio
+import json
+import logging
 import os
-from pathlib import Path
-from typing import Callable, List, Optional, Union
+from collections import defaultdict
+from concurrent.futures import Executor
+from contextlib import nullcontext
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 from nhelper.behavior import Behavior, BehaviorSet
+from nhelper.cache import PredictionCache
 from nhelper.performers import PerformerType
+from nhelper.profiling import Profiler, TimedPredictFn, profile_run
+from nhelper.scheduler import AsyncScheduler
+from nhelper.storage import MANIFEST, read_behaviors, read_manifest, read_pickled_behaviors, write_behaviors, \
+    write_pickled_behaviors
+from nhelper.utils import EXECUTORS, batched
+
+
+def _run_behavior(behavior: Behavior, profile: bool = False, **kwargs) -> Tuple[List[Any], Optional[Dict]]:
+    """
+    Runs a Behavior and returns its outputs, and its timings if profiled, so that they can be shipped back from
+    a worker process
+    """
+    if not profile:
+        behavior.run(**kwargs)
+        return behavior.outputs, None
+    _, timings = profile_run(behavior, partial(behavior.run, **kwargs))
+    return behavior.outputs, timings
 
 
 class TestPack(object):
     """A 'TestPack' is intended to centralize the different 'Behaviors' of a test suite."""
 
-    def __init__(self, behaviors: Optional[BehaviorSet] = None, performer: PerformerType = None):
+    def __init__(self, behaviors: Optional[BehaviorSet] = None, performer: PerformerType = None,
+                 profiler: Optional[Profiler] = None):
         """
 
         :param behaviors: a set of Behaviors to be added to the test suite
         :param performer: object to use to compute performance summary
+        :param profiler: object collecting the timings of the runs, nothing is timed if None
         """
         self.behaviors = behaviors if behaviors is not None else BehaviorSet()
         self.performer = performer
+        self.profiler = profiler
         self.outputs = []
+        self.errors = {}
+        self._fingerprints = {}
+        self._incremental = False
         self._is_ran = False
 
     @property
@@ -26,6 +56,26 @@ class TestPack(object):
             return None
         return self.performer.result
 
+    @property
+    def profile(self) -> Optional[Dict[str, Any]]:
+        """Timings of the last run (see 'Profiler.report'), None if not profiled"""
+        if not self._is_ran or self.profiler is None:
+            return None
+        return self.profiler.report()
+
+    def summary(self) -> Dict[str, Any]:
+        """Performance summary and timings of the last run"""
+        return {"result": self.result, "profile": self.profile}
+
+    def export(self, path: str) -> None:
+        """
+        Writes the performance summary and timings of the last run as JSON
+
+        :param path: path of the JSON file
+        """
+        with open(path, "w") as writer:
+            json.dump(self.summary(), writer, indent=2, default=str)
+
     def add(self, new_behaviors: Union[Behavior, List[Behavior]]) -> None:
         """
         Adds new Behavior(s) to the current test suite
@@ -37,55 +87,280 @@ class TestPack(object):
             new_behaviors = [new_behaviors]
         self.behaviors.update(new_behaviors)
 
-    def run(self) -> None:
+    def run(self, batch_size: Optional[int] = None, max_tokens: Optional[int] = None, fuse: bool = False,
+            cache: Optional[PredictionCache] = None, executor: Optional[Union[str, Executor]] = None,
+            max_workers: Optional[int] = None, stream: bool = False, incremental: bool = False) -> None:
         """
         Runs the different Behaviors
+
+        :param batch_size: maximum number of samples per call to a Behavior's 'predict_fn'
+        :param max_tokens: maximum number of (whitespace-separated) tokens per call to a Behavior's 'predict_fn'
+        :param fuse: whether to run all Behaviors sharing a 'predict_fn' in a single prediction pass over
+                     their deduplicated samples
+        :param cache: prediction cache consulted before calling the Behaviors' 'predict_fn'
+        :param executor: "thread", "process" or an 'Executor' instance used to run the Behaviors concurrently.
+                         A failing Behavior is then recorded in 'self.errors' and left out of the performance
+                         summary instead of interrupting the run. With "process" the Behaviors (including their
+                         'predict_fn') have to be picklable.
+        :param max_workers: maximum number of workers of the executor created from "thread" or "process"
+        :param stream: whether to feed the performer chunk by chunk without keeping the Behaviors' outputs, so that
+                       memory stays constant in the number of samples. Requires a performer supporting 'partial_fit'.
+        :param incremental: whether to only run the Behaviors added, modified or failed since the last incremental
+                            run, detected through their content hash (see 'Behavior.fingerprint'). The contributions
+                            of modified and removed Behaviors are replaced in the performer instead of refitting it.
+        """
+        if self._is_ran and not incremental:
+            raise ValueError("The 'TestPack' has already been ran.")
+        if sum([fuse, executor is not None, stream]) > 1:
+            raise ValueError("Only one of 'fuse', 'executor' and 'stream' can be used at a time.")
+
+        if self.profiler is not None:
+            self.profiler.reset()
+            self.profiler.start()
+        try:
+            if incremental:
+                with self._phase("changes"):
+                    behaviors, fingerprints = self._changed_behaviors()
+            else:
+                behaviors = list(self.behaviors)
+
+            with self._phase("run"):
+                if stream:
+                    for behavior in behaviors:
+                        self._profiled(behavior, partial(self._stream, behavior, batch_size, max_tokens, cache))
+                elif fuse:
+                    self._run_fused(behaviors, batch_size, max_tokens, cache)
+                elif executor is not None:
+                    self._run_parallel(behaviors, executor, max_workers, batch_size=batch_size,
+                                       max_tokens=max_tokens, cache=cache)
+                else:
+                    for behavior in behaviors:
+                        self._profiled(behavior, partial(behavior.run, batch_size=batch_size, max_tokens=max_tokens,
+                                                         cache=cache))
+
+            with self._phase("performer"):
+                succeeded = [behavior for behavior in behaviors if behavior.name not in self.errors]
+                if incremental:
+                    if not stream:
+                        self.performer.add(succeeded)
+                    self._fingerprints.update((behavior.name, fingerprints[behavior.name]) for behavior in succeeded)
+                elif not stream:
+                    self.performer.fit(succeeded)
+        finally:
+            if self.profiler is not None:
+                self.profiler.stop()
+
+        self.outputs = [None] * len(self.behaviors)
+        self._incremental = incremental
+        self._is_ran = True
+
+    def _stream(self, behavior: Behavior, batch_size: Optional[int], max_tokens: Optional[int],
+                cache: Optional[PredictionCache]) -> int:
+        """Feeds the performer with the outputs of a Behavior chunk by chunk and returns its number of outputs"""
+        n_outputs = 0
+        for outputs in behavior.stream(batch_size=batch_size, max_tokens=max_tokens, cache=cache):
+            self.performer.partial_fit(behavior, outputs)
+            n_outputs += len(outputs)
+        return n_outputs
+
+    def _phase(self, name: str):
+        """Context timing a phase of the run when profiling"""
+        return self.profiler.phase(name) if self.profiler is not None else nullcontext()
+
+    def _profiled(self, behavior: Behavior, run: Callable[[], Any]) -> None:
+        """Runs a Behavior, timing it when profiling"""
+        if self.profiler is None:
+            run()
+            return
+        n_outputs, timings = profile_run(behavior, run)
+        self.profiler.add_behavior(behavior.name, timings,
+                                   n_outputs if isinstance(n_outputs, int) else len(behavior.outputs))
+
+    def _changed_behaviors(self) -> Tuple[List[Behavior], Dict[str, str]]:
+        """
+        Finds the Behaviors to (re-)run incrementally and removes the contributions of the modified or removed
+        Behaviors from the performer.
+
+        :return: Behaviors to run, reset if needed, and the fingerprint of every Behavior
+        """
+        if self._is_ran and not self._incremental:
+            raise ValueError("The 'TestPack' can only be re-ran incrementally after an incremental run.")
+
+        fingerprints = {behavior.name: behavior.fingerprint() for behavior in self.behaviors}
+        stale = [name for name, fingerprint in self._fingerprints.items() if fingerprints.get(name) != fingerprint]
+        if stale:
+            self.performer.remove(stale)
+            for name in stale:
+                del self._fingerprints[name]
+
+        behaviors = [behavior for behavior in self.behaviors if behavior.name not in self._fingerprints]
+        for behavior in behaviors:
+            self.errors.pop(behavior.name, None)
+            if behavior._is_ran:
+                behavior.reset()
+        return behaviors, fingerprints
+
+    async def arun(self, batch_size: Optional[int] = None, max_tokens: Optional[int] = None,
+                   scheduler: Optional[AsyncScheduler] = None) -> None:
+        """
+        Runs the different Behaviors concurrently with asynchronous prediction functions. A failing Behavior
+        is recorded in 'self.errors' and left out of the performance summary.
+
+        :param batch_size: maximum number of samples per call to a Behavior's 'predict_fn'
+        :param max_tokens: maximum number of (whitespace-separated) tokens per call to a Behavior's 'predict_fn'
+        :param scheduler: object bounding, throttling and retrying the calls of all the Behaviors
         """
         if self._is_ran:
             raise ValueError("The 'TestPack' has already been ran.")
-        self.outputs = [behavior.run() for behavior in self.behaviors]
 
-        self.performer.fit(self.behaviors)
+        scheduler = scheduler if scheduler is not None else AsyncScheduler()
+        behaviors = list(self.behaviors)
+        if self.profiler is not None:
+            self.profiler.reset()
+            self.profiler.start()
+        try:
+            with self._phase("run"):
+                results = await asyncio.gather(
+                    *(behavior.arun(batch_size=batch_size, max_tokens=max_tokens, scheduler=scheduler)
+                      for behavior in behaviors),
+                    return_exceptions=True
+                )
+
+            self.outputs = []
+            for behavior, result in zip(behaviors, results):
+                if isinstance(result, Exception):
+                    logging.error(f"Behavior '{behavior.name}' failed: {result!r}")
+                    self.errors[behavior.name] = result
+                self.outputs.append(None)
+
+            with self._phase("performer"):
+                self.performer.fit([behavior for behavior in self.behaviors if behavior.name not in self.errors])
+        finally:
+            if self.profiler is not None:
+                self.profiler.stop()
         self._is_ran = True
 
-    def to_file(self, folder: str):
+    def _run_parallel(self, behaviors: List[Behavior], executor: Union[str, Executor],
+                      max_workers: Optional[int] = None, **kwargs) -> None:
+        """
+        Runs Behaviors concurrently, isolating the errors of each Behavior.
+
+        :param behaviors: Behaviors to run
+        :param executor: "thread", "process" or an 'Executor' instance
+        :param max_workers: maximum number of workers of the executor created from "thread" or "process"
+        :param kwargs: keyword arguments passed to 'Behavior.run'
         """
-        Saves the current Behaviors contained in the pack into pickle objects.
+        if isinstance(executor, str):
+            if executor not in EXECUTORS:
+                raise ValueError(f"Unknown executor '{executor}', expected one of {list(EXECUTORS)}.")
+            pool = EXECUTORS[executor](max_workers=max_workers)
+        else:
+            pool = executor
+
+        try:
+            futures = [pool.submit(_run_behavior, behavior, profile=self.profiler is not None, **kwargs)
+                       for behavior in behaviors]
+            for behavior, future in zip(behaviors, futures):
+                try:
+                    behavior.outputs, timings = future.result()
+                    behavior._is_ran = True
+                    if timings is not None:
+                        self.profiler.add_behavior(behavior.name, timings, len(behavior.outputs))
+                except Exception as e:
+                    logging.error(f"Behavior '{behavior.name}' failed: {e!r}")
+                    self.errors[behavior.name] = e
+        finally:
+            if pool is not executor:
+                pool.shutdown()
+
+    def _run_fused(self, behaviors: List[Behavior], batch_size: Optional[int] = None,
+                   max_tokens: Optional[int] = None, cache: Optional[PredictionCache] = None) -> None:
+        """
+        Gathers the samples of all Behaviors sharing a 'predict_fn', predicts each distinct text once
+        and scatters the predictions back to the Behaviors.
+
+        :param behaviors: Behaviors to run
+        :param batch_size: maximum number of distinct texts per call to 'predict_fn'
+        :param max_tokens: maximum number of (whitespace-separated) tokens per call to 'predict_fn'
+        :param cache: prediction cache consulted before calling 'predict_fn'
+        """
+        behaviors_per_fn = defaultdict(list)
+        for behavior in behaviors:
+            behaviors_per_fn[behavior.predict_fn].append(behavior)
+
+        for predict_fn, fn_behaviors in behaviors_per_fn.items():
+            timed = TimedPredictFn(predict_fn) if self.profiler is not None else None
+            if timed is not None:
+                predict_fn = timed
+            if cache is not None:
+                predict_fn = partial(cache.predict, predict_fn)
+            # texts are materialized once, lazy samples being consumed when iterated
+            behavior_texts = [behavior.texts() for behavior in fn_behaviors]
+            texts = list(dict.fromkeys(text for texts in behavior_texts for text in texts))
+
+            predictions = {}
+            with self._phase("predict"):
+                for batch in batched(texts, batch_size, max_tokens):
+                    predictions.update(zip(batch, predict_fn(batch)))
+            if timed is not None:
+                self.profiler.add_predict_calls(timed.wall, timed.batch_sizes)
+
+            with self._phase("outputs"):
+                for behavior, texts in zip(fn_behaviors, behavior_texts):
+                    self._profiled(behavior, partial(behavior.add_predictions,
+                                                     [predictions[text] for text in texts], texts))
+
+    def to_file(self, folder: str, format: str = "pickle"):
+        """
+        Saves the current Behaviors contained in the pack.
 
         :param folder: path to save the current TestPack
+        :param format: "pickle" for one pickle object per Behavior, or "columnar" for a single pack of
+                       contiguous samples and labels that can be memory-mapped and loaded selectively
         :return:
         """
-        Path(folder).mkdir(parents=True, exist_ok=True)
+        if format not in ("pickle", "columnar"):
+            raise ValueError(f"Unknown format '{format}', expected 'pickle' or 'columnar'.")
 
-        for behavior in self.behaviors:
-            behavior.to_file(folder)
+        if format == "columnar":
+            write_behaviors(self.behaviors, folder)
+        else:
+            write_pickled_behaviors(self.behaviors, folder)
 
     @classmethod
     def from_file(cls, folder: str, prediction_fns: Union[List[Callable], Callable] = None,
-                  performer: PerformerType = None):
+                  performer: PerformerType = None, names: Optional[List[str]] = None,
+                  capabilities: Optional[List[str]] = None, mmap: bool = True, executor: Optional[str] = "thread",
+                  max_workers: Optional[int] = None):
         """
         Loads a TestPack from a folder
 
         :param folder: path to the saved TestPack folder
         :param prediction_fns: function(s) to use to obtain predictions. Either pass a single function
-                               that will be used for all Behaviors or one per Behavior.
+                               that will be used for all Behaviors or one per (loaded) Behavior.
         :param performer: object to compute performance summary
+        :param names: names of the Behaviors to load, all if None
+        :param capabilities: capabilities of the Behaviors to load, all if None
+        :param mmap: whether to memory-map the samples and labels of a columnar pack
+        :param executor: "thread", "process" or None, how pickled Behaviors are loaded (see 'read_pickled_behaviors')
+        :param max_workers: maximum number of pickled Behaviors loaded at once
         :return: TestPack
         """
-        files = [f for f in os.listdir(folder) if f.endswith("pkl")]
+        if os.path.isfile(os.path.join(folder, MANIFEST)) and read_manifest(folder)["format"] == "columnar":
+            loaded_behaviors = read_behaviors(folder, names=names, capabilities=capabilities, mmap=mmap)
+        else:
+            loaded_behaviors = read_pickled_behaviors(folder, names=names, capabilities=capabilities,
+                                                      executor=executor, max_workers=max_workers)
 
         if isinstance(prediction_fns, list):
-            assert len(files) == len(prediction_fns), \
+            assert len(loaded_behaviors) == len(prediction_fns), \
                 "The number of prediction functions provided differs with the number of behaviors found"
         else:
-            prediction_fns = [prediction_fns, ] * len(files)
+            prediction_fns = [prediction_fns, ] * len(loaded_behaviors)
 
         behaviors = BehaviorSet()
-        for f, prediction_fn in zip(files, prediction_fns):
-            behavior = Behavior.from_file(
-                path_to_file=os.path.join(folder, f),
-                predict_fn=prediction_fn
-            )
+        for behavior, prediction_fn in zip(loaded_behaviors, prediction_fns):
+            behavior.predict_fn = prediction_fn
             behaviors.add(behavior)
 
         return cls(behaviors, performer)
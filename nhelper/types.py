@@ -1,5 +1,6 @@
+from collections import Counter
 from enum import Enum
-from typing import Union, List
+from typing import List, Tuple, Union
 
 from pydantic import BaseModel
 
@@ -26,32 +27,34 @@ class BinarySpan(BaseModel):
     text: str = None
     prob: float = None
 
+    @property
+    def key(self) -> Tuple:
+        """Identity of the span used for comparisons"""
+        return self.start, self.end
+
     def __str__(self):
-        return str(self.start) + "_" + str(self.end)
+        return "_".join(str(elt) for elt in self.key)
 
     def __hash__(self):
-        return hash(str(self))
+        return hash(self.key)
 
     def __lt__(self, other):
-        return str(self) < str(other)
+        return self.key < other.key
 
     def __eq__(self, other):
         if other.__class__ is self.__class__:
-            return str(self.start) + "_" + str(self.end) == \
-                   str(other.start) + "_" + str(other.end)
+            return self.key == other.key
+        return NotImplemented
 
 
 class Span(BinarySpan):
     """Representation of a 'Span' object for span classification tasks"""
     label: Union[Union[str, int], List[Union[str, int]]]
 
-    def __str__(self):
-        return str(self.start) + "_" + str(self.end) + "_" + str(self.label)
-
-    def __eq__(self, other):
-        if other.__class__ is self.__class__:
-            return str(self.start) + "_" + str(self.end) + "_" + str(self.label) == \
-                   str(other.start) + "_" + str(other.end) + "_" + str(other.label)
+    @property
+    def key(self) -> Tuple:
+        """Identity of the span used for comparisons, labels being compared through their string form"""
+        return self.start, self.end, str(self.label)
 
     def to_binary(self):
         """"""
@@ -74,16 +77,14 @@ class SpanClassificationOutput(BaseModel):
         if len(self.y) != len(self.y_pred):
             return False
 
-        return sorted(self.y) == sorted(self.y_pred)
+        return Counter(span.key for span in self.y) == Counter(span.key for span in self.y_pred)
 
     @property
     def binary_success(self):
         if len(self.y) != len(self.y_pred):
             return False
 
-        binary_y = [span.to_binary() for span in self.y]
-        binary_y_pred = [span.to_binary() for span in self.y_pred]
-        return sorted(binary_y_pred) == sorted(binary_y)
+        return Counter(span.key[:2] for span in self.y) == Counter(span.key[:2] for span in self.y_pred)
 
 
 class SequenceClassificationOutput(BaseModel):
@@ -103,6 +104,34 @@ class TargetedSequenceClassificationOutput(SequenceClassificationOutput):
     target: str
 
 
+class PairedSequenceClassificationOutput(BaseModel):
+    """
+    Output of a sequence classification model on a perturbed sample and on its original. 'y' is the expected
+    shift of the probability from the original to the perturbed sample: 0 (invariance, same predicted label),
+    1 (increase) or -1 (decrease).
+    """
+    text: str
+    original: str
+    y_pred: Union[str, int]
+    y_pred_prob: float = None
+    original_y_pred: Union[str, int]
+    original_y_pred_prob: float = None
+    y: int
+    tolerance: float = 0.
+
+    @property
+    def shift(self):
+        if self.y_pred_prob is None or self.original_y_pred_prob is None:
+            return None
+        return self.y_pred_prob - self.original_y_pred_prob
+
+    @property
+    def success(self):
+        if self.y == 0:
+            return self.y_pred == self.original_y_pred and (self.shift is None or abs(self.shift) <= self.tolerance)
+        return self.shift is not None and self.y * self.shift >= -self.tolerance
+
+
 class MultiLabelSequenceClassificationOutput(BaseModel):
     """"""
     text: str
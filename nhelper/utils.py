@@ -0,0 +1,43 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, List, Optional
+
+EXECUTORS = {
+    "thread": ThreadPoolExecutor,
+    "process": ProcessPoolExecutor
+}
+
+
+def count_tokens(text: str) -> int:
+    """Approximates the number of tokens of a text by its number of whitespace-separated words"""
+    return len(text.split())
+
+
+def batched(items: Iterable[Any], batch_size: Optional[int] = None, max_tokens: Optional[int] = None,
+            length_fn: Callable[[Any], int] = count_tokens) -> Iterator[List[Any]]:
+    """
+    Splits items into consecutive batches bounded in size and/or in number of tokens.
+    An item longer than 'max_tokens' is yielded in a batch of its own.
+
+    :param items: items to batch
+    :param batch_size: maximum number of items per batch, unbounded if None
+    :param max_tokens: maximum number of tokens per batch, unbounded if None
+    :param length_fn: function returning the number of tokens of an item
+    :return: iterator over the batches
+    """
+    if batch_size is not None and batch_size < 1:
+        raise ValueError(f"'batch_size' should be a positive integer, got {batch_size}.")
+    if max_tokens is not None and max_tokens < 1:
+        raise ValueError(f"'max_tokens' should be a positive integer, got {max_tokens}.")
+
+    batch, n_tokens = [], 0
+    for item in items:
+        item_tokens = length_fn(item) if max_tokens is not None else 0
+        if batch and ((batch_size is not None and len(batch) >= batch_size) or
+                      (max_tokens is not None and n_tokens + item_tokens > max_tokens)):
+            yield batch
+            batch, n_tokens = [], 0
+        batch.append(item)
+        n_tokens += item_tokens
+
+    if batch:
+        yield batch
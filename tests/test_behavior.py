@@ -1,11 +1,14 @@
+import pickle
 import random
 from typing import List
 
 import pytest
 
-from nhelper.behavior import MultiLabelSequenceClassificationBehavior, SequenceClassificationBehavior, \
-    SpanClassificationBehavior, TokenClassificationBehavior
-from nhelper.types import BehaviorType, Span, Token
+from nhelper.behavior import MultiLabelSequenceClassificationBehavior, PairedSequenceClassificationBehavior, \
+    SequenceClassificationBehavior, SpanClassificationBehavior, TokenClassificationBehavior
+from nhelper.outputs import OutputStore
+from nhelper.types import BehaviorType, PairedSequenceClassificationOutput, Span, SpanClassificationOutput, Token, \
+    TokenClassificationOutput
 
 
 @pytest.fixture
@@ -71,6 +74,53 @@ class TestSequenceClassificationBehavior:
 
         assert output0 == output1
 
+    def test_load_legacy(self, tmp_path, text_sample, random_class):
+        """"""
+        behavior = SequenceClassificationBehavior(
+            capability="Capability 1",
+            name="Test legacy",
+            test_type=BehaviorType.invariance,
+            samples=[text_sample] * 3,
+            labels=[random_class] * 3
+        )
+        # outputs as pickled by the previous versions of 'to_file'
+        behavior.outputs = []
+        with open(tmp_path / "legacy.pkl", "wb") as writer:
+            pickle.dump(behavior, writer)
+
+        new_behavior = SequenceClassificationBehavior.from_file(str(tmp_path / "legacy.pkl"), self.predict_fn)
+        assert isinstance(new_behavior.outputs, OutputStore)
+        new_behavior.run()
+        assert len(new_behavior.outputs) == 3
+
+    def test_run_batched(self, text_sample, random_class):
+        """"""
+        n_samples = 10
+        batch_sizes = []
+
+        def predict_fn(list_text: List[str]):
+            batch_sizes.append(len(list_text))
+            return [random_class] * len(list_text)
+
+        behavior = SequenceClassificationBehavior(
+            capability="Capability 1",
+            name="Test batched sequence classification",
+            test_type=BehaviorType.invariance,
+            samples=[text_sample] * n_samples,
+            labels=[random_class] * n_samples,
+            predict_fn=predict_fn
+        )
+        behavior.run(batch_size=4)
+        assert batch_sizes == [4, 4, 2]
+        assert len(behavior.outputs) == n_samples
+        assert all([b.success for b in behavior.outputs])
+
+        behavior.reset()
+        batch_sizes.clear()
+        behavior.run(max_tokens=3 * len(text_sample.split()))
+        assert batch_sizes == [3, 3, 3, 1]
+        assert len(behavior.outputs) == n_samples
+
 
 class TestMultiLabelSequenceClassificationBehavior:
     """"""
@@ -124,6 +174,78 @@ class TestMultiLabelSequenceClassificationBehavior:
         assert output0 == output1
 
 
+class TestPairedSequenceClassificationBehavior:
+    """"""
+
+    @staticmethod
+    def predict_fn(list_text: List[str]):
+        # probability of the positive class grows with the number of "good"
+        probs = [min(0.25 + 0.25 * text.split().count("good"), 1.) for text in list_text]
+        return [(int(prob > 0.5), [1 - prob, prob]) for prob in probs]
+
+    def test_invariance(self):
+        """"""
+        calls = []
+
+        def predict_fn(list_text):
+            calls.append(list(list_text))
+            return self.predict_fn(list_text)
+
+        behavior = PairedSequenceClassificationBehavior(
+            capability="Capability 1",
+            name="Test invariance",
+            test_type=BehaviorType.invariance,
+            originals=["a good movie"] * 3,
+            samples=["a good film", "a good good movie", "a good picture"],
+            predict_fn=predict_fn,
+            target=1,
+            tolerance=0.1
+        )
+        behavior.run()
+
+        assert calls == [["a good movie", "a good film", "a good good movie", "a good picture"]]
+        assert behavior.outputs.success().tolist() == [True, False, True]
+        assert [output.success for output in behavior.outputs] == [True, False, True]
+        assert behavior.outputs[1] == PairedSequenceClassificationOutput(
+            text="a good good movie", original="a good movie", y_pred=1, y_pred_prob=0.75, original_y_pred=0,
+            original_y_pred_prob=0.5, y=0, tolerance=0.1
+        )
+
+    def test_directional(self):
+        """"""
+        behavior = PairedSequenceClassificationBehavior(
+            capability="Capability 1",
+            name="Test directional",
+            test_type=BehaviorType.directional,
+            originals=["a movie", "a movie", "a good movie"],
+            samples=["a good movie", "a bad movie", "a movie"],
+            labels=[1, 1, -1],
+            predict_fn=self.predict_fn,
+            target=1
+        )
+        behavior.run(batch_size=2)
+
+        assert behavior.outputs.shifts().tolist() == [0.25, 0., -0.25]
+        assert behavior.outputs.success().tolist() == [True, True, True]
+        assert behavior.fingerprint() != PairedSequenceClassificationBehavior(
+            capability="Capability 1",
+            name="Test directional",
+            test_type=BehaviorType.directional,
+            originals=["a movie", "a good movie", "a good movie"],
+            samples=["a good movie", "a bad movie", "a movie"],
+            labels=[1, 1, -1]
+        ).fingerprint()
+
+        with pytest.raises(ValueError):
+            PairedSequenceClassificationBehavior(
+                capability="Capability 1",
+                name="Test directional",
+                test_type=BehaviorType.directional,
+                originals=["a movie"],
+                samples=["a good movie"]
+            )
+
+
 class TestSpanClassificationBehavior:
     """"""
 
@@ -172,6 +294,56 @@ class TestSpanClassificationBehavior:
 
         assert output0 == output1
 
+    def test_lazy_outputs(self, text_sample):
+        """"""
+        behavior = SpanClassificationBehavior(
+            capability="Capability 1",
+            name="Test lazy span classification",
+            test_type=BehaviorType.invariance,
+            samples=[text_sample] * 3,
+            labels=[[Span(start=0, end=10, label=1)], [], [Span(start=20, end=30, label=1)]],
+            predict_fn=lambda x: [[(0, 10, None, 0.9, 1)], [], [(0, 10, None, 0.8, 1)]]
+        )
+        behavior.run()
+
+        assert isinstance(behavior.outputs, OutputStore)
+        assert behavior.outputs[0] == SpanClassificationOutput(
+            text=text_sample,
+            y_pred=[Span(start=0, end=10, prob=0.9, label=1)],
+            y=[Span(start=0, end=10, label=1)]
+        )
+        assert behavior.outputs.success().tolist() == [output.success for output in behavior.outputs] == \
+               [True, True, False]
+
+    def test_span_matching(self, text_sample):
+        """"""
+        labels = [
+            [Span(start=0, end=2, label=1), Span(start=5, end=9, label=0), Span(start=5, end=9, label=0)],
+            [Span(start=0, end=2, label=1), Span(start=5, end=9, label=0)],
+            [Span(start=0, end=2, label=1)],
+            [Span(start=0, end=2, label="1")]
+        ]
+        predictions = [
+            [(5, 9, None, None, 0), (0, 2, None, None, 1), (5, 9, None, None, 0)],
+            [(5, 9, None, None, 1), (0, 2, None, None, 1)],
+            [(0, 2, None, None, 1), (0, 2, None, None, 1)],
+            [(0, 2, None, None, 1)]
+        ]
+        behavior = SpanClassificationBehavior(
+            capability="Capability 1",
+            name="Test span matching",
+            test_type=BehaviorType.invariance,
+            samples=[text_sample] * len(labels),
+            labels=labels,
+            predict_fn=lambda x: predictions
+        )
+        behavior.run()
+
+        assert behavior.outputs.success().tolist() == [output.success for output in behavior.outputs] == \
+               [True, False, False, True]
+        assert behavior.outputs.success(binarize=True).tolist() == \
+               [output.binary_success for output in behavior.outputs] == [True, True, False, True]
+
 
 class TestTokenClassificationBehavior:
     """"""
@@ -231,3 +403,24 @@ class TestTokenClassificationBehavior:
         output1 = behavior.outputs
 
         assert output0 == output1
+
+    def test_lazy_outputs(self, text_sample):
+        """"""
+        behavior = TokenClassificationBehavior(
+            capability="Capability 1",
+            name="Test lazy token classification",
+            test_type=BehaviorType.invariance,
+            samples=[text_sample] * 2,
+            labels=[[0, 1, 0], [Token(pos=0, label=1), Token(pos=1, prob=0.5, label=0)]],
+            predict_fn=lambda x: [[0, 1, 0], [Token(pos=0, label=1), Token(pos=1, label=0)]]
+        )
+        behavior.run()
+
+        assert isinstance(behavior.outputs, OutputStore)
+        assert behavior.outputs[-1] == TokenClassificationOutput(
+            text=text_sample,
+            y_pred=[Token(pos=0, label=1), Token(pos=1, label=0)],
+            y=[Token(pos=0, label=1), Token(pos=1, prob=0.5, label=0)]
+        )
+        assert behavior.outputs.success().tolist() == [output.success for output in behavior.outputs] == \
+               [True, False]
@@ -0,0 +1,47 @@
+import json
+import tracemalloc
+
+from benchmarks.run import SCENARIOS, Phases, compare, main, run_benchmarks
+
+
+class TestBenchmarks:
+    """"""
+
+    def test_run_benchmarks(self):
+        """"""
+        results = run_benchmarks(list(SCENARIOS), [10, 20], trace_memory=True, batch_size=8, n_tokens=16)
+
+        assert [(result["scenario"], result["n_samples"]) for result in results["results"]] == \
+               [(name, n_samples) for name in SCENARIOS for n_samples in (10, 20)]
+        sequence = results["results"][0]
+        assert set(sequence["phases"]) == {"build", "run", "predict", "outputs", "success", "fit"}
+        assert sequence["phases"]["run"]["peak_memory"] > 0
+        assert sequence["throughput"] > 0
+        assert "Ratio" in compare(results, results)
+
+    def test_phases_tracing(self):
+        """"""
+        phases = Phases(trace_memory=True)
+        with phases.phase("alone"):
+            [0] * 100000
+        assert phases.timings["alone"]["peak_memory"] > 0
+        assert not tracemalloc.is_tracing()
+
+        # tracing started by the caller is left on, and the peak is that of the phase only
+        tracemalloc.start()
+        try:
+            [0] * 1000000
+            with phases.phase("traced"):
+                [0] * 100000
+            assert tracemalloc.is_tracing()
+        finally:
+            tracemalloc.stop()
+        assert phases.timings["traced"]["peak_memory"] < 2 * phases.timings["alone"]["peak_memory"]
+
+    def test_main(self, tmp_path, capsys):
+        """"""
+        output = tmp_path / "results.json"
+        main(["--scenarios", "generate", "--samples", "10", "--repeat", "1", "--output", str(output)])
+
+        assert json.loads(output.read_text())["results"][0]["scenario"] == "generate"
+        assert "generate_pos" in capsys.readouterr().out
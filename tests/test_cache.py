@@ -0,0 +1,71 @@
+import pytest
+
+from nhelper.behavior import SequenceClassificationBehavior
+from nhelper.cache import PredictionCache
+from nhelper.types import BehaviorType
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / "cache.sqlite")
+
+
+class TestPredictionCache:
+    """"""
+
+    def test_predict(self, cache_path):
+        """"""
+        calls = []
+
+        def predict_fn(list_text):
+            calls.append(list(list_text))
+            return [len(text) for text in list_text]
+
+        cache = PredictionCache(cache_path, fingerprint="model-v1")
+        assert cache.predict(predict_fn, ["a", "bb", "a"]) == [1, 2, 1]
+        assert cache.predict(predict_fn, ["bb", "ccc"]) == [2, 3]
+        assert calls == [["a", "bb"], ["ccc"]]
+        assert cache.stats == {"hits": 1, "misses": 3, "size": 3}
+
+        # predictions are persisted on disk and scoped to the model fingerprint
+        assert PredictionCache(cache_path, fingerprint="model-v1").get(["a", "ccc"]) == {"a": 1, "ccc": 3}
+        assert PredictionCache(cache_path, fingerprint="model-v2").get(["a", "ccc"]) == {}
+
+    def test_lru_eviction(self, cache_path):
+        """"""
+        cache = PredictionCache(cache_path, fingerprint="model-v1", max_size=2)
+        cache.put({"a": 1})
+        cache.put({"b": 2})
+        cache.get(["a"])
+        cache.put({"c": 3})
+
+        assert len(cache) == 2
+        assert cache.get(["a", "b", "c"]) == {"a": 1, "c": 3}
+
+    def test_behavior_run(self, cache_path):
+        """"""
+        calls = []
+
+        def predict_fn(list_text):
+            calls.extend(list_text)
+            return [1, ] * len(list_text)
+
+        def make_behavior():
+            return SequenceClassificationBehavior(
+                capability="Capability 1",
+                name="Test cached sequence classification",
+                test_type=BehaviorType.invariance,
+                samples=["This is a test", "This is a 2nd test"],
+                labels=[1, 0],
+                predict_fn=predict_fn
+            )
+
+        cache = PredictionCache(cache_path, fingerprint="model-v1")
+        behavior = make_behavior()
+        behavior.run(cache=cache)
+        new_behavior = make_behavior()
+        new_behavior.run(cache=cache)
+
+        assert len(calls) == 2
+        assert [output.success for output in new_behavior.outputs] == [True, False]
+        assert cache.hits == 2
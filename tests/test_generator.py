@@ -66,6 +66,22 @@ class TestGenerator:
         )
         assert generations == ["Hey my name is jules a", "Hey my name is james b", "Hey my name is john c"]
 
+    def test_generate_positions(self):
+        """"""
+        generations, positions = Generator.generate(
+            templates=["The {animal} ate {food}", "{food}: eaten by the {animal}"],
+            return_pos=True,
+            animal=["cat", "ant"],
+            food=["the fish", "plants"]
+        )
+        assert generations == ["The cat ate the fish", "the fish: eaten by the cat", "The ant ate plants",
+                               "plants: eaten by the ant"]
+        for text, text_positions in zip(generations, positions):
+            for start, end, label, word in text_positions:
+                assert text[start:end] == word
+        # "ant" appears in "plants" before the slot, positions are the slot's
+        assert positions[3] == [(21, 24, "animal", "ant"), (0, 6, "food", "plants")]
+
     def test_generate_bad_inputs(self):
         """"""
         generator = Generator()
@@ -76,3 +92,60 @@ class TestGenerator:
                 name=["jules"],
                 family_name=["a", "b", "c"]
             )
+
+    def test_iter_generate(self):
+        """"""
+        kwargs = {"name": ["jules", "james", "john"], "family_name": ["a", "b"]}
+        generations = Generator.generate(templates="Hey my name is {name} {family_name}", generate_all=True, **kwargs)
+        assert list(Generator.iter_generate("Hey my name is {name} {family_name}", generate_all=True, **kwargs)) == \
+               generations
+        assert generations[:2] == ["Hey my name is jules a", "Hey my name is jules b"]
+
+        shards = [
+            list(Generator.iter_generate("Hey my name is {name} {family_name}", generate_all=True, _shard=(i, 4),
+                                         **kwargs))
+            for i in range(4)
+        ]
+        assert [text for shard in shards for text in shard] == generations
+
+        # the last shard of 10^12 combinations starts at once, without enumerating the previous ones
+        large = {keyword: [str(i) for i in range(1000)] for keyword in ("a", "b", "c", "d")}
+        last_shard = Generator.iter_generate("{a} {b} {c} {d}", generate_all=True, _shard=(999, 1000), **large)
+        assert next(last_shard) == "999 0 0 0"
+        assert next(last_shard) == "999 0 0 1"
+
+        samples = list(Generator.iter_generate("Hey my name is {name} {family_name}", generate_all=True,
+                                               _n_samples=3, _seed=0, **kwargs))
+        assert len(samples) == len(set(samples)) == 3
+        assert set(samples) <= set(generations)
+        assert samples == list(Generator.iter_generate("Hey my name is {name} {family_name}", generate_all=True,
+                                                       _n_samples=3, _seed=0, **kwargs))
+
+    def test_generate_reserved_names(self):
+        """"""
+        generations = Generator.generate(templates="{seed} {shard} {n_samples}", seed=["a", "b"], shard=["c", "d"],
+                                         n_samples=["e", "f"])
+        assert generations == ["a c e", "b d f"]
+
+    def test_cached_translate(self, tmp_path):
+        """"""
+        calls = []
+
+        def translator_pipeline(templates, batch_size=None, num_workers=None):
+            calls.append(list(templates))
+            return [{"generated_text": template.upper()} for template in templates]
+
+        def make_generator():
+            generator = Generator(cache_size=2, cache_path=str(tmp_path / "cache.sqlite"))
+            generator.translator_model_name = "upper"
+            generator.translator_pipeline = translator_pipeline
+            return generator
+
+        generator = make_generator()
+        assert generator.translate(["a", "b", "a"]) == ["A", "B", "A"]
+        assert generator.translate(["b", "c"]) == ["B", "C"]
+        assert calls == [["a", "b"], ["c"]]
+
+        # results are persisted on disk and reused by a new Generator
+        assert make_generator().translate(["a", "c"]) == ["A", "C"]
+        assert len(calls) == 2
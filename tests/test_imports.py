@@ -0,0 +1,39 @@
+import subprocess
+import sys
+
+HEAVY_MODULES = ("torch", "transformers", "pytorch_lightning")
+
+
+def run_python(code: str) -> str:
+    return subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout
+
+
+class TestImports:
+    """"""
+
+    def test_lazy_imports(self):
+        """"""
+        loaded = run_python(
+            "import sys\n"
+            "import nhelper.behavior, nhelper.generator, nhelper.performers, nhelper.testpack\n"
+            f"print(','.join(module for module in {HEAVY_MODULES} if module in sys.modules))"
+        )
+        assert loaded.strip() == ""
+
+    def test_lazy_attributes(self):
+        """"""
+        loaded = run_python(
+            "import sys\n"
+            "from nhelper.testpack import PyTorchTestPack\n"
+            "print('torch' in sys.modules, PyTorchTestPack.__name__)"
+        )
+        assert loaded.split() == ["True", "PyTorchTestPack"]
+
+    def test_package_import(self):
+        """"""
+        loaded = run_python(
+            "import sys\n"
+            "import nhelper\n"
+            f"print(','.join(module for module in {HEAVY_MODULES} if module in sys.modules))"
+        )
+        assert loaded.strip() == ""
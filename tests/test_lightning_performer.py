@@ -0,0 +1,66 @@
+import socket
+
+import pytest
+
+pl = pytest.importorskip("pytorch_lightning")
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from nhelper.performers import LightningPerformer
+
+
+class Trainer:
+    """Minimal stand-in for the 'pl.Trainer' passed to the callback hooks"""
+    loggers = []
+
+
+def run_lightning_performer(batches):
+    performer = LightningPerformer(initial_capacity=1)
+    performer.on_test_start(Trainer(), pl.LightningModule())
+    for batch_idx, (batch, outputs) in enumerate(batches):
+        performer.on_test_batch_end(Trainer(), pl.LightningModule(), outputs, batch, batch_idx)
+    performer.on_test_end(Trainer(), pl.LightningModule())
+    return performer.result
+
+
+def make_batch(names, capability, labels):
+    return {"name": names, "capability": [capability] * len(names), "test_type": ["invariance"] * len(names),
+            "labels": torch.tensor(labels)}
+
+
+def run_distributed(rank, world_size, port, results):
+    dist.init_process_group("gloo", init_method=f"tcp://127.0.0.1:{port}", rank=rank, world_size=world_size)
+    batches = [(make_batch(["Test a", "Test b"], "Capability 1", [1, 0]), torch.tensor([1, 1]))] if rank == 0 else \
+        [(make_batch(["Test c"], "Capability 2", [1]), torch.tensor([0]))]
+    results[rank] = run_lightning_performer(batches)
+    dist.destroy_process_group()
+
+
+class TestLightningPerformer:
+    """"""
+
+    def test_batched_metadata(self):
+        """"""
+        result = run_lightning_performer([
+            (make_batch(["Test a", "Test a", "Test b"], "Capability 1", [1, 0, 1]), torch.tensor([1, 1, 1])),
+            (make_batch(["Test c", "Test b"], "Capability 2", [0, 0]), torch.tensor([0, 1])),
+        ])
+        assert result["Total"] == [0.6, "3/5"]
+        assert result["Name - Test a"] == [0.5, "1/2"]
+        assert result["Name - Test b"] == [0.5, "1/2"]
+        assert result["Capability - Capability 2"] == [0.5, "1/2"]
+        assert result["Behavior type - invariance"] == [0.6, "3/5"]
+
+    def test_distributed(self):
+        """"""
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+
+        results = mp.Manager().dict()
+        mp.start_processes(run_distributed, args=(2, port, results), nprocs=2, start_method="fork")
+        assert results[0] == results[1]
+        assert results[0]["Total"] == [1 / 3, "1/3"]
+        assert results[0]["Capability - Capability 2"] == [0.0, "0/1"]
@@ -1,4 +1,8 @@
-from nhelper.behavior import SequenceClassificationBehavior, SpanClassificationBehavior, TokenClassificationBehavior
+import numpy as np
+import pytest
+
+from nhelper.behavior import MultiLabelSequenceClassificationBehavior, SequenceClassificationBehavior, \
+    SpanClassificationBehavior, TokenClassificationBehavior
 from nhelper.performers import Performer
 from nhelper.types import BehaviorType, Span, Token
 
@@ -143,3 +147,232 @@ class TestPerformer:
         assert performer.result[f"Behavior type - {BehaviorType.invariance.value}"] == \
                performer.result[f"Name - {token_classification_behavior.name}"] == [0, '0/1']
         assert performer.result["Total"] == [1 / 3, '1/3']
+
+    def test_columns(self):
+        """"""
+        behaviors = [
+            SequenceClassificationBehavior(
+                capability=f"Capability {i % 2}",
+                name=f"Test sequence classification {i}",
+                test_type=BehaviorType.invariance,
+                samples=["This is a test"] * (i + 1),
+                labels=[1] * (i + 1),
+                predict_fn=lambda x: [1, 0] * (len(x) // 2) + [1] * (len(x) % 2)
+            ) for i in range(4)
+        ]
+        performer = Performer()
+        performer.fit(behaviors)
+
+        assert performer.categories["capability"] == ["Capability 0", "Capability 1"]
+        assert performer.columns["capability"].tolist() == [0, 1, 1, 0, 0, 0, 1, 1, 1, 1]
+        assert performer.columns["success"].tolist() == [True, True, False, True, False, True, True, False, True,
+                                                         False]
+        assert performer.result["Capability - Capability 0"] == [0.75, "3/4"]
+        assert performer.result["Capability - Capability 1"] == [0.5, "3/6"]
+        assert performer.result["Total"] == [0.6, "6/10"]
+
+    @pytest.mark.parametrize("span_match, iou_threshold, binarize, expected", [
+        ("exact", 0.5, False, [0.0, 0.0, 0.0]),
+        ("overlap", 0.5, False, [1 / 3, 0.5, 0.4]),
+        ("iou", 0.5, False, [1 / 3, 0.5, 0.4]),
+        ("iou", 0.9, False, [0.0, 0.0, 0.0]),
+        ("overlap", 0.5, True, [2 / 3, 1.0, 0.8]),
+    ])
+    def test_span_metrics(self, span_match, iou_threshold, binarize, expected):
+        """"""
+        span_classification_behavior = SpanClassificationBehavior(
+            capability="Capability 1",
+            name="Test span classification",
+            test_type=BehaviorType.invariance,
+            samples=["This is a test"],
+            labels=[[Span(start=0, end=10, label=1), Span(start=20, end=30, label=2)]],
+            predict_fn=lambda x: [[(0, 8, None, None, 1), (20, 30, None, None, 1), (40, 45, None, None, 1)]]
+        )
+        seq_classification_behavior = SequenceClassificationBehavior(
+            capability="Capability 2",
+            name="Test sequence classification",
+            test_type=BehaviorType.invariance,
+            samples=["This is a test"],
+            labels=[1],
+            predict_fn=lambda x: [1] * len(x)
+        )
+        performer = Performer(binarize=binarize, span_match=span_match, iou_threshold=iou_threshold)
+        performer.fit([span_classification_behavior, seq_classification_behavior])
+
+        assert performer.span_result["Total"] == pytest.approx(expected)
+        assert performer.span_result[f"Name - {span_classification_behavior.name}"] == pytest.approx(expected)
+        assert "F1" in performer.tabulate_result()
+
+    def test_group_by(self):
+        """"""
+        behaviors = [
+            SequenceClassificationBehavior(
+                capability=f"Capability {i % 2}",
+                name=f"Test sequence classification {i}",
+                test_type=BehaviorType.invariance if i < 2 else BehaviorType.directional,
+                samples=["This is a test"] * 4,
+                labels=[0, 1, 1, 1],
+                predict_fn=lambda x: [(1, 0.5), (1, 0.5), (1, 1.0), (0, 1.0)]
+            ) for i in range(3)
+        ]
+        performer = Performer(group_by=[("capability", "test_type"), "label"], confidence_weighted=True)
+        performer.fit(behaviors)
+
+        assert list(performer.result) == [
+            "Total",
+            "Capability × Behavior type - Capability 0 × invariance",
+            "Capability × Behavior type - Capability 1 × invariance",
+            "Capability × Behavior type - Capability 0 × directional",
+            "Label - 0",
+            "Label - 1"
+        ]
+        assert performer.result["Capability × Behavior type - Capability 0 × directional"] == [0.5, "2/4"]
+        assert performer.result["Label - 0"] == [0.0, "0/3"]
+        assert performer.result["Label - 1"] == [2 / 3, "6/9"]
+        assert performer.confidence_result["Total"] == pytest.approx(1.5 / 3)
+        assert "Conf. acc" in performer.tabulate_result()
+
+    def test_group_by_label_mixed_tasks(self):
+        """"""
+        span_behavior = SpanClassificationBehavior(
+            capability="Capability 1",
+            name="Test span classification",
+            test_type=BehaviorType.invariance,
+            samples=["This is a test"],
+            labels=[[Span(start=0, end=4, label=1)]],
+            predict_fn=lambda x: [[Span(start=0, end=4, label=1)]] * len(x)
+        )
+        seq_behavior = SequenceClassificationBehavior(
+            capability="Capability 1",
+            name="Test sequence classification",
+            test_type=BehaviorType.invariance,
+            samples=["This is a test"] * 3,
+            labels=[0, 1, 2],
+            predict_fn=lambda x: [0, 0, 2]
+        )
+        multilabel_behavior = MultiLabelSequenceClassificationBehavior(
+            capability="Capability 1",
+            name="Test multi-label classification",
+            test_type=BehaviorType.invariance,
+            samples=["This is a test"] * 2,
+            labels=[[1, 0], [0, 1]],
+            predict_fn=lambda x: [[1, 0], [1, 1]]
+        )
+        performer = Performer(group_by=["label"])
+        performer.fit([span_behavior, seq_behavior, multilabel_behavior])
+
+        assert performer.result["Total"] == [0.6666666666666666, "4/6"]
+        assert set(performer.result) == {"Total", "Label - 0", "Label - 1", "Label - 2"}
+        assert performer.result["Label - 0"] == [1.0, "1/1"]
+        assert performer.result["Label - 1"] == [0.0, "0/1"]
+        assert performer.result["Label - 2"] == [1.0, "1/1"]
+
+    def test_macro(self):
+        """"""
+        behaviors = [
+            SequenceClassificationBehavior(
+                capability="Capability 1",
+                name=f"Test sequence classification {n_samples}",
+                test_type=BehaviorType.invariance,
+                samples=["This is a test"] * n_samples,
+                labels=[1] + [0] * (n_samples - 1),
+                predict_fn=lambda x: [1] * len(x)
+            ) for n_samples in (1, 4)
+        ]
+        performer = Performer(metric_type="macro")
+        performer.fit(behaviors)
+
+        assert performer.result["Total"] == [(1.0 + 0.25) / 2, "2/5"]
+        assert performer.result["Name - Test sequence classification 4"] == [0.25, "1/4"]
+        with pytest.raises(ValueError):
+            Performer(metric_type="micro")
+
+    def test_token_metrics(self):
+        """"""
+        behavior = TokenClassificationBehavior(
+            capability="Capability 1",
+            name="Test token metrics",
+            test_type=BehaviorType.invariance,
+            samples=["This is a test !", "A test ."],
+            labels=[[0, 1, 1, 0, 2], [2, 2, 0]],
+            predict_fn=lambda x: [[0, 1, 1, 0, 0], [2, 0, 0]]
+        )
+        performer = Performer(token_metrics=True)
+        performer.fit([behavior])
+
+        assert performer.result["Total"] == [0.0, "0/2"]
+        accuracy, precision, recall, f1 = performer.token_result["Total"]
+        assert accuracy == 6 / 8
+        assert (precision, recall, f1) == pytest.approx((1 / 2, 1 / 3, 0.4))
+        assert "Entity F1" in performer.tabulate_result()
+
+        labels, matrix = behavior.outputs.confusion_matrix()
+        assert labels == [0, 1, 2]
+        assert matrix.tolist() == [[3, 0, 0], [0, 2, 0], [2, 0, 1]]
+        assert behavior.outputs[0].y_pred[1] == Token(pos=1, label=1)
+
+    def test_class_metrics(self):
+        """"""
+        sequence_behavior = SequenceClassificationBehavior(
+            capability="Capability 1",
+            name="Test class metrics",
+            test_type=BehaviorType.invariance,
+            samples=["This is a test"] * 5,
+            labels=["a", "a", "b", "b", "c"],
+            predict_fn=lambda x: ["a", "b", "b", "b", "a"]
+        )
+        multilabel_behavior = MultiLabelSequenceClassificationBehavior(
+            capability="Capability 2",
+            name="Test multi-label class metrics",
+            test_type=BehaviorType.invariance,
+            samples=["This is a test"] * 2,
+            labels=[[1, 0, 1], [0, 1, 0]],
+            predict_fn=lambda x: [[1, 0, 0], [0, 1, 0]]
+        )
+        performer = Performer(class_metrics=True)
+        performer.fit([sequence_behavior, multilabel_behavior])
+
+        labels, matrix = performer.confusion_matrix
+        assert labels == ["a", "b", "c"]
+        assert matrix.tolist() == [[1, 1, 0], [0, 2, 0], [1, 0, 0]]
+        assert performer.class_result["single-label"]["a"] == pytest.approx([0.5, 0.5, 0.5, 2])
+        assert performer.class_result["single-label"]["b"] == pytest.approx([2 / 3, 1., 0.8, 2])
+        assert performer.class_result["multi-label"][2] == pytest.approx([np.nan, 0., np.nan, 1], nan_ok=True)
+
+        assert performer.multilabel_result["Name - Test multi-label class metrics"] == [1 / 6, 0.5]
+        assert performer.multilabel_result["Total"] == [1 / 6, 0.5]
+        assert np.isnan(performer.multilabel_result["Name - Test class metrics"]).all()
+        assert "Hamming loss" in performer.tabulate_result()
+        assert "Support" in performer.tabulate_classes()
+
+        performer.remove(["Test multi-label class metrics"])
+        assert "multi-label" not in performer.class_result
+        assert performer.confusion_matrix[1].sum() == 5
+
+    def test_class_metrics_namespaces(self):
+        """"""
+        sequence_behavior = SequenceClassificationBehavior(
+            capability="Capability 1",
+            name="Test class namespaces",
+            test_type=BehaviorType.invariance,
+            samples=["This is a test"] * 4,
+            labels=[0, 0, 2, 10],
+            predict_fn=lambda x: [0, 0, 2, 10]
+        )
+        multilabel_behavior = MultiLabelSequenceClassificationBehavior(
+            capability="Capability 1",
+            name="Test multi-label class namespaces",
+            test_type=BehaviorType.invariance,
+            samples=["This is a test"] * 2,
+            labels=[[1, 0], [1, 0]],
+            predict_fn=lambda x: [[0, 0], [1, 0]]
+        )
+        performer = Performer(class_metrics=True)
+        performer.fit([sequence_behavior, multilabel_behavior])
+
+        assert list(performer.class_result["single-label"]) == ["0", "2", "10"]
+        assert performer.class_result["single-label"]["0"] == [1., 1., 1., 2]
+        assert performer.class_result["multi-label"][0] == pytest.approx([1., 0.5, 2 / 3, 2])
+        assert performer.confusion_matrix[0] == ["0", "2", "10"]
+        assert "multi-label" in performer.tabulate_classes()
+
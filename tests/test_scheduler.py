@@ -0,0 +1,204 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from nhelper.behavior import SequenceClassificationBehavior
+from nhelper.performers import Performer
+from nhelper.scheduler import AsyncScheduler, RateLimiter
+from nhelper.testpack import TestPack
+from nhelper.types import BehaviorType
+
+
+class InferenceServer:
+    """Local stand-in for an inference server: predicts the number of words of each text of a request,
+    fails the first 'n_failures' requests and records the maximum number of requests in flight."""
+
+    def __init__(self, n_failures: int = 0, latency: float = 0.01):
+        self.n_failures = n_failures
+        self.latency = latency
+        self.n_requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.server = None
+
+    async def handle(self, reader, writer):
+        texts = json.loads(await reader.readline())
+        self.n_requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.latency)
+        self.in_flight -= 1
+
+        if self.n_failures > 0:
+            self.n_failures -= 1
+            writer.write(b"error\n")
+        else:
+            writer.write(json.dumps([len(text.split()) for text in texts]).encode() + b"\n")
+        await writer.drain()
+        writer.close()
+
+    async def predict(self, texts):
+        reader, writer = await asyncio.open_connection(*self.server.sockets[0].getsockname()[:2])
+        writer.write(json.dumps(texts).encode() + b"\n")
+        await writer.drain()
+        response = await reader.readline()
+        writer.close()
+        return json.loads(response)
+
+    async def __aenter__(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return self
+
+    async def __aexit__(self, *args):
+        self.server.close()
+        await self.server.wait_closed()
+
+
+def make_behavior(name, predict_fn, n_samples=8):
+    return SequenceClassificationBehavior(
+        capability="Capability 1",
+        name=name,
+        test_type=BehaviorType.invariance,
+        samples=["one two three"] * n_samples,
+        labels=[3] * n_samples,
+        predict_fn=predict_fn
+    )
+
+
+class TestAsyncScheduler:
+    """"""
+
+    def test_behavior_arun(self):
+        """"""
+        async def main():
+            async with InferenceServer(n_failures=1) as server:
+                behavior = make_behavior("Test async", server.predict)
+                scheduler = AsyncScheduler(max_concurrency=2, retries=2, backoff=0.01)
+                await behavior.arun(batch_size=2, scheduler=scheduler)
+                return behavior, scheduler, server
+
+        behavior, scheduler, server = asyncio.run(main())
+        assert len(behavior.outputs) == 8
+        assert all(output.success for output in behavior.outputs)
+        assert server.n_requests == 5
+        assert server.max_in_flight == 2
+        assert scheduler.n_retries == 1
+
+    def test_behavior_arun_bounded(self):
+        """"""
+        pulled, lags = [], []
+
+        def samples():
+            for i in range(20):
+                pulled.append(i)
+                yield "one two three"
+
+        async def predict_fn(texts):
+            lags.append(len(pulled) - len(behavior.outputs))
+            await asyncio.sleep(0.001)
+            return [3] * len(texts)
+
+        behavior = SequenceClassificationBehavior(
+            capability="Capability 1",
+            name="Test async bounded",
+            test_type=BehaviorType.invariance,
+            samples=samples(),
+            labels=(3 for _ in range(20)),
+            predict_fn=predict_fn
+        )
+        asyncio.run(behavior.arun(batch_size=1, scheduler=AsyncScheduler(max_concurrency=2)))
+
+        assert len(behavior.outputs) == 20
+        assert all(output.success for output in behavior.outputs)
+        assert max(lags) <= 4
+
+    def test_behavior_arun_slow_head(self, monkeypatch):
+        """"""
+        n_waits = []
+        wait = asyncio.wait
+
+        async def counted_wait(*args, **kwargs):
+            n_waits.append(1)
+            return await wait(*args, **kwargs)
+
+        async def predict_fn(texts):
+            if texts == ["0"]:
+                await asyncio.sleep(0.2)
+            return [int(text) for text in texts]
+
+        behavior = SequenceClassificationBehavior(
+            capability="Capability 1",
+            name="Test async slow head",
+            test_type=BehaviorType.invariance,
+            samples=[str(i) for i in range(4)],
+            labels=list(range(4)),
+            predict_fn=predict_fn
+        )
+        monkeypatch.setattr(asyncio, "wait", counted_wait)
+        asyncio.run(behavior.arun(batch_size=1, scheduler=AsyncScheduler(max_concurrency=4)))
+
+        assert [output.y_pred for output in behavior.outputs] == ["0", "1", "2", "3"]
+        # the chunks finished before the head one are not waited for again
+        assert len(n_waits) <= 4
+
+    def test_behavior_arun_cancelled(self):
+        """"""
+        calls, completed = [], []
+
+        async def predict_fn(texts):
+            calls.append(texts)
+            if len(calls) == 1:
+                raise ValueError("Unknown model")
+            await asyncio.sleep(0.05)
+            completed.append(texts)
+            return [3] * len(texts)
+
+        async def main():
+            behavior = make_behavior("Test async cancelled", predict_fn)
+            with pytest.raises(ValueError):
+                await behavior.arun(batch_size=1, scheduler=AsyncScheduler(max_concurrency=4))
+            await asyncio.sleep(0.1)
+
+        asyncio.run(main())
+        assert len(calls) > 1
+        assert completed == []
+
+    def test_testpack_arun(self):
+        """"""
+        async def broken_predict_fn(texts):
+            raise ValueError("Unknown model")
+
+        async def main():
+            async with InferenceServer() as server:
+                testpack = TestPack(performer=Performer())
+                testpack.add([make_behavior(f"Test async {i}", server.predict) for i in range(3)])
+                testpack.add(make_behavior("Test async broken", broken_predict_fn))
+                await testpack.arun(batch_size=4, scheduler=AsyncScheduler(max_concurrency=3))
+                return testpack, server
+
+        testpack, server = asyncio.run(main())
+        assert list(testpack.errors) == ["Test async broken"]
+        assert server.max_in_flight <= 3
+        assert testpack.result["Total"] == [1.0, "24/24"]
+
+    def test_retries_exhausted(self):
+        """"""
+        async def predict_fn(texts):
+            raise ConnectionError("Server unavailable")
+
+        behavior = make_behavior("Test async failure", predict_fn)
+        with pytest.raises(ConnectionError):
+            asyncio.run(behavior.arun(scheduler=AsyncScheduler(retries=1, backoff=0.)))
+
+    def test_rate_limiter(self):
+        """"""
+        async def main():
+            limiter = RateLimiter(rate=50, burst=1)
+            start = time.monotonic()
+            for _ in range(6):
+                await limiter.acquire()
+            return time.monotonic() - start
+
+        assert asyncio.run(main()) >= 5 / 50 * 0.9
@@ -1,9 +1,16 @@
+import json
+import pickle
+
 import pytest
+from torch.utils.data import DataLoader
 
-from nhelper.behavior import DuplicateBehaviorError, SequenceClassificationBehavior
+from nhelper.behavior import Behavior, DuplicateBehaviorError, PairedSequenceClassificationBehavior, \
+    SequenceClassificationBehavior, SpanClassificationBehavior
 from nhelper.performers import Performer
-from nhelper.testpack import PyTorchTestPack, TestPack
-from nhelper.types import BehaviorType
+from nhelper.profiling import Profiler
+from nhelper.storage import read_pickled_behaviors
+from nhelper.testpack import MappedPyTorchTestPack, PyTorchIterableTestPack, PyTorchTestPack, TestPack
+from nhelper.types import BehaviorType, Span
 
 
 @pytest.fixture
@@ -30,6 +37,14 @@ def seq_classification_behavior2():
     )
 
 
+def predict_ones(list_text):
+    return [1, ] * len(list_text)
+
+
+def predict_unavailable(list_text):
+    raise RuntimeError("Model unavailable")
+
+
 @pytest.fixture
 def performer():
     return Performer()
@@ -59,6 +74,211 @@ class TestTestPack:
         with pytest.raises(ValueError):
             testpack.run()
 
+    def test_run_fused(self, performer):
+        """"""
+        calls = []
+
+        def predict_fn(list_text):
+            calls.append(list(list_text))
+            return [1, ] * len(list_text)
+
+        testpack = TestPack(performer=performer)
+        testpack.add([
+            SequenceClassificationBehavior(
+                capability="Capability 1",
+                name="Test fused 1",
+                test_type=BehaviorType.invariance,
+                samples=["TEST", "OTHER"],
+                labels=[1, 2],
+                predict_fn=predict_fn
+            ),
+            SequenceClassificationBehavior(
+                capability="Capability 2",
+                name="Test fused 2",
+                test_type=BehaviorType.invariance,
+                samples=["TEST", "TEST", "THIRD"],
+                labels=[1, 1, 1],
+                predict_fn=predict_fn
+            )
+        ])
+        testpack.run(fuse=True)
+
+        assert len(calls) == 1
+        assert sorted(calls[0]) == ["OTHER", "TEST", "THIRD"]
+        assert all(len(behavior.outputs) == len(behavior.samples) for behavior in testpack.behaviors)
+        assert testpack.result["Total"] == [0.8, "4/5"]
+
+    def test_run_fused_paired(self, performer):
+        """"""
+        calls = []
+
+        def predict_fn(list_text):
+            calls.append(list(list_text))
+            return [(1, 0.5 + 0.1 * text.count("!")) for text in list_text]
+
+        testpack = TestPack(performer=performer)
+        testpack.add([
+            SequenceClassificationBehavior(
+                capability="Capability 1",
+                name="Test fused sequence",
+                test_type=BehaviorType.minimum_functionality,
+                samples=["TEST"],
+                labels=[1],
+                predict_fn=predict_fn
+            ),
+            PairedSequenceClassificationBehavior(
+                capability="Capability 2",
+                name="Test fused paired",
+                test_type=BehaviorType.directional,
+                originals=["TEST", "TEST"],
+                samples=["TEST !", "TEST ?"],
+                labels=1,
+                predict_fn=predict_fn
+            )
+        ])
+        testpack.run(fuse=True)
+
+        assert len(calls) == 1
+        assert sorted(calls[0]) == ["TEST", "TEST !", "TEST ?"]
+        assert testpack.result["Name - Test fused paired"] == [1.0, "2/2"]
+
+    @pytest.mark.parametrize("executor", ["thread", "process"])
+    def test_run_parallel(self, executor, performer):
+        """"""
+        behaviors = [
+            SequenceClassificationBehavior(
+                capability="Capability 1",
+                name=f"Test parallel {i}",
+                test_type=BehaviorType.invariance,
+                samples=["TEST"] * (i + 1),
+                labels=[1] * (i + 1),
+                predict_fn=predict_ones
+            ) for i in range(4)
+        ]
+        broken_behavior = SequenceClassificationBehavior(
+            capability="Capability 2",
+            name="Test parallel broken",
+            test_type=BehaviorType.invariance,
+            samples=["TEST"],
+            labels=[1],
+            predict_fn=predict_unavailable
+        )
+        testpack = TestPack(performer=performer)
+        testpack.add(behaviors + [broken_behavior])
+        testpack.run(executor=executor, max_workers=2)
+
+        assert list(testpack.errors) == ["Test parallel broken"]
+        assert isinstance(testpack.errors["Test parallel broken"], RuntimeError)
+        assert str(testpack.errors["Test parallel broken"]) == "Model unavailable"
+        assert all(len(behavior.outputs) == len(behavior.samples) for behavior in behaviors)
+        assert testpack.result["Total"] == [1.0, "10/10"]
+
+    def test_run_stream(self, performer):
+        """"""
+        def generate(n, modulo):
+            for j in range(n):
+                yield f"sample {j}", j % modulo
+
+        def make_behaviors(lazy):
+            behaviors = []
+            for i in range(3):
+                samples = (sample for sample, _ in generate(10 * (i + 1), i + 2))
+                labels = (label for _, label in generate(10 * (i + 1), i + 2))
+                behaviors.append(SequenceClassificationBehavior(
+                    capability=f"Capability {i % 2}",
+                    name=f"Test stream {i}",
+                    test_type=BehaviorType.invariance,
+                    samples=samples if lazy else list(samples),
+                    labels=labels if lazy else list(labels),
+                    predict_fn=lambda x: [int(text.split()[1]) % 2 for text in x]
+                ))
+            return behaviors
+
+        testpack = TestPack(performer=performer)
+        testpack.add(make_behaviors(lazy=True))
+        testpack.run(batch_size=4, stream=True)
+        assert all(len(behavior.outputs) == 0 for behavior in testpack.behaviors)
+
+        eager_testpack = TestPack(performer=Performer())
+        eager_testpack.add(make_behaviors(lazy=False))
+        eager_testpack.run()
+        assert testpack.result == eager_testpack.result
+
+        fused_testpack = TestPack(performer=Performer())
+        fused_testpack.add(make_behaviors(lazy=True))
+        fused_testpack.run(batch_size=4, fuse=True)
+        assert fused_testpack.result == eager_testpack.result
+
+    def test_run_incremental(self, performer):
+        """"""
+        calls = []
+
+        def predict_fn(list_text):
+            calls.extend(list_text)
+            return [1, ] * len(list_text)
+
+        def make_behavior(i, labels):
+            return SequenceClassificationBehavior(
+                capability=f"Capability {i % 2}",
+                name=f"Test incremental {i}",
+                test_type=BehaviorType.invariance,
+                samples=[f"Sample {i}.{j}" for j in range(len(labels))],
+                labels=labels,
+                predict_fn=predict_fn
+            )
+
+        behaviors = [make_behavior(i, [1, 1]) for i in range(3)]
+        testpack = TestPack(performer=performer)
+        testpack.add(behaviors)
+        testpack.run(incremental=True)
+        assert len(calls) == 6
+
+        # a new and a modified Behavior are the only ones re-ran, a removed one is subtracted
+        calls.clear()
+        behaviors[0].labels = [1, 0]
+        testpack.behaviors.remove(behaviors[2])
+        testpack.add(make_behavior(3, [0]))
+        testpack.run(incremental=True)
+        assert sorted(calls) == ["Sample 0.0", "Sample 0.1", "Sample 3.0"]
+
+        calls.clear()
+        testpack.run(incremental=True)
+        assert calls == []
+
+        expected = TestPack(performer=Performer())
+        expected.add([make_behavior(0, [1, 0]), make_behavior(1, [1, 1]), make_behavior(3, [0])])
+        expected.run()
+        assert testpack.result == expected.result
+        assert "Name - Test incremental 2" not in testpack.result
+
+    def test_run_incremental_retry_failures(self, performer):
+        """"""
+        def broken_predict_fn(list_text):
+            raise RuntimeError("Model unavailable")
+
+        behavior = SequenceClassificationBehavior(
+            capability="Capability 1",
+            name="Test incremental failure",
+            test_type=BehaviorType.invariance,
+            samples=["TEST"],
+            labels=[1],
+            predict_fn=broken_predict_fn
+        )
+        testpack = TestPack(performer=performer)
+        testpack.add(behavior)
+        testpack.run(incremental=True, executor="thread")
+        assert list(testpack.errors) == ["Test incremental failure"]
+
+        behavior.predict_fn = predict_ones
+        testpack.run(incremental=True, executor="thread")
+        assert testpack.errors == {}
+        assert testpack.result["Total"] == [1.0, "1/1"]
+
+        with pytest.raises(ValueError):
+            not_incremental = TestPack(performer=Performer())
+            not_incremental.run()
+            not_incremental.run(incremental=True)
+
     def test_save_and_load(self, seq_classification_behavior, seq_classification_behavior2, performer):
         """"""
         testpack = TestPack(performer=performer)
@@ -77,6 +297,115 @@ class TestTestPack:
 
         assert outputs1 == outputs2
 
+    @pytest.mark.parametrize("mode", [{}, {"fuse": True}, {"executor": "thread"}, {"executor": "process"},
+                                      {"stream": True}])
+    def test_run_profiled(self, mode):
+        """"""
+        testpack = TestPack(performer=Performer(), profiler=Profiler())
+        testpack.add([
+            SequenceClassificationBehavior(
+                capability="Capability 1",
+                name=f"Test profiled {i}",
+                test_type=BehaviorType.invariance,
+                samples=[f"TEST {j}" for j in range(5)],
+                labels=[1] * 5,
+                predict_fn=predict_ones
+            ) for i in range(2)
+        ])
+        testpack.run(batch_size=2, **mode)
+
+        profile = testpack.profile
+        assert {"run", "performer"} <= set(profile["phases"])
+        assert set(profile["behaviors"]) == {"Test profiled 0", "Test profiled 1"}
+        assert all(timings["n_samples"] == 5 for timings in profile["behaviors"].values())
+        if mode.get("fuse"):
+            assert profile["predict"]["n_predict_calls"] == 3
+        else:
+            assert profile["behaviors"]["Test profiled 0"]["n_predict_calls"] == 3
+            assert profile["behaviors"]["Test profiled 0"]["max_batch_size"] == 2
+            assert profile["predict"]["n_predict_calls"] == 6
+
+    def test_export_profile(self, tmp_path, seq_classification_behavior):
+        """"""
+        testpack = TestPack(performer=Performer(), profiler=Profiler(cprofile=True, trace_memory=True, top=5))
+        testpack.add(seq_classification_behavior)
+        assert testpack.profile is None
+        testpack.run()
+
+        testpack.export(str(tmp_path / "summary.json"))
+        summary = json.loads((tmp_path / "summary.json").read_text())
+        assert summary["result"]["Total"] == [1.0, "1/1"]
+        assert "cumulative" in summary["profile"]["cprofile"]
+        assert summary["profile"]["memory"]["peak"] > 0
+        assert TestPack(performer=Performer()).summary()["profile"] is None
+
+    @pytest.mark.parametrize("executor", [None, "thread", "process"])
+    def test_load_parallel(self, tmp_path, executor):
+        """"""
+        testpack = TestPack()
+        testpack.add([
+            SequenceClassificationBehavior(
+                capability=f"Capability {i % 3}",
+                name=f"Test saved {i}",
+                test_type=BehaviorType.invariance,
+                samples=[f"Sample {i}"],
+                labels=[i]
+            ) for i in range(9)
+        ])
+        testpack.to_file(str(tmp_path))
+
+        loaded = TestPack.from_file(str(tmp_path), predict_ones, capabilities=["Capability 1"], executor=executor,
+                                    max_workers=2)
+        assert sorted(behavior.name for behavior in loaded.behaviors) == ["Test saved 1", "Test saved 4",
+                                                                          "Test saved 7"]
+        assert all(behavior.predict_fn is predict_ones for behavior in loaded.behaviors)
+
+        # folders saved without a manifest are listed and filtered once loaded
+        (tmp_path / "manifest.json").unlink()
+        loaded = TestPack.from_file(str(tmp_path), names=["Test saved 2"], executor=executor)
+        assert [list(behavior.samples) for behavior in loaded.behaviors] == [["Sample 2"]]
+
+    def test_save_and_load_columnar(self, tmp_path, seq_classification_behavior, performer):
+        """"""
+        span_behavior = SpanClassificationBehavior(
+            capability="Capability 2",
+            name="Test span classification",
+            test_type=BehaviorType.invariance,
+            samples=["My name is Jules", "Jüles lives in Paris"],
+            labels=[[Span(start=11, end=16, label="PER")], [Span(start=0, end=5, label="PER"),
+                                                            Span(start=15, end=20, label="LOC")]],
+            predict_fn=lambda x: [[(11, 16, "Jules", None, "PER")], [(0, 5, "Jüles", None, "PER")]]
+        )
+        testpack = TestPack(performer=performer)
+        testpack.add([seq_classification_behavior, span_behavior])
+        testpack.to_file(str(tmp_path), format="columnar")
+
+        loaded = TestPack.from_file(str(tmp_path), seq_classification_behavior.predict_fn, Performer(),
+                                    capabilities=["Capability 1"])
+        assert [behavior.name for behavior in loaded.behaviors] == [seq_classification_behavior.name]
+
+        loaded = TestPack.from_file(str(tmp_path), names=[span_behavior.name])
+        behavior, = loaded.behaviors
+        assert isinstance(behavior, SpanClassificationBehavior)
+        assert list(behavior.samples) == span_behavior.samples
+        assert list(behavior.labels) == span_behavior.labels
+
+        # the samples are memory-mapped views, pickled by reference to the pack
+        assert list(pickle.loads(pickle.dumps(behavior.samples))) == span_behavior.samples
+
+        # but are materialized when the Behavior is saved alone, so that its file is self-contained
+        pickled = Behavior.from_file(behavior.to_file(str(tmp_path / "pickled")))
+        assert pickled.samples == span_behavior.samples
+        assert pickled.labels == span_behavior.labels
+
+        with pytest.raises(ValueError, match="does not contain pickled Behaviors"):
+            read_pickled_behaviors(str(tmp_path))
+
+        behavior.predict_fn = span_behavior.predict_fn
+        behavior.run()
+        span_behavior.run()
+        assert behavior.outputs == span_behavior.outputs
+
 
 class TestPyTorchTestPack:
     """"""
@@ -135,3 +464,42 @@ class TestPyTorchTestPack:
 
         assert sorted([elt for elt in pt_testpack2], key=lambda d: d["name"]) == \
                sorted([elt for elt in pt_testpack], key=lambda d: d["name"])
+
+    def test_from_columnar_behaviors(self, tmp_path, seq_classification_behavior, seq_classification_behavior2):
+        """"""
+        testpack = TestPack()
+        testpack.add([seq_classification_behavior, seq_classification_behavior2])
+        testpack.to_file(str(tmp_path), format="columnar")
+
+        pt_testpack = PyTorchTestPack.from_saved_behaviors(str(tmp_path), processor=self.identity)
+        assert [elt for elt in pt_testpack] == [elt for elt in PyTorchTestPack.from_testpack(testpack, self.identity)]
+
+        pt_testpack = PyTorchTestPack.from_saved_behaviors(str(tmp_path), capabilities=["Capability 2"])
+        assert [elt["labels"] for elt in pt_testpack] == [2]
+
+    def test_iterable(self, seq_classification_behavior, seq_classification_behavior2):
+        """"""
+        testpack = TestPack()
+        testpack.add([seq_classification_behavior, seq_classification_behavior2])
+
+        pt_testpack = PyTorchTestPack.from_testpack(testpack, self.identity)
+        pt_iterable_testpack = PyTorchIterableTestPack.from_testpack(testpack, self.identity)
+
+        assert sorted([elt for elt in pt_iterable_testpack], key=lambda d: d["name"]) == \
+               sorted([elt for elt in pt_testpack], key=lambda d: d["name"])
+
+    def test_memory_mapped(self, tmp_path, seq_classification_behavior, seq_classification_behavior2):
+        """"""
+        testpack = TestPack()
+        testpack.add([seq_classification_behavior, seq_classification_behavior2])
+        testpack.to_file(str(tmp_path), format="columnar")
+
+        pt_testpack = PyTorchTestPack.from_testpack(testpack, self.identity)
+        mapped_testpack = MappedPyTorchTestPack(str(tmp_path), processor=self.identity)
+        assert len(mapped_testpack) == len(pt_testpack)
+        assert sorted([elt for elt in mapped_testpack], key=lambda d: d["name"]) == \
+               sorted([elt for elt in pt_testpack], key=lambda d: d["name"])
+
+        mapped_testpack = MappedPyTorchTestPack(str(tmp_path), capabilities=["Capability 2"])
+        loader = DataLoader(mapped_testpack, batch_size=None, num_workers=2)
+        assert [item["labels"] for item in loader] == [2]